@@ -0,0 +1,265 @@
+#####################################################
+# Vectorized analytics over minutes and dates
+#####################################################
+# Usage (needs numpy):
+# python3 analytics.py --by employee [--by month] [--from 01/01/2016] \
+#     [--to 12/31/2016] [--employee Beth] [--percentile 50 --percentile 90]
+#
+# EntryColumns.load reads the id, employee id, task id, spent minutes and
+# day of every matching entry in one query straight into numpy arrays, 24
+# bytes per entry, instead of building a model object per entry. Names and
+# tasks stay dictionary encoded as their ids until results are labelled.
+#
+# Group-by sums, counts, percentiles, histograms and outliers are computed
+# with array operations over every group at once. Groupings are the ones
+# of reports.py: employee, task, day, week, month, plus year.
+import argparse
+import datetime
+import itertools
+
+import numpy
+from peewee import Cast, fn
+
+from entry import Entry, Employee, Task
+import worklog_db
+
+
+COLUMNS = [('id', 'i8'), ('employee', 'i4'), ('task', 'i4'),
+           ('minutes', 'i4'), ('day', 'i4')]
+FETCH_SIZE = 4096
+GROUPINGS = ('employee', 'task', 'day', 'week', 'month', 'year')
+# Julian day number of 1970-01-01
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+def day_number(timestamp):
+    """Days since 1970-01-01 of the date part of a timestamp, which is
+    stored as either 'YYYY-MM-DD' or a full datetime string"""
+    return Cast(fn.julianday(fn.substr(timestamp, 1, 10)) -
+                UNIX_EPOCH_JULIAN_DAY, 'INTEGER')
+
+
+class EntryColumns(object):
+    def __init__(self, ids, employees, tasks, minutes, days, employee_names,
+                 task_names):
+        self.ids = ids
+        self.employees = employees
+        self.tasks = tasks
+        self.minutes = minutes
+        self.days = days
+        self.employee_names = employee_names
+        self.task_names = task_names
+
+    @classmethod
+    def load(cls, query=None):
+        """Load the entries matched by query, a worklog_db.filter_entries
+        query, or every entry"""
+        if query is None:
+            query = Entry.select()
+        query = query.select(
+            Entry.id, Entry.employee, Entry.task_ref, Entry.spent_minutes,
+            day_number(Entry.timestamp)).order_by().tuples()
+        # The query's own database, as for a partition, else Entry's
+        database = query._database or Entry._meta.database
+        cursor = database.execute(query)
+        batches = iter(lambda: cursor.fetchmany(FETCH_SIZE), [])
+        rows = numpy.fromiter(itertools.chain.from_iterable(batches),
+                              dtype=COLUMNS)
+        return cls(rows['id'].copy(), rows['employee'].copy(),
+                   rows['task'].copy(), rows['minutes'].copy(),
+                   rows['day'].copy(), names(Employee, database),
+                   names(Task, database))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (
+            self.ids, self.employees, self.tasks, self.minutes, self.days))
+
+    def where(self, mask):
+        """The entries selected by a boolean array"""
+        return EntryColumns(self.ids[mask], self.employees[mask],
+                            self.tasks[mask], self.minutes[mask],
+                            self.days[mask], self.employee_names,
+                            self.task_names)
+
+    def dates(self):
+        return self.days.astype('datetime64[D]')
+
+    ########################################################
+    # Grouping
+    ########################################################
+    def group_codes(self, name):
+        """An integer array with one code per entry for the grouping"""
+        if name == 'employee':
+            return self.employees
+        if name == 'task':
+            return self.tasks
+        if name == 'day':
+            return self.days
+        dates = self.dates()
+        years = dates.astype('datetime64[Y]')
+        if name == 'year':
+            return years.astype('i4') + 1970
+        if name == 'month':
+            return dates.astype('datetime64[M]').astype('i4')
+        if name == 'week':
+            # strftime's %W: weeks start on Monday, and the days before the
+            # first Monday of the year are week 0
+            day_of_year = (dates - years.astype('datetime64[D]')).astype('i4')
+            weekday = (self.days + 3) % 7
+            week = (day_of_year + 7 - weekday) // 7
+            return (years.astype('i4') + 1970) * 100 + week
+        raise ValueError("Unknown grouping: {}".format(name))
+
+    def label(self, name, code):
+        if name == 'employee':
+            return self.employee_names[code]
+        if name == 'task':
+            return self.task_names[code]
+        if name == 'day':
+            return datetime.date(1970, 1, 1) + datetime.timedelta(int(code))
+        if name == 'month':
+            return '{:04d}-{:02d}'.format(1970 + code // 12, code % 12 + 1)
+        if name == 'week':
+            return '{:04d}-W{:02d}'.format(code // 100, code % 100)
+        return int(code)
+
+    def groups(self, by):
+        """The distinct group keys, as rows of codes, and the index of each
+        entry's group"""
+        if not by:
+            # A single group, unless there are no entries at all
+            return (numpy.zeros((min(len(self), 1), 0), 'i8'),
+                    numpy.zeros(len(self), 'i8'))
+        columns = [self.group_codes(name).astype('i8') for name in by]
+        if not len(self):
+            return numpy.zeros((0, len(by)), 'i8'), numpy.zeros(0, 'i8')
+        lows = [column.min() for column in columns]
+        sizes = [column.max() - low + 1 for column, low in zip(columns, lows)]
+        if numpy.prod(numpy.array(sizes, 'f8')) >= 2 ** 62:
+            keys, inverse = numpy.unique(numpy.stack(columns, axis=1), axis=0,
+                                         return_inverse=True)
+            return keys, inverse.reshape(-1)
+        # Pack the codes of each entry into one integer, as digits with the
+        # size of each grouping for their base, which unique sorts far faster
+        # than rows of codes
+        packed = numpy.zeros(len(self), 'i8')
+        for column, low, size in zip(columns, lows, sizes):
+            packed = packed * size + (column - low)
+        packed, inverse = numpy.unique(packed, return_inverse=True)
+        keys = numpy.empty((len(packed), len(by)), 'i8')
+        for index in reversed(range(len(by))):
+            packed, keys[:, index] = numpy.divmod(packed, sizes[index])
+            keys[:, index] += lows[index]
+        return keys, inverse.reshape(-1)
+
+    def labelled(self, by, keys, values):
+        """Rows of group labels followed by the values of each group, in
+        order of the labels"""
+        rows = [tuple(self.label(name, code) for name, code in zip(by, key))
+                + tuple(value) for key, value in zip(keys.tolist(), values)]
+        return sorted(rows, key=lambda row: row[:len(by)])
+
+    ########################################################
+    # Aggregates
+    ########################################################
+    def totals(self, by=()):
+        """(group labels..., total minutes, entry count) rows"""
+        keys, inverse = self.groups(by)
+        minutes = numpy.bincount(inverse, weights=self.minutes,
+                                 minlength=len(keys)).astype('i8')
+        counts = numpy.bincount(inverse, minlength=len(keys))
+        return self.labelled(by, keys, zip(minutes.tolist(), counts.tolist()))
+
+    def percentiles(self, percents, by=()):
+        """(group labels..., minutes at each percent) rows, interpolating
+        linearly between entries like numpy.percentile"""
+        keys, inverse = self.groups(by)
+        columns = self._quantiles(percents, inverse, len(keys))
+        return self.labelled(by, keys, zip(*[column.tolist()
+                                             for column in columns]))
+
+    def histogram(self, bins, by=()):
+        """(group labels..., counts per bin) rows.
+
+        bins are the bin edges as for numpy.histogram: each bin holds the
+        minutes from its edge up to the next one, the last bin including
+        its upper edge. Minutes outside the edges are not counted.
+        """
+        edges = numpy.asarray(bins)
+        keys, inverse = self.groups(by)
+        slot = numpy.searchsorted(edges, self.minutes, side='right') - 1
+        slot[self.minutes == edges[-1]] = len(edges) - 2
+        inside = (slot >= 0) & (slot < len(edges) - 1)
+        counts = numpy.bincount(
+            inverse[inside] * (len(edges) - 1) + slot[inside],
+            minlength=len(keys) * (len(edges) - 1))
+        counts = counts.reshape(len(keys), len(edges) - 1)
+        return self.labelled(by, keys, [(row,) for row in counts.tolist()])
+
+    def outliers(self, by=(), k=1.5):
+        """Ids of the entries whose minutes lie more than k interquartile
+        ranges outside the middle half of their group"""
+        keys, inverse = self.groups(by)
+        low, high = self._quantiles((25, 75), inverse, len(keys))
+        spread = (high - low) * k
+        outside = ((self.minutes < (low - spread)[inverse]) |
+                   (self.minutes > (high + spread)[inverse]))
+        return self.ids[outside].tolist()
+
+    def _quantiles(self, percents, inverse, group_count):
+        """One array per percent with the minutes at that percent of each
+        group, found by sorting the minutes once within their groups"""
+        counts = numpy.bincount(inverse, minlength=group_count)
+        starts = numpy.cumsum(counts) - counts
+        minutes = self.minutes[numpy.lexsort((self.minutes, inverse))]
+        columns = []
+        for percent in percents:
+            position = starts + (counts - 1) * (percent / 100.0)
+            low = numpy.floor(position).astype('i8')
+            high = numpy.minimum(low + 1, starts + counts - 1)
+            fraction = position - low
+            columns.append(minutes[low] + (minutes[high] - minutes[low]) *
+                           fraction)
+        return columns
+
+
+def names(model, database=None):
+    """Names by id for one of the interned name tables"""
+    return dict(model.select(model.id, model.name).tuples()
+                .bind(database or model._meta.database))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Minutes spent per group: totals and percentiles")
+    parser.add_argument('--by', action='append', choices=GROUPINGS,
+                        dest='group_by', help="repeat to nest groupings")
+    parser.add_argument('--from', dest='start_date',
+                        type=worklog_db.parse_date)
+    parser.add_argument('--to', dest='end_date', type=worklog_db.parse_date)
+    parser.add_argument('--employee', help="part of the employee name")
+    parser.add_argument('--percentile', type=float, action='append',
+                        dest='percents', help="default: 50 and 90")
+    args = parser.parse_args(argv)
+    group_by = args.group_by or []
+    percents = args.percents or [50, 90]
+    worklog_db.initialize()
+    columns = EntryColumns.load(worklog_db.filter_entries(
+        employee=args.employee, start_date=args.start_date,
+        end_date=args.end_date))
+    totals = columns.totals(group_by)
+    rows = [total + percentile[len(group_by):] for total, percentile in
+            zip(totals, columns.percentiles(percents, group_by))]
+    print('\t'.join(group_by + ['minutes', 'entries'] +
+                    ['p{:g}'.format(percent) for percent in percents]))
+    for row in rows:
+        print('\t'.join(str(value) for value in row))
+    return rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+#####################################################
+# Asyncio HTTP/JSON API over the Work Log
+#####################################################
+# Usage:
+# python3 api.py [--host 127.0.0.1] [--port 8080] [--database workLog.db]
+#     [--partitions worklog-partitions]
+#
+# Routes:
+# GET    /entries?employee=&date=&from=&to=&minutes=&min_minutes=&max_minutes=
+#                &search=&mode=&limit=&after=
+# POST   /entries              {"name", "task", "spent_minutes", "notes",
+#                               "timestamp"}
+# GET    /entries/<id>
+# PATCH  /entries/<id>         any of the fields above
+# DELETE /entries/<id>
+# GET    /employees
+# GET    /dates
+# GET    /histogram?bucket_minutes=&buckets= and the filters of /entries:
+#                              entry counts by minutes spent
+# GET    /explain and the filters of /entries: how the entries are found
+# GET    /stats                query latency histograms by operation
+#
+# Entry lists come a page at a time; a response's "next" value, when not
+# null, is passed back as after= to get the following page.
+#
+# Connections are served by the event loop, so an idle keep-alive
+# connection costs no thread. Database calls go to a WorklogService on a
+# thread pool sized to its reader pool, or with --partitions to a
+# partitions.PartitionedWorklog over one database file per year.
+import argparse
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import json
+import re
+from urllib.parse import parse_qs, urlsplit
+
+from cursor import PAGE_SIZE
+from entry import db
+import instrumentation
+import service
+import worklog_db
+
+
+MAX_PAGE_SIZE = 500
+MAX_BUCKETS = 1000
+MAX_BODY = 1024 * 1024
+ENTRY_PATH = re.compile(r'^/entries/(\d+)$')
+# Sort value and entry id, as cursor.EntryCursor.key gives them
+KEY_LENGTH = 2
+SEARCH_MODES = ('match', 'substring')
+REASONS = {
+    200: 'OK',
+    201: 'Created',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super(HTTPError, self).__init__(message or REASONS[status])
+        self.status = status
+
+
+def entry_json(entry):
+    data = {
+        'id': entry.id,
+        'name': entry.name,
+        'task': entry.task,
+        'spent_minutes': entry.spent_minutes,
+        'notes': entry.notes,
+        'timestamp': entry.timestamp.isoformat(),
+    }
+    snippet = getattr(entry, 'snippet', None)
+    if snippet:
+        data['snippet'] = snippet
+    return data
+
+
+def encode_key(key):
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_key(token):
+    """The sort key encoded by encode_key: the entry's timestamp or search
+    rank, then its id"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise HTTPError(400, "Invalid after token")
+    # Anything else would reach the SQL as it is
+    if not isinstance(key, list) or len(key) != KEY_LENGTH or \
+            any(isinstance(part, bool) for part in key) or \
+            not isinstance(key[0], (str, int, float)) or \
+            not isinstance(key[-1], int):
+        raise HTTPError(400, "Invalid after token")
+    return tuple(key)
+
+
+def parse_filters(params):
+    """Turn query string parameters into worklog_db.filter_entries
+    arguments"""
+    def value(name):
+        return params[name][-1] if name in params else None
+
+    filters = {}
+    try:
+        for name, key in (('date', 'date'), ('from', 'start_date'),
+                          ('to', 'end_date')):
+            if value(name) is not None:
+                filters[key] = worklog_db.parse_date(value(name))
+        for name, key in (('minutes', 'spent_minutes'),
+                          ('min_minutes', 'min_minutes'),
+                          ('max_minutes', 'max_minutes')):
+            if value(name) is not None:
+                filters[key] = worklog_db.parse_spent_minutes(value(name))
+        page_size = int(value('limit') or PAGE_SIZE)
+        assert value('mode') in (None,) + SEARCH_MODES
+    except (ValueError, AssertionError):
+        raise HTTPError(400, "Invalid filter value")
+    if value('employee') is not None:
+        filters['employee'] = value('employee')
+    if value('search') is not None:
+        filters['search_term'] = value('search')
+        filters['search_mode'] = value('mode') or 'match'
+    filters['page_size'] = min(max(page_size, 1), MAX_PAGE_SIZE)
+    if value('after') is not None:
+        filters['after'] = decode_key(value('after'))
+    return filters
+
+
+def unpaged_filters(params):
+    """parse_filters for the routes without pages"""
+    filters = parse_filters(params)
+    del filters['page_size']
+    filters.pop('after', None)
+    return filters
+
+
+def histogram_filters(params):
+    """unpaged_filters for GET /histogram, which also takes the bucket
+    width in minutes and the number of buckets"""
+    filters = unpaged_filters(params)
+    try:
+        for name in ('bucket_minutes', 'buckets'):
+            if name in params:
+                filters[name] = int(params[name][-1])
+                assert 0 < filters[name] <= MAX_BUCKETS
+    except (ValueError, AssertionError):
+        raise HTTPError(400, "Invalid histogram value")
+    return filters
+
+
+class WorklogAPI(object):
+    def __init__(self, worklog, max_workers=service.MAX_READERS):
+        self.worklog = worklog
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        self.executor.shutdown()
+
+    async def call(self, function, *args, **kwargs):
+        """Run a blocking service call on the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs))
+
+    ########################################################
+    # Routes
+    ########################################################
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        if url.path == '/entries':
+            if method == 'GET':
+                entries, key = await self.call(self.worklog.find_page,
+                                               **parse_filters(params))
+                return 200, {'entries': [entry_json(entry)
+                                         for entry in entries],
+                             'next': encode_key(key)}
+            if method == 'POST':
+                entry_id = await self.call(self.worklog.add_entry,
+                                           **self.entry_fields(body))
+                return 201, {'id': entry_id}
+            raise HTTPError(405)
+        match = ENTRY_PATH.match(url.path)
+        if match:
+            entry_id = int(match.group(1))
+            if method == 'GET':
+                entry = await self.call(self.worklog.get_entry, entry_id)
+            elif method == 'PATCH':
+                edited = await self.call(self.worklog.edit_entry, entry_id,
+                                         **self.entry_fields(body))
+                if not edited:
+                    raise HTTPError(404)
+                # A partitioned work log returns the new id of an entry
+                # moved to another year
+                if edited is not True:
+                    entry_id = edited
+                entry = await self.call(self.worklog.get_entry, entry_id)
+            elif method == 'DELETE':
+                if not await self.call(self.worklog.delete_entry, entry_id):
+                    raise HTTPError(404)
+                return 200, {'deleted': entry_id}
+            else:
+                raise HTTPError(405)
+            if entry is None:
+                raise HTTPError(404)
+            return 200, entry_json(entry)
+        if url.path == '/employees' and method == 'GET':
+            return 200, {'employees': await self.call(
+                self.worklog.employee_names)}
+        if url.path == '/dates' and method == 'GET':
+            dates = await self.call(self.worklog.entry_dates)
+            return 200, {'dates': [date.isoformat() for date in dates]}
+        if url.path == '/histogram' and method == 'GET':
+            rows = await self.call(self.worklog.minutes_histogram,
+                                   **histogram_filters(params))
+            return 200, {'buckets': [
+                {'low': low, 'high': high, 'entries': count,
+                 'minutes': minutes} for low, high, count, minutes in rows]}
+        if url.path == '/explain' and method == 'GET':
+            return 200, {'plan': await self.call(
+                self.worklog.explain, **unpaged_filters(params))}
+        if url.path == '/stats' and method == 'GET':
+            return 200, {'queries': instrumentation.recorder.summary()}
+        raise HTTPError(404)
+
+    @staticmethod
+    def entry_fields(body):
+        try:
+            fields = json.loads(body.decode('utf-8') or '{}')
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(fields, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return fields
+
+    ########################################################
+    # HTTP/1.1
+    ########################################################
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, keep_alive, body = request
+                try:
+                    status, payload = await self.route(method, target, body)
+                except HTTPError as error:
+                    status, payload = error.status, {'error': str(error)}
+                except (ValueError, TypeError) as error:
+                    status, payload = 400, {'error': str(error)}
+                except Exception:
+                    status, payload = 500, {'error': REASONS[500]}
+                writer.write(http_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HTTPError as error:
+            writer.write(http_response(error.status, {'error': str(error)},
+                                       False))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def read_request(reader):
+    """Read one request; None once the client has closed the connection"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400)
+    if length > MAX_BODY:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b''
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        keep_alive = connection == 'keep-alive'
+    else:
+        keep_alive = connection != 'close'
+    return method.upper(), target, keep_alive, body
+
+
+def http_response(status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    head = ('HTTP/1.1 {} {}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: {}\r\n\r\n').format(
+                status, REASONS[status], len(body),
+                'keep-alive' if keep_alive else 'close')
+    return head.encode('latin-1') + body
+
+
+async def run(host, port, path, partition_directory=None):
+    if partition_directory is None:
+        worklog = service.WorklogService(path)
+    else:
+        import partitions
+        worklog = partitions.PartitionedWorklog(partition_directory)
+    worklog.initialize()
+    api = WorklogAPI(worklog)
+    server = await api.serve(host, port)
+    print("Serving the work log on http://{}:{}".format(host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.close()
+        worklog.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the work log as an HTTP/JSON API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--database', default=db.database)
+    parser.add_argument('--partitions', metavar='DIRECTORY',
+                        help="serve one database file per year from "
+                             "DIRECTORY instead of --database")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run(args.host, args.port, args.database,
+                        args.partitions))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
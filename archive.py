@@ -0,0 +1,273 @@
+#####################################################
+# Archival of old entries and compaction of the Work Log
+#####################################################
+# Usage:
+# python3 archive.py archive --before 2017-01-01 [--database workLog.db] \
+#     [--directory archive] [--no-compact]
+# python3 archive.py compact [--database workLog.db]
+#
+# archive moves the entries dated before a cutoff into a new archive file:
+# a complete work log database holding just those entries, with its own
+# search index and catalogs, vacuumed, gzip compressed and made read-only.
+# The archive_range table of the live database records the dates each file
+# covers. Lookups include the archive when asked (find_archived,
+# WorklogService.find_entries(include_archive=True), cli.py find
+# --archived), opening only the files whose dates can match; a file is
+# decompressed to a temporary copy the first time a process reads it.
+#
+# The live database holds its write lock from the copy until the entries
+# are deleted, so no entry written meanwhile can be lost or left out. The
+# archive file is complete on disk before the delete commits; if the
+# archive is interrupted, the live database is unchanged and the orphaned
+# file is not referenced.
+#
+# compact then returns the pages freed by the delete to the file system,
+# COMPACT_PAGES at a time in separate transactions so that other writers
+# get their turn. A database made before auto_vacuum was set to
+# incremental (see settings.py) is converted by one full VACUUM first.
+import argparse
+import atexit
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from peewee import SqliteDatabase
+
+from entry import ArchiveRange, db
+from migrations import migrate
+import worklog_db
+
+
+ARCHIVE_DIRECTORY = 'archive'
+ARCHIVE_FILE = 'worklog-archive-{}-{}-{}.db'
+# gzip level 6 compresses an archive nearly as small as 9 in half the time
+COMPRESS_LEVEL = 6
+COMPACT_PAGES = 1024
+# Seconds to wait between compaction steps
+COMPACT_PAUSE = 0.01
+INCREMENTAL = 2
+
+
+########################################################
+# Archiving
+########################################################
+def archive_entries(database, cutoff, directory=None):
+    """Move the entries dated before cutoff into a new archive file.
+
+    Returns the ArchiveRange recorded for the file, or None when there was
+    nothing to archive. directory defaults to ARCHIVE_DIRECTORY next to the
+    database file.
+    """
+    base = os.path.dirname(os.path.abspath(database.database))
+    directory = os.path.join(base, directory or ARCHIVE_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    archived_at = datetime.datetime.now().replace(microsecond=0)
+    # Compared as text with the stored timestamps, as in
+    # worklog_db.timestamp_in_range
+    cutoff = cutoff.isoformat()
+    with database.atomic(lock_type='IMMEDIATE'):
+        first, last, count = database.execute_sql(
+            'SELECT min(substr("timestamp", 1, 10)), '
+            'max(substr("timestamp", 1, 10)), count(*) FROM "entry" '
+            'WHERE "timestamp" < ?', (cutoff,)).fetchone()
+        if not count:
+            return None
+        name = ARCHIVE_FILE.format(first, last,
+                                   archived_at.strftime('%Y%m%d%H%M%S'))
+        work_path = os.path.join(directory, name)
+        try:
+            copy_entries(database.database, work_path, cutoff, count)
+            path = compress(work_path)
+        finally:
+            if os.path.exists(work_path):
+                os.remove(work_path)
+        archive_range = ArchiveRange(
+            path=os.path.relpath(path, base),
+            first_date=datetime.date.fromisoformat(first),
+            last_date=datetime.date.fromisoformat(last), entry_count=count,
+            archived_at=archived_at)
+        archive_range.id = ArchiveRange.insert(
+            **archive_range.__data__).bind(database).execute()
+        database.execute_sql('DELETE FROM "entry" WHERE "timestamp" < ?',
+                             (cutoff,))
+    return archive_range
+
+
+def copy_entries(live_path, work_path, cutoff, count):
+    """Build the work log at work_path from the entries of the database at
+    live_path dated before cutoff, keeping their ids"""
+    archive_db = SqliteDatabase(work_path)
+    archive_db.connect()
+    try:
+        migrate(archive_db)
+        archive_db.execute_sql('ATTACH DATABASE ? AS "live"', (live_path,))
+        with archive_db.atomic():
+            for table, column in (('employee', 'employee_id'),
+                                  ('task', 'task_id')):
+                archive_db.execute_sql(
+                    'INSERT INTO "{0}" ("id", "name") '
+                    'SELECT "id", "name" FROM "live"."{0}" WHERE "id" IN '
+                    '(SELECT "{1}" FROM "live"."entry" '
+                    'WHERE "timestamp" < ?)'.format(table, column), (cutoff,))
+            copied = archive_db.execute_sql(
+                'INSERT INTO "entry" ("id", "employee_id", "task_id", '
+                '"spent_minutes", "notes", "timestamp") '
+                'SELECT "id", "employee_id", "task_id", "spent_minutes", '
+                '"notes", "timestamp" FROM "live"."entry" '
+                'WHERE "timestamp" < ?', (cutoff,)).rowcount
+        archive_db.execute_sql('DETACH DATABASE "live"')
+        # The copy reads the live file through its own connection, so check
+        # it saw the same entries as the transaction holding the write lock
+        assert copied == count, "archive copied {} of {} entries".format(
+            copied, count)
+        archive_db.execute_sql('VACUUM')
+    finally:
+        archive_db.close()
+
+
+def compress(work_path):
+    """gzip the file at work_path to a read-only file beside it and return
+    the new file's path"""
+    path = work_path + '.gz'
+    partial = path + '.partial'
+    with open(work_path, 'rb') as source, open(partial, 'wb') as target:
+        with gzip.GzipFile(fileobj=target, mode='wb',
+                           compresslevel=COMPRESS_LEVEL) as compressed:
+            shutil.copyfileobj(source, compressed)
+        target.flush()
+        os.fsync(target.fileno())
+    os.chmod(partial, 0o444)
+    os.replace(partial, path)
+    return path
+
+
+########################################################
+# Lookups
+########################################################
+_open_archives = {}
+_open_lock = threading.Lock()
+
+
+def open_archive(path):
+    """A read-only database over the archive file at path"""
+    with _open_lock:
+        archive_db = _open_archives.get(path)
+        if archive_db is None:
+            handle, copy = tempfile.mkstemp(suffix='.db')
+            with os.fdopen(handle, 'wb') as target, \
+                    gzip.open(path, 'rb') as source:
+                shutil.copyfileobj(source, target)
+            archive_db = SqliteDatabase(copy, pragmas=[('query_only', 1)],
+                                        check_same_thread=False)
+            _open_archives[path] = archive_db
+        return archive_db
+
+
+@atexit.register
+def close_archives():
+    with _open_lock:
+        for archive_db in _open_archives.values():
+            archive_db.close()
+            os.remove(archive_db.database)
+        _open_archives.clear()
+
+
+def archived_ranges(database, date=None, start_date=None, end_date=None,
+                    **_):
+    """The archive ranges that can hold entries matching the date filters,
+    oldest first"""
+    query = ArchiveRange.select().order_by(ArchiveRange.first_date,
+                                           ArchiveRange.id)
+    first = start_date if date is None else max(date, start_date or date)
+    last = end_date if date is None else min(date, end_date or date)
+    if first is not None:
+        query = query.where(ArchiveRange.last_date >= first)
+    if last is not None:
+        query = query.where(ArchiveRange.first_date <= last)
+    return list(query.bind(database))
+
+
+def archived_queries(database, **filters):
+    """worklog_db.filter_entries queries over each archive file that can
+    match the filters, oldest first, bound to the file"""
+    base = os.path.dirname(os.path.abspath(database.database))
+    return [worklog_db.filter_entries(**filters).bind(
+                open_archive(os.path.join(base, archive_range.path)))
+            for archive_range in archived_ranges(database, **filters)]
+
+
+def find_archived(database, limit=None, **filters):
+    """Archived entries matching the filters of worklog_db.filter_entries"""
+    entries = []
+    for query in archived_queries(database, **filters):
+        if limit is not None:
+            query = query.limit(limit - len(entries))
+        entries.extend(query)
+        if limit is not None and len(entries) >= limit:
+            break
+    return entries
+
+
+########################################################
+# Compaction
+########################################################
+def compact(database, pages=COMPACT_PAGES, pause=COMPACT_PAUSE):
+    """Hand the free pages of the database back to the file system and
+    return how many there were"""
+    def pragma(statement):
+        return database.execute_sql('PRAGMA ' + statement).fetchall()
+    free = pragma('freelist_count')[0][0]
+    if pragma('auto_vacuum')[0][0] != INCREMENTAL:
+        pragma('auto_vacuum = INCREMENTAL')
+        database.execute_sql('VACUUM')
+        return free
+    remaining = free
+    while remaining:
+        # The pragma frees one page each time it is stepped, and execute()
+        # steps a statement without result columns only once
+        database.connection().executescript(
+            'PRAGMA incremental_vacuum({:d})'.format(min(pages, remaining)))
+        left = pragma('freelist_count')[0][0]
+        if left >= remaining:
+            break
+        remaining = left
+        time.sleep(pause)
+    return free - remaining
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Archive old entries and compact the work log")
+    parser.add_argument('--database', default=db.database)
+    commands = parser.add_subparsers(dest='command', required=True)
+    archive_parser = commands.add_parser(
+        'archive', help="move entries dated before a cutoff to an archive "
+                        "file")
+    archive_parser.add_argument('--before', required=True,
+                                type=worklog_db.parse_date)
+    archive_parser.add_argument('--directory', default=ARCHIVE_DIRECTORY)
+    archive_parser.add_argument('--no-compact', dest='compact',
+                                action='store_false')
+    commands.add_parser('compact', help="return free pages to the file "
+                                        "system")
+    args = parser.parse_args(argv)
+    db.init(args.database)
+    worklog_db.initialize()
+    if args.command == 'archive':
+        archive_range = archive_entries(db, args.before, args.directory)
+        if archive_range is None:
+            print("No entries dated before {}".format(args.before))
+        else:
+            print("Archived {} entries from {} to {} in {}".format(
+                archive_range.entry_count, archive_range.first_date,
+                archive_range.last_date, archive_range.path))
+    if args.command == 'compact' or args.compact:
+        print("Freed {} pages".format(compact(db)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#####################################################
+# Benchmarks over a seeded synthetic work log
+#####################################################
+# Usage:
+# python3 benchmark.py [--entries 100000] [--seed 1] [--repeat 5] \
+#     [--database bench.db] [--output results.json] [--compare base.json]
+#
+# Fills a database with a reproducible work log of the given size (the same
+# entries and seed always give the same rows), then times every lookup of
+# the service layer and single entry inserts, edits and deletes. Results
+# are written as JSON; with --compare, any benchmark whose median is more
+# than --tolerance slower than in the baseline file is listed and the exit
+# status is 1.
+#
+# An existing database with the expected number of entries is reused, so
+# large datasets only have to be generated once.
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+from entry import Entry
+import importer
+import service
+
+
+FIRST_NAMES = ('Alice', 'Beth', 'Carlos', 'Dmitri', 'Emma', 'Farid', 'Grace',
+               'Hiro', 'Ines', 'Jamal', 'Kate', 'Liam', 'Maya', 'Noor',
+               'Oscar', 'Priya', 'Quinn', 'Rosa', 'Sven', 'Tariq')
+LAST_NAMES = ('Adams', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia',
+              'Hughes', 'Ito', 'Jones', 'Kowalski', 'Lopez', 'Moreau',
+              'Nakamura', 'Okafor', 'Patel', 'Rossi', 'Silva', 'Tanaka',
+              'Weber')
+VERBS = ('Review', 'Deploy', 'Fix', 'Write', 'Test', 'Plan', 'Design',
+         'Refactor', 'Document', 'Debug', 'Support', 'Migrate')
+OBJECTS = ('billing report', 'login page', 'search index', 'release notes',
+           'invoice export', 'user survey', 'API client', 'backup job',
+           'dashboard', 'onboarding flow', 'build pipeline', 'database schema')
+WORDS = ('customer', 'meeting', 'follow', 'up', 'bug', 'feature', 'call',
+         'blocked', 'waiting', 'review', 'merged', 'draft', 'estimate',
+         'sprint', 'deadline', 'urgent', 'client', 'team', 'notes', 'spec',
+         'question', 'answer', 'done', 'pending', 'retest', 'handover')
+# Entries are spread over three years ending on this date
+LAST_DATE = datetime.date(2017, 12, 31)
+DAYS = 3 * 365
+DEFAULT_ENTRIES = 100000
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.2
+
+
+########################################################
+# Synthetic work log
+########################################################
+def cardinalities(count):
+    """Number of distinct employees and tasks for a log of count entries.
+
+    Both grow with the square root of the log, from 50 employees and 200
+    tasks at 10k entries to about 1,600 and 6,300 at 10M.
+    """
+    root = count ** 0.5
+    return max(int(root / 2), 5), max(int(root * 2), 10)
+
+
+def vocabulary(words, size, rng):
+    """size distinct strings made of one item from each of words, numbered
+    once the combinations run out"""
+    combinations = [' '.join(parts) for parts in itertools.product(*words)]
+    rng.shuffle(combinations)
+    values = combinations[:size]
+    for number in itertools.count(2):
+        if len(values) >= size:
+            break
+        values.extend('{} {}'.format(value, number)
+                      for value in combinations[:size - len(values)])
+    return values
+
+
+def generate_entries(count, seed=1):
+    """Yield count entry dicts, the same ones for the same count and seed.
+
+    Employees and tasks are picked with Zipf-like weights, so a few of each
+    account for most entries, as in a real log.
+    """
+    rng = random.Random(seed)
+    name_count, task_count = cardinalities(count)
+    names = vocabulary((FIRST_NAMES, LAST_NAMES), name_count, rng)
+    tasks = vocabulary((VERBS, OBJECTS), task_count, rng)
+    name_weights = list(itertools.accumulate(
+        1.0 / rank for rank in range(1, name_count + 1)))
+    task_weights = list(itertools.accumulate(
+        1.0 / rank for rank in range(1, task_count + 1)))
+    first_date = LAST_DATE - datetime.timedelta(days=DAYS - 1)
+    for _ in range(count):
+        yield {
+            'name': rng.choices(names, cum_weights=name_weights)[0],
+            'task': rng.choices(tasks, cum_weights=task_weights)[0],
+            'spent_minutes': 5 * rng.randint(1, 96),
+            'notes': ' '.join(rng.choice(WORDS)
+                              for _ in range(rng.randint(0, 12))),
+            'timestamp': first_date + datetime.timedelta(
+                days=rng.randrange(DAYS)),
+        }
+
+
+def populate(worklog, count, seed=1, progress=None):
+    """Fill the service's database with generate_entries(count, seed),
+    unless it already holds count entries"""
+    with worklog.write_lock, worklog.write_db.bind_ctx([Entry]):
+        existing = Entry.select().count()
+        if existing == count:
+            return False
+        assert existing == 0, "The benchmark database holds other entries"
+        importer.import_rows(generate_entries(count, seed),
+                             progress=progress)
+    return True
+
+
+########################################################
+# Timing
+########################################################
+def time_call(function, repeat):
+    """Run function repeat times and return its timings in seconds with the
+    size of its last result"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    rows = len(result) if isinstance(result, list) else None
+    return timings, rows
+
+
+def summary(timings, rows):
+    return {
+        'runs': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'max': max(timings),
+        'rows': rows,
+    }
+
+
+def lookups(worklog, count, seed):
+    """(name, function) pairs timing each service lookup with arguments
+    drawn from the dataset"""
+    rng = random.Random(seed)
+    sample = next(itertools.islice(generate_entries(count, seed),
+                                   rng.randrange(min(count, 1000)), None))
+    day = sample['timestamp']
+    week_end = day + datetime.timedelta(days=6)
+    word = rng.choice(WORDS)
+    return [
+        ('find_by_employee',
+         lambda: worklog.find_by_employee(sample['name'])),
+        ('find_by_date', lambda: worklog.find_by_date(day)),
+        ('find_by_date_range',
+         lambda: worklog.find_by_date_range(day, week_end)),
+        ('find_by_spent_minutes',
+         lambda: worklog.find_by_spent_minutes(sample['spent_minutes'])),
+        ('find_by_search_term',
+         lambda: worklog.find_by_search_term(word)),
+        ('find_by_search_term_substring',
+         lambda: worklog.find_by_search_term(word, mode='substring')),
+        ('find_page', lambda: worklog.find_page(employee=sample['name'])[0]),
+    ]
+
+
+def writes(worklog, seed):
+    """(name, function) pairs timing single entry inserts, edits and
+    deletes; run in order the same number of times, the deletes remove
+    every entry the inserts added"""
+    rng = random.Random(seed)
+    created = []
+
+    def add():
+        created.append(worklog.add_entry('Benchmark', 'Insert',
+                                         rng.randint(1, 480)))
+
+    def edit():
+        worklog.edit_entry(rng.choice(created),
+                           spent_minutes=rng.randint(1, 480))
+
+    def delete():
+        worklog.delete_entry(created.pop())
+
+    return [('add_entry', add), ('edit_entry', edit),
+            ('delete_entry', delete)]
+
+
+def run(worklog, count, seed=1, repeat=DEFAULT_REPEAT):
+    """Time every benchmark and return the results as a JSON-ready dict"""
+    results = {}
+    for name, function in lookups(worklog, count, seed):
+        # One untimed run warms the page cache and the connection pool
+        function()
+        results[name] = summary(*time_call(function, repeat))
+    for name, function in writes(worklog, seed):
+        results[name] = summary(*time_call(function, repeat))
+    return {
+        'entries': count,
+        'seed': seed,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """(name, baseline median, current median) for every benchmark more than
+    tolerance slower in current than in baseline"""
+    slower = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before and result['median'] > before['median'] * (1 + tolerance):
+            slower.append((name, before['median'], result['median']))
+    return slower
+
+
+def print_progress(result):
+    sys.stderr.write("\rGenerating: {}".format(result))
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the work log over a synthetic dataset")
+    parser.add_argument('--entries', type=int, default=DEFAULT_ENTRIES)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--database',
+                        help="default: bench-<entries>-<seed>.db")
+    parser.add_argument('--output', help="JSON results file (default: "
+                                         "standard output)")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="JSON results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+    path = args.database or 'bench-{}-{}.db'.format(args.entries, args.seed)
+    worklog = service.WorklogService(path)
+    try:
+        worklog.initialize()
+        if populate(worklog, args.entries, args.seed, print_progress):
+            sys.stderr.write("\n")
+        results = run(worklog, args.entries, args.seed, args.repeat)
+    finally:
+        worklog.close()
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            slower = compare(json.load(baseline_file), results,
+                             args.tolerance)
+        for name, before, after in slower:
+            sys.stderr.write("{}: {:.2f} ms -> {:.2f} ms\n".format(
+                name, before * 1000, after * 1000))
+        if slower:
+            sys.exit(1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#####################################################
+# Bulk edits and deletes of the entries matching filters
+#####################################################
+# edit_entries and delete_entries change every entry matching the filters
+# of worklog_db.filter_entries, as cli.py edit and cli.py delete do, with
+# set-based statements instead of saving or deleting entries one by one.
+# Unlike a lookup, employee must be the whole name: 'Beth' never changes the
+# entries of Bethany or Elizabeth.
+#
+# The entries are changed BATCH_SIZE at a time, in order of id: each batch
+# is a single UPDATE or DELETE of the next matching ids in a transaction of
+# its own, and RETURNING gives the ids it changed, from which the next
+# batch continues. Other writers get the lock between batches, so a large
+# change never holds them up for longer than one batch; an interrupted
+# change keeps the batches already committed. The triggers keep the
+# catalogs, rollups and search index in step row by row as usual.
+#
+# dry_run only counts the matching entries. report, if given, is called
+# with the number and row count of each batch as it commits.
+import time
+
+from peewee import fn
+
+from cache import lookup_cache
+from entry import Entry, Employee, Task
+import service
+import worklog_db
+
+
+BATCH_SIZE = 500
+# Seconds to wait between batches
+BATCH_PAUSE = 0.01
+
+
+def matching_entries(employee=None, **filters):
+    """worklog_db.filter_entries(names=False) over the filters, with
+    employee matched as the whole name"""
+    query = worklog_db.filter_entries(names=False, **filters)
+    if employee is not None:
+        query = query.where(Entry.employee.in_(
+            Employee.select(Employee.id).where(Employee.name == employee)))
+    return query
+
+
+def count_entries(database=None, **filters):
+    """The number of entries matching the filters"""
+    return (matching_entries(**filters)
+            .select(fn.count(Entry.id)).order_by()
+            .bind(database or Entry._meta.database).scalar())
+
+
+def delete_entries(database=None, dry_run=False, batch_size=BATCH_SIZE,
+                   pause=BATCH_PAUSE, report=None, **filters):
+    """Delete the entries matching the filters and return how many there
+    were; with dry_run only count them"""
+    if dry_run:
+        return count_entries(database, **filters)
+    return run_batches(Entry.delete(), database, batch_size, pause, report,
+                       filters)
+
+
+def edit_entries(changes, database=None, dry_run=False,
+                 batch_size=BATCH_SIZE, pause=BATCH_PAUSE, report=None,
+                 **filters):
+    """Set the fields of changes, a dict of service.EDITABLE_FIELDS values,
+    on the entries matching the filters and return how many there were;
+    with dry_run only count them. Raises ValueError for values an entry
+    cannot take."""
+    unknown = set(changes) - set(service.EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError("Cannot edit {}".format(', '.join(sorted(unknown))))
+    if not changes:
+        raise ValueError("No changes given")
+    values = service.clean_values(**changes)
+    if dry_run:
+        return count_entries(database, **filters)
+    database = database or Entry._meta.database
+    # Interned once, ahead of the batches; a name row left without entries
+    # is harmless, as names are never removed
+    if 'name' in values:
+        values['employee'] = Employee.intern(values.pop('name'), database)
+    if 'task' in values:
+        values['task_ref'] = Task.intern(values.pop('task'), database)
+    return run_batches(Entry.update(**values), database, batch_size, pause,
+                       report, filters)
+
+
+def run_batches(statement, database, batch_size, pause, report, filters):
+    """Run statement, an Entry update or delete, over the entries matching
+    the filters, batch_size of them per transaction, and return the number
+    of rows it changed"""
+    assert batch_size > 0
+    database = database or Entry._meta.database
+    batch = (matching_entries(**filters)
+             .select(Entry.id).order_by(Entry.id).limit(batch_size))
+    total = number = last = 0
+    try:
+        while True:
+            with database.atomic(lock_type='IMMEDIATE'):
+                changed = [entry_id for entry_id, in statement
+                           .where(Entry.id.in_(batch.where(Entry.id > last)))
+                           .returning(Entry.id).tuples().bind(database)
+                           .execute()]
+            if not changed:
+                break
+            number += 1
+            total += len(changed)
+            last = max(changed)
+            if report is not None:
+                report(number, len(changed))
+            if len(changed) < batch_size:
+                break
+            time.sleep(pause)
+    finally:
+        # The statements bypass the signals the lookup cache listens to
+        if total:
+            lookup_cache.clear()
+    return total
@@ -0,0 +1,158 @@
+#####################################################
+# Write-invalidated cache of lookup results
+#####################################################
+# The lookups hand browse_through a query; LookupCache remembers the ordered
+# ids of the entries each query matched, keyed by the query's SQL and
+# parameters, so repeating a lookup pages through entries by id instead of
+# running the filter again.
+#
+# The key also holds the database the query is bound to, so the same lookup
+# over two databases, such as two partitions, is cached twice.
+#
+# Entry sends post_save and post_delete signals, and a cached result is
+# dropped exactly when a write touches one of its rows: when a saved or
+# deleted entry is among its ids, or when a saved entry now matches its
+# query. Whether it does is checked for all the cached queries at once, with
+# one UNION ALL of the queries for that one entry id per database, and at
+# most MAX_COMPOUND queries per statement. Writes that bypass the model
+# methods, such as bulk imports or other processes, are only bounded by the
+# ttl; call clear() after making them.
+#
+# The API and the write buffer save entries off the main thread, so the
+# results are only read and changed under a lock. A lookup runs its query
+# outside the lock and is not cached if a write came in meanwhile.
+from collections import OrderedDict
+import functools
+import operator
+import threading
+import time
+
+from peewee import Value
+from playhouse.signals import post_save, post_delete
+
+from entry import Entry
+from settings import load_cache_settings
+
+
+# SQLite's default limit on the selects of one compound statement
+MAX_COMPOUND = 500
+
+
+class LookupCache(object):
+    def __init__(self, size=128, ttl=300, max_ids=10000, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.max_ids = max_ids
+        self.clock = clock
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Counts the writes seen, for ids() to tell one came in meanwhile
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def stats(self):
+        with self.lock:
+            return OrderedDict([
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('invalidations', self.invalidations),
+                ('cached', len(self.results)),
+            ])
+
+    def clear(self):
+        with self.lock:
+            self.writes += 1
+            self.results.clear()
+
+    @staticmethod
+    def key(query):
+        sql, params = query.sql()
+        return id(database_of(query)), sql, tuple(params)
+
+    def ids(self, query):
+        """The ordered ids of the entries query matches.
+
+        Returns None, after counting a miss, for results with more than
+        max_ids entries; those are left for the caller to page through.
+        """
+        key = self.key(query)
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None:
+                ids, _, _, expires = cached
+                if self.clock() < expires:
+                    self.results.move_to_end(key)
+                    self.hits += 1
+                    return ids
+                del self.results[key]
+            self.misses += 1
+            if not self.size:
+                return None
+            writes = self.writes
+        ids = [row[0] for row in query.select(Entry.id)
+               .limit(self.max_ids + 1).tuples()]
+        if len(ids) > self.max_ids:
+            return None
+        with self.lock:
+            # A write since the query ran may not show in its ids
+            if writes == self.writes:
+                self.results[key] = (ids, set(ids), query,
+                                     self.clock() + self.ttl)
+                while len(self.results) > self.size:
+                    self.results.popitem(last=False)
+        return ids
+
+    def invalidate(self, entry, deleted=False):
+        """Drop the results that entry's write may have changed"""
+        with self.lock:
+            self.writes += 1
+            unchanged = []
+            for key, (_, id_set, query, _) in list(self.results.items()):
+                if entry.id in id_set:
+                    self.drop(key)
+                elif not deleted:
+                    unchanged.append((key, query))
+            for key in matching_keys(unchanged, entry.id):
+                self.drop(key)
+
+    def drop(self, key):
+        del self.results[key]
+        self.invalidations += 1
+
+
+def database_of(query):
+    return query._database or Entry._meta.database
+
+
+def matching_keys(queries, entry_id):
+    """The keys of the (key, query) pairs whose query matches the entry
+    with entry_id"""
+    by_database = OrderedDict()
+    for key, query in queries:
+        by_database.setdefault(database_of(query), []).append((key, query))
+    matched = []
+    for database, pairs in by_database.items():
+        for start in range(0, len(pairs), MAX_COMPOUND):
+            batch = pairs[start:start + MAX_COMPOUND]
+            # Each query selects its position in the batch when it matches
+            check = functools.reduce(operator.add, [
+                query.select(Value(number)).where(Entry.id == entry_id)
+                .order_by() for number, (_, query) in enumerate(batch)])
+            matched.extend(batch[number][0] for number in
+                           set(check.bind(database).scalars()))
+    return matched
+
+
+lookup_cache = LookupCache(**load_cache_settings())
+
+
+@post_save(sender=Entry)
+def invalidate_saved_entry(sender, instance, created):
+    lookup_cache.invalidate(instance)
+
+
+@post_delete(sender=Entry)
+def invalidate_deleted_entry(sender, instance):
+    lookup_cache.invalidate(instance, deleted=True)
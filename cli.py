@@ -0,0 +1,270 @@
+#####################################################
+# Non-interactive command line for the Work Log
+#####################################################
+# Usage:
+# python3 cli.py find [--employee Beth] [--date 03/01/2016] [--from 01/01/2016]
+#     [--to 12/31/2016] [--minutes 30] [--min-minutes 240] [--max-minutes 480]
+#     [--search "deploy*"] [--substring] [--limit 20]
+#     [--format table|csv|json|jsonl] [--archived] [--explain]
+# python3 cli.py add --name Beth --task Deploy --minutes 30 [--notes ...] \
+#     [--date 03/01/2016]
+# python3 cli.py edit [the filters of find] [--set-name Beth] [--set-task ...]
+#     [--set-minutes 30] [--set-notes ...] [--set-date 03/01/2016]
+#     [--dry-run] [--batch-size 500]
+# python3 cli.py delete [the filters of find] [--dry-run] [--batch-size 500]
+# python3 cli.py employees
+# python3 cli.py dates
+#
+# Meant for scripts that call it many times a day: only argparse is
+# imported before the arguments are checked, the database modules are
+# imported by the command that needs them, and the schema is only checked
+# further when PRAGMA user_version is behind (see worklog_db.initialize).
+# edit and delete change every matching entry in batches (see bulk.py),
+# printing each batch's row count to standard error; they refuse to run
+# without a filter, and take --employee as the whole name, not part of it.
+# Errors go to standard error with exit status 2.
+import argparse
+import sys
+
+
+FORMATS = ('table', 'csv', 'json', 'jsonl')
+EXACT_EMPLOYEE_HELP = "the whole employee name (see cli.py employees)"
+
+
+class UsageError(Exception):
+    pass
+
+
+def print_table(rows, stream):
+    count = 0
+    for entry_id, name, task, spent_minutes, notes, timestamp in rows:
+        stream.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+            entry_id, timestamp.isoformat(), name, task, spent_minutes,
+            notes))
+        count += 1
+    return count
+
+
+def parse_filters(args):
+    """worklog_db.filter_entries arguments from the filter options"""
+    import worklog_db
+    try:
+        filters = {
+            'employee': args.employee,
+            'search_term': args.search,
+            'search_mode': 'substring' if args.substring else 'match',
+        }
+        for name, value in (('date', args.date), ('start_date', args.start),
+                            ('end_date', args.end)):
+            filters[name] = worklog_db.parse_date(value) if value else None
+        for name, value in (('spent_minutes', args.minutes),
+                            ('min_minutes', args.min_minutes),
+                            ('max_minutes', args.max_minutes)):
+            if value is not None:
+                filters[name] = worklog_db.parse_spent_minutes(value)
+    except (ValueError, AssertionError):
+        raise UsageError("Dates are MM/DD/YYYY or YYYY-MM-DD and minutes "
+                         "a whole, non-negative number")
+    return filters
+
+
+def find(args):
+    import itertools
+    import exporter
+    import planner
+    import worklog_db
+    filters = parse_filters(args)
+    worklog_db.initialize()
+    plan = planner.plan_query(**filters)
+    if args.explain:
+        lines = plan.explain()
+        for line in lines:
+            print(line)
+        return lines
+    query = plan.query
+    if args.limit is not None:
+        query = query.limit(args.limit)
+    rows = exporter.export_rows(query)
+    if args.archived:
+        import archive
+        from entry import Entry
+        rows = itertools.chain(rows, *[
+            exporter.export_rows(archived) for archived in
+            archive.archived_queries(Entry._meta.database, **filters)])
+        rows = itertools.islice(rows, args.limit)
+    write = print_table if args.format == 'table' else \
+        exporter.WRITERS[args.format]
+    return write(rows, sys.stdout)
+
+
+def add(args):
+    from entry import Entry
+    import service
+    import worklog_db
+    values = dict(name=args.name, task=args.task, spent_minutes=args.minutes,
+                  notes=args.notes or '')
+    if args.date is not None:
+        values['timestamp'] = args.date
+    try:
+        values = service.clean_values(**values)
+    except ValueError as error:
+        raise UsageError(str(error))
+    worklog_db.initialize()
+    entry = Entry.create(**values)
+    print(entry.id)
+    return entry.id
+
+
+def bulk_filters(args):
+    """parse_filters for edit and delete, which must be given a filter so
+    that a slip cannot change every entry"""
+    filters = parse_filters(args)
+    if all(value is None for name, value in filters.items()
+           if name != 'search_mode'):
+        raise UsageError("Give at least one filter")
+    return filters
+
+
+def bulk_options(args):
+    """bulk.py keyword arguments from the edit and delete options"""
+    import bulk
+    if args.batch_size is not None and args.batch_size < 1:
+        raise UsageError("The batch size must be positive")
+
+    def report(number, rows):
+        sys.stderr.write("batch {}: {} entries\n".format(number, rows))
+    return {'dry_run': args.dry_run,
+            'batch_size': args.batch_size or bulk.BATCH_SIZE,
+            'report': report}
+
+
+def edit(args):
+    import bulk
+    import worklog_db
+    filters = bulk_filters(args)
+    changes = dict((field, value) for field, value in (
+        ('name', args.set_name), ('task', args.set_task),
+        ('spent_minutes', args.set_minutes), ('notes', args.set_notes),
+        ('timestamp', args.set_date)) if value is not None)
+    options = bulk_options(args)
+    worklog_db.initialize()
+    try:
+        count = bulk.edit_entries(changes, **dict(options, **filters))
+    except ValueError as error:
+        raise UsageError(str(error))
+    print("{} {} entries".format("Would edit" if args.dry_run else "Edited",
+                                 count))
+    return count
+
+
+def delete(args):
+    import bulk
+    import worklog_db
+    filters = bulk_filters(args)
+    options = bulk_options(args)
+    worklog_db.initialize()
+    count = bulk.delete_entries(**dict(options, **filters))
+    print("{} {} entries".format(
+        "Would delete" if args.dry_run else "Deleted", count))
+    return count
+
+
+def employees(args):
+    import worklog_db
+    worklog_db.initialize()
+    names = worklog_db.catalog_names()
+    for name in names:
+        print(name)
+    return names
+
+
+def dates(args):
+    import worklog_db
+    worklog_db.initialize()
+    entry_dates = worklog_db.catalog_dates()
+    for date in entry_dates:
+        print(date.isoformat())
+    return entry_dates
+
+
+def add_filter_arguments(parser, employee_help="part of the employee name"):
+    parser.add_argument('--employee', help=employee_help)
+    parser.add_argument('--date')
+    parser.add_argument('--from', dest='start')
+    parser.add_argument('--to', dest='end')
+    parser.add_argument('--minutes')
+    parser.add_argument('--min-minutes', help="at least these minutes")
+    parser.add_argument('--max-minutes', help="at most these minutes")
+    parser.add_argument('--search', help="search term for task or notes")
+    parser.add_argument('--substring', action='store_true',
+                        help="match --search as a plain substring")
+
+
+def add_bulk_arguments(parser):
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only count the matching entries")
+    parser.add_argument('--batch-size', type=int,
+                        help="entries changed per transaction (default: "
+                             "bulk.BATCH_SIZE)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='worklog', description="Query and add work log entries")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    find_parser = commands.add_parser('find', help="print matching entries")
+    add_filter_arguments(find_parser)
+    find_parser.add_argument('--limit', type=int)
+    find_parser.add_argument('--format', choices=FORMATS, default='table')
+    find_parser.add_argument('--archived', action='store_true',
+                             help="also look in the archive files")
+    find_parser.add_argument('--explain', action='store_true',
+                             help="print how the entries would be found "
+                                  "instead")
+    find_parser.set_defaults(run=find)
+
+    add_parser = commands.add_parser('add', help="add an entry, printing its "
+                                                 "id")
+    add_parser.add_argument('--name', required=True)
+    add_parser.add_argument('--task', required=True)
+    add_parser.add_argument('--minutes', required=True)
+    add_parser.add_argument('--notes')
+    add_parser.add_argument('--date', help="default: today")
+    add_parser.set_defaults(run=add)
+
+    edit_parser = commands.add_parser(
+        'edit', help="change fields of every matching entry")
+    add_filter_arguments(edit_parser, EXACT_EMPLOYEE_HELP)
+    edit_parser.add_argument('--set-name')
+    edit_parser.add_argument('--set-task')
+    edit_parser.add_argument('--set-minutes')
+    edit_parser.add_argument('--set-notes')
+    edit_parser.add_argument('--set-date')
+    add_bulk_arguments(edit_parser)
+    edit_parser.set_defaults(run=edit)
+
+    delete_parser = commands.add_parser(
+        'delete', help="delete every matching entry")
+    add_filter_arguments(delete_parser, EXACT_EMPLOYEE_HELP)
+    add_bulk_arguments(delete_parser)
+    delete_parser.set_defaults(run=delete)
+
+    commands.add_parser('employees', help="list employee names") \
+        .set_defaults(run=employees)
+    commands.add_parser('dates', help="list dates with entries") \
+        .set_defaults(run=dates)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        return args.run(args)
+    except UsageError as error:
+        parser.exit(2, "{}: error: {}\n".format(parser.prog, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#####################################################
+# Paged access to matched entries
+#####################################################
+from peewee import NodeList, Tuple
+
+from entry import Entry
+
+
+PAGE_SIZE = 50
+
+
+class EntryCursor(object):
+    """Windowed view over the entries matched by a query.
+
+    Entries are fetched page_size rows at a time with keyset pagination:
+    each page continues from the sort key of the last entry seen instead
+    of skipping rows with OFFSET, so moving through the results costs the
+    same wherever the cursor is, and at most one page of entries is held
+    in memory.
+
+    The sort key is the query's own ordering (such as bm25 rank for a
+    full-text search), or timestamp when it has none, followed by the entry
+    id to make it unique. Every sort column must be ascending. Passing the
+    key() of an entry as after starts the cursor just past that entry.
+    """
+
+    def __init__(self, query, page_size=PAGE_SIZE, after=None):
+        self.query = query
+        self.page_size = page_size
+        self.sort_key = list(query._order_by or [Entry.timestamp])
+        self.sort_key.append(Entry.id)
+        self.page = self._fetch(after=after)
+        self.index = 0
+
+    def __bool__(self):
+        return bool(self.page)
+
+    @property
+    def current(self):
+        return self.page[self.index]
+
+    def next(self):
+        """Move to the next entry; False when already at the last one"""
+        if self.index + 1 < len(self.page):
+            self.index += 1
+            return True
+        page = self._fetch(after=self.key(self.page[-1]))
+        if not page:
+            return False
+        self.page, self.index = page, 0
+        return True
+
+    def previous(self):
+        """Move to the previous entry; False when already at the first"""
+        if self.index > 0:
+            self.index -= 1
+            return True
+        page = self._fetch(before=self.key(self.page[0]))
+        if not page:
+            return False
+        self.page, self.index = page, len(page) - 1
+        return True
+
+    def key(self, entry):
+        """The sort key of an entry fetched by this cursor"""
+        return tuple(getattr(entry, '_key{}'.format(position))
+                     for position in range(len(self.sort_key)))
+
+    def _fetch(self, after=None, before=None):
+        # The keys are selected through a NodeList so that peewee hands back
+        # the stored values unconverted; a legacy timestamp such as
+        # '2017-07-03 16:58:35' must not be cut down to its date.
+        query = self.query.select_extend(*[
+            NodeList((key,)).alias('_key{}'.format(position))
+            for position, key in enumerate(self.sort_key)])
+        position = Tuple(*self.sort_key)
+        if before is None:
+            if after is not None:
+                query = query.where(position > Tuple(*after))
+            query = query.order_by(*self.sort_key)
+        else:
+            query = query.where(position < Tuple(*before))
+            query = query.order_by(*[key.desc() for key in self.sort_key])
+        page = list(query.limit(self.page_size))
+        if before is not None:
+            page.reverse()
+        return page
+
+
+class IdCursor(object):
+    """Cursor over a known, ordered list of entry ids.
+
+    Has the interface of EntryCursor. Each page is fetched by restricting
+    query to the page's ids, so the entries carry the same columns (such as
+    a search snippet) as when the query was first run.
+    """
+
+    def __init__(self, query, ids, page_size=PAGE_SIZE):
+        self.query = query.order_by()
+        self.ids = ids
+        self.page_size = page_size
+        self.start = 0
+        self.page = self._fetch(0)
+        self.index = 0
+
+    def __bool__(self):
+        return bool(self.page)
+
+    @property
+    def current(self):
+        return self.page[self.index]
+
+    def next(self):
+        """Move to the next entry; False when already at the last one"""
+        if self.index + 1 < len(self.page):
+            self.index += 1
+            return True
+        start = self.start + self.page_size
+        page = self._fetch(start)
+        if not page:
+            return False
+        self.start, self.page, self.index = start, page, 0
+        return True
+
+    def previous(self):
+        """Move to the previous entry; False when already at the first"""
+        if self.index > 0:
+            self.index -= 1
+            return True
+        if self.start == 0:
+            return False
+        start = max(self.start - self.page_size, 0)
+        page = self._fetch(start)
+        if not page:
+            return False
+        self.start, self.page, self.index = start, page, len(page) - 1
+        return True
+
+    def _fetch(self, start):
+        ids = self.ids[start:start + self.page_size]
+        if not ids:
+            return []
+        entries = dict((entry.id, entry) for entry in
+                       self.query.where(Entry.id.in_(ids)))
+        # Entries deleted since the ids were cached are skipped
+        return [entries[entry_id] for entry_id in ids if entry_id in entries]
@@ -1,16 +1,219 @@
 from peewee import *
+from playhouse import signals
+from playhouse.sqlite_ext import FTS5Model, SearchField
 import datetime
 
+from instrumentation import InstrumentedSqliteDatabase
+from settings import load_pragmas
 
-db = SqliteDatabase('workLog.db')
 
+db = InstrumentedSqliteDatabase('workLog.db', pragmas=load_pragmas())
 
-class Entry(Model):
-    name = CharField(max_length=255)
-    task = CharField(max_length=255)
+
+# Employee names and task names are stored once each and referenced by id
+# from the entries. Rows are only ever added, never renamed or deleted, so
+# an id always stands for the same string.
+class InternedName(Model):
+    name = CharField(max_length=255, unique=True)
+
+    class Meta:
+        database = db
+
+    @classmethod
+    def intern(cls, name, database=None):
+        """Return the id of the row holding name, adding the row if needed"""
+        database = database or cls._meta.database
+
+        def find():
+            return (cls.select(cls.id).where(cls.name == name)
+                    .bind(database).scalar())
+        name_id = find()
+        if name_id is None:
+            cls.insert(name=name).on_conflict_ignore().bind(database).execute()
+            name_id = find()
+        return name_id
+
+
+class Employee(InternedName):
+    class Meta:
+        table_name = 'employee'
+
+
+class Task(InternedName):
+    class Meta:
+        table_name = 'task'
+
+
+class NameOf(object):
+    """Entry attribute for the name behind one of its foreign keys.
+
+    Reading it gives the name, selected alongside the entry under the alias
+    joined_as or else fetched through the foreign key, and assigning a name
+    interns it. On the class, Entry.name == 'Beth', != 'Beth', .in_(names),
+    .not_in(names) and .contains('Be') become filters on the foreign key,
+    which SQLite runs as an integer IN or NOT IN over the ids of the
+    matching names. Other operators, such as ordering, raise TypeError:
+    join the name table and use its name column for those.
+    """
+    def __init__(self, foreign_key, joined_as):
+        self.foreign_key = foreign_key
+        self.joined_as = joined_as
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        name = instance.__dict__.get(self.joined_as)
+        if name is None:
+            name = getattr(instance, self.foreign_key.name).name
+        return name
+
+    def __set__(self, instance, name):
+        instance.__dict__.pop(self.joined_as, None)
+        setattr(instance, self.foreign_key.name,
+                self.foreign_key.rel_model.intern(name))
+
+    def matching(self, condition, negated=False):
+        model = self.foreign_key.rel_model
+        ids = model.select(model.id).where(condition(model.name))
+        if negated:
+            return self.foreign_key.not_in(ids)
+        return self.foreign_key.in_(ids)
+
+    def __eq__(self, name):
+        return self.matching(lambda column: column == name)
+
+    def __ne__(self, name):
+        return self.matching(lambda column: column == name, negated=True)
+
+    __hash__ = object.__hash__
+
+    def in_(self, names):
+        return self.matching(lambda column: column.in_(names))
+
+    def not_in(self, names):
+        return self.matching(lambda column: column.in_(names), negated=True)
+
+    def contains(self, text):
+        return self.matching(lambda column: column.contains(text))
+
+    def unsupported(self, *args):
+        raise TypeError("Only ==, !=, in_, not_in and contains filter on "
+                        "the name of an entry")
+
+    __lt__ = __le__ = __gt__ = __ge__ = unsupported
+    asc = desc = startswith = endswith = unsupported
+
+
+# Entry sends playhouse.signals post_save and post_delete signals, which
+# the lookup cache in cache.py listens to.
+class Entry(signals.Model):
+    employee = ForeignKeyField(Employee, column_name='employee_id')
+    task_ref = ForeignKeyField(Task, column_name='task_id')
     spent_minutes = IntegerField()
     notes = TextField()
-    timestamp = DateField(default=datetime.datetime.now)
+    timestamp = DateField(default=datetime.datetime.now, index=True)
+
+    name = NameOf(employee, 'employee_name')
+    task = NameOf(task_ref, 'task_name')
+
+    class Meta:
+        database = db
+        # The leading column of each composite index also serves plain
+        # lookups on the employee and spent_minutes, and the trailing
+        # timestamp keeps the matches in date order without a sort step.
+        indexes = (
+            (('employee', 'timestamp'), False),
+            (('spent_minutes', 'timestamp'), False),
+        )
+
+
+def select_entries(*columns):
+    """Select entries together with their employee and task names, so that
+    reading the names costs no further queries"""
+    return (Entry
+            .select(Entry, Employee.name.alias('employee_name'),
+                    Task.name.alias('task_name'), *columns)
+            .join_from(Entry, Employee)
+            .join_from(Entry, Task)
+            .objects())
+
+
+# The catalog tables hold one row per distinct value in Entry together with
+# the number of entries carrying it. They are created and kept up to date
+# by triggers installed in migrations.py, so the pick lists, and planner.py
+# estimating how many entries a filter matches, can read them without
+# scanning the log.
+class NameCatalog(Model):
+    name = CharField(max_length=255, primary_key=True)
+    entry_count = IntegerField()
+
+    class Meta:
+        database = db
+        table_name = 'name_catalog'
+
+
+class DateCatalog(Model):
+    date = DateField(primary_key=True)
+    entry_count = IntegerField()
+
+    class Meta:
+        database = db
+        table_name = 'date_catalog'
+
+
+class MinutesCatalog(Model):
+    spent_minutes = IntegerField(primary_key=True)
+    entry_count = IntegerField()
+
+    class Meta:
+        database = db
+        table_name = 'minutes_catalog'
+
+
+# Full-text index over the task and notes of every entry. It reads its
+# content from the entry_text view, which joins each entry to its task
+# name, and is kept in sync by triggers installed in migrations.py; the
+# rowid of a search row is the id of its entry.
+class EntrySearch(FTS5Model):
+    task = SearchField()
+    notes = SearchField()
+
+    class Meta:
+        database = db
+        table_name = 'entry_search'
+        options = {'content': 'entry_text', 'content_rowid': 'id'}
+
+
+# One row per term of the full-text index with the number of entries
+# holding it (doc), read by SQLite straight from the index.
+EntrySearchVocab = EntrySearch.VocabModel(table='entry_search_vocab')
+
+
+# Minutes and entry counts per day, employee and task, kept up to date by
+# triggers installed in migrations.py so reports never scan the log.
+class DailyRollup(Model):
+    date = DateField()
+    name = CharField(max_length=255)
+    task = CharField(max_length=255)
+    total_minutes = IntegerField()
+    entry_count = IntegerField()
+
+    class Meta:
+        database = db
+        table_name = 'daily_rollup'
+        primary_key = CompositeKey('date', 'name', 'task')
+
+
+# One row per archive file written by archive.py, giving the dates of the
+# entries moved into it, so that lookups including the archive only open
+# the files that can match.
+class ArchiveRange(Model):
+    path = TextField()
+    first_date = DateField()
+    last_date = DateField()
+    entry_count = IntegerField()
+    archived_at = DateTimeField()
 
     class Meta:
-        database = db
\ No newline at end of file
+        database = db
+        table_name = 'archive_range'
@@ -0,0 +1,273 @@
+#####################################################
+# Streaming export of work log entries
+#####################################################
+# Usage:
+# python3 exporter.py --format csv --employee Beth --from 01/01/2016 \
+#     --to 12/31/2016 > beth-2016.csv
+# python3 exporter.py --format columnar --output worklog.wlc
+#
+# Takes the filters of the find_by_* lookups and streams the matching
+# entries through a peewee tuples iterator, so memory use does not grow with
+# the number of entries exported.
+#
+# The columnar format stores entries in row groups of up to ROW_GROUP_SIZE
+# rows. Each group is a little-endian uint32 row count followed by one
+# zlib-compressed chunk per column, each prefixed with its uint32 length.
+# Names and tasks are dictionary encoded: a group holds integer codes plus
+# the strings first seen in that group. A zero row count ends the file.
+import argparse
+from array import array
+import csv
+import datetime
+import json
+import struct
+import sys
+import zlib
+
+from entry import Entry, Employee, Task
+import worklog_db
+
+
+COLUMNS = ('id', 'name', 'task', 'spent_minutes', 'notes', 'timestamp')
+COLUMNAR_MAGIC = b'WLC1'
+ROW_GROUP_SIZE = 65536
+
+
+def export_rows(query):
+    """Stream the COLUMNS of each entry matched by query as tuples.
+
+    query must join in the employee and task, as the queries of
+    entry.select_entries and worklog_db.filter_entries do.
+    """
+    query = query.select(Entry.id, Employee.name, Task.name,
+                         Entry.spent_minutes, Entry.notes, Entry.timestamp)
+    if not query._order_by:
+        query = query.order_by(Entry.timestamp, Entry.id)
+    return query.tuples().iterator()
+
+
+def write_csv(rows, stream):
+    writer = csv.writer(stream)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def json_record(row):
+    record = dict(zip(COLUMNS, row))
+    record['timestamp'] = record['timestamp'].isoformat()
+    return json.dumps(record)
+
+
+def write_jsonl(rows, stream):
+    count = 0
+    for row in rows:
+        stream.write(json_record(row))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def write_json(rows, stream):
+    """Write the rows as one JSON array, streamed a row at a time"""
+    stream.write('[')
+    count = 0
+    for row in rows:
+        if count:
+            stream.write(',\n')
+        stream.write(json_record(row))
+        count += 1
+    stream.write(']\n')
+    return count
+
+
+########################################################
+# Columnar format
+########################################################
+def _int_bytes(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _int_values(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _string_bytes(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    return (struct.pack('<I', len(encoded)) +
+            _int_bytes('I', [len(value) for value in encoded]) +
+            b''.join(encoded))
+
+
+def _string_values(data):
+    count, = struct.unpack_from('<I', data)
+    lengths = _int_values('I', data[4:4 + 4 * count])
+    strings = []
+    offset = 4 + 4 * count
+    for length in lengths:
+        strings.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return strings
+
+
+class ColumnarWriter(object):
+    """Write rows of COLUMNS to a binary stream in the columnar format.
+
+    Only the current row group and the name and task dictionaries are held
+    in memory.
+    """
+
+    def __init__(self, stream, row_group_size=ROW_GROUP_SIZE):
+        self.stream = stream
+        self.row_group_size = row_group_size
+        self.dictionaries = ({}, {})
+        self.rows = []
+        self.stream.write(COLUMNAR_MAGIC)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        ids, names, tasks, minutes, notes, timestamps = zip(*self.rows)
+        name_codes, new_names = self._encode(self.dictionaries[0], names)
+        task_codes, new_tasks = self._encode(self.dictionaries[1], tasks)
+        chunks = [
+            _int_bytes('q', ids),
+            _int_bytes('q', minutes),
+            _int_bytes('i', [timestamp.toordinal()
+                             for timestamp in timestamps]),
+            _int_bytes('I', name_codes),
+            _int_bytes('I', task_codes),
+            _string_bytes(new_names),
+            _string_bytes(new_tasks),
+            _string_bytes(notes),
+        ]
+        self.stream.write(struct.pack('<I', len(self.rows)))
+        for chunk in chunks:
+            chunk = zlib.compress(chunk)
+            self.stream.write(struct.pack('<I', len(chunk)))
+            self.stream.write(chunk)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.stream.write(struct.pack('<I', 0))
+
+    @staticmethod
+    def _encode(dictionary, values):
+        codes = []
+        new_values = []
+        for value in values:
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+                new_values.append(value)
+            codes.append(code)
+        return codes, new_values
+
+
+def write_columnar(rows, stream, row_group_size=ROW_GROUP_SIZE):
+    writer = ColumnarWriter(stream, row_group_size)
+    count = 0
+    for row in rows:
+        writer.write(row)
+        count += 1
+    writer.close()
+    return count
+
+
+def read_columnar(stream):
+    """Yield the rows of a columnar file as tuples of COLUMNS"""
+    if stream.read(4) != COLUMNAR_MAGIC:
+        raise ValueError("Not a work log columnar file")
+    names, tasks = [], []
+    while True:
+        row_count, = struct.unpack('<I', stream.read(4))
+        if not row_count:
+            return
+        chunks = []
+        for _ in range(8):
+            length, = struct.unpack('<I', stream.read(4))
+            chunks.append(zlib.decompress(stream.read(length)))
+        names.extend(_string_values(chunks[5]))
+        tasks.extend(_string_values(chunks[6]))
+        columns = zip(
+            _int_values('q', chunks[0]),
+            _int_values('I', chunks[3]),
+            _int_values('I', chunks[4]),
+            _int_values('q', chunks[1]),
+            _string_values(chunks[7]),
+            _int_values('i', chunks[2]),
+        )
+        for entry_id, name, task, minutes, notes, ordinal in columns:
+            yield (entry_id, names[name], tasks[task], minutes, notes,
+                   datetime.date.fromordinal(ordinal))
+########################################################
+# End: Columnar format
+########################################################
+
+
+WRITERS = {
+    'csv': write_csv,
+    'json': write_json,
+    'jsonl': write_jsonl,
+    'columnar': write_columnar,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export work log entries matching the given filters")
+    parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    parser.add_argument('--output', help="file to write (default: stdout)")
+    parser.add_argument('--employee', help="part of the employee name")
+    parser.add_argument('--date', type=worklog_db.parse_date)
+    parser.add_argument('--from', dest='start_date',
+                        type=worklog_db.parse_date)
+    parser.add_argument('--to', dest='end_date', type=worklog_db.parse_date)
+    parser.add_argument('--minutes', type=worklog_db.parse_spent_minutes)
+    parser.add_argument('--search', help="search term for task or notes")
+    parser.add_argument('--substring', action='store_true',
+                        help="match --search as a plain substring")
+    args = parser.parse_args(argv)
+    worklog_db.initialize()
+    query = worklog_db.filter_entries(
+        employee=args.employee, date=args.date, start_date=args.start_date,
+        end_date=args.end_date, spent_minutes=args.minutes,
+        search_term=args.search,
+        search_mode='substring' if args.substring else 'match')
+    rows = export_rows(query)
+    binary = args.format == 'columnar'
+    if args.output is None:
+        stream = sys.stdout.buffer if binary else sys.stdout
+    elif binary:
+        stream = open(args.output, 'wb')
+    else:
+        stream = open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        count = WRITERS[args.format](rows, stream)
+    finally:
+        if args.output is None:
+            stream.flush()
+        else:
+            stream.close()
+    sys.stderr.write("{} entries exported\n".format(count))
+    return count
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#####################################################
+# Bulk import of work logs from CSV or JSONL files
+#####################################################
+# Usage:
+# python3 importer.py timesheets.csv [--batch-size 5000]
+# python3 importer.py timesheets.jsonl
+#
+# Each row needs name, task and spent_minutes; notes and timestamp are
+# optional. Timestamps may be written as YYYY-MM-DD or MM/DD/YYYY and default
+# to today. Rows are checked with the same rules as the interactive prompts,
+# invalid ones are counted and skipped, and valid ones are written with
+# insert_many, one transaction per batch. A JSONL line that is not valid
+# JSON, or not an object, is rejected like any other invalid row.
+#
+# Throughput: about 20,000 rows a second into an indexed log (100,000 rows
+# in 5 s), well short of hundreds of thousands. Checking rows runs at about
+# 320,000 a second; most of the time goes to the triggers that keep the
+# catalogs, full-text index and rollup in step with each row, and SQLite
+# alone inserts about 75,000 rows a second into the four indexes of the
+# entry table. Dropping the triggers for an import and catching the
+# catalogs, index and rollup up with one statement each afterwards was
+# measured at about 33,000 rows a second, and would keep every other
+# writer out for the whole import instead of one batch, so imports keep
+# the triggers.
+import argparse
+import csv
+import datetime
+import json
+import sys
+
+from cache import lookup_cache
+from entry import Entry, Employee, Task
+import worklog_db
+
+
+BATCH_SIZE = 5000
+# Rendering an insert_many statement costs peewee far more than SQLite
+# spends running it, so one statement of this many rows is rendered once
+# and reused with fresh parameters. 100 rows of 5 values stay under the
+# 999 parameter limit of older SQLite builds.
+ROWS_PER_STATEMENT = 100
+
+
+class ImportResult(object):
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+
+    def __str__(self):
+        return "{} rows imported, {} rejected".format(self.imported,
+                                                      self.rejected)
+
+
+def read_csv(lines):
+    """Yield one dict per CSV row, keyed by the header line"""
+    for row in csv.DictReader(lines):
+        yield row
+
+
+def read_jsonl(lines):
+    """Yield the value of each non-blank JSON line, or None for a line
+    that is not valid JSON, so that validate_row rejects it"""
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def parse_timestamp(timestamp):
+    if not timestamp:
+        return datetime.date.today()
+    try:
+        return datetime.date.fromisoformat(timestamp)
+    except ValueError:
+        return worklog_db.parse_date(timestamp)
+
+
+def validate_row(row):
+    """Return the (name, task, spent_minutes, notes, timestamp) values of
+    row; import_rows swaps the names for their ids.
+
+    Raises ValueError or AssertionError when the row breaks one of the rules
+    the interactive prompts enforce.
+    """
+    if not isinstance(row, dict):
+        raise TypeError("A row must be an object")
+    spent_minutes = row.get('spent_minutes')
+    # Only text or whole numbers, as typed at the prompt: JSON 30.7 or true
+    # would otherwise pass through int()
+    if isinstance(spent_minutes, bool) or \
+            not isinstance(spent_minutes, (str, int)):
+        raise TypeError("Minutes must be text or a whole number")
+    name = str(row.get('name') or '').strip()
+    task = str(row.get('task') or '').strip()
+    assert worklog_db.is_valid_text(name)
+    assert worklog_db.is_valid_text(task)
+    return (
+        name,
+        task,
+        worklog_db.parse_spent_minutes(spent_minutes),
+        str(row.get('notes') or '').strip(),
+        parse_timestamp(str(row.get('timestamp') or '').strip()).isoformat()
+    )
+
+
+def insert_statement(row_count):
+    """SQL of an insert_many for row_count rows, with a placeholder for each
+    value"""
+    sql, _ = Entry.insert_many([(None,) * 5] * row_count, fields=[
+        Entry.employee, Entry.task_ref, Entry.spent_minutes, Entry.notes,
+        Entry.timestamp]).sql()
+    return sql
+
+
+def import_rows(rows, batch_size=BATCH_SIZE, progress=None):
+    """Validate and insert rows, batch_size rows per transaction.
+
+    progress, if given, is called with the running ImportResult after each
+    batch is committed.
+    """
+    database = Entry._meta.database
+    statement = insert_statement(ROWS_PER_STATEMENT)
+    result = ImportResult()
+    batch = []
+    # Ids of the names and tasks seen so far, so each is interned once
+    employee_ids = {}
+    task_ids = {}
+
+    def interned(ids, model, name):
+        if name not in ids:
+            ids[name] = model.intern(name, database)
+        return ids[name]
+
+    def flush():
+        with database.atomic():
+            batch[:] = [(interned(employee_ids, Employee, row[0]),
+                         interned(task_ids, Task, row[1])) + row[2:]
+                        for row in batch]
+            for start in range(0, len(batch), ROWS_PER_STATEMENT):
+                rows = batch[start:start + ROWS_PER_STATEMENT]
+                if len(rows) < ROWS_PER_STATEMENT:
+                    statement_sql = insert_statement(len(rows))
+                else:
+                    statement_sql = statement
+                database.execute_sql(statement_sql,
+                                     [value for row in rows for value in row])
+        result.imported += len(batch)
+        del batch[:]
+        if progress is not None:
+            progress(result)
+
+    for row in rows:
+        try:
+            batch.append(validate_row(row))
+        except (ValueError, TypeError, AssertionError):
+            result.rejected += 1
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    # insert_many sends no model signals, so cached lookups are dropped
+    lookup_cache.clear()
+    return result
+
+
+def guess_format(path):
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def print_progress(result):
+    sys.stderr.write("\r{}".format(result))
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Import work log entries from a CSV or JSONL file")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=sorted(READERS),
+                        help="file format (default: from the extension)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="rows per transaction")
+    args = parser.parse_args(argv)
+    worklog_db.initialize()
+    reader = READERS[args.format or guess_format(args.path)]
+    with open(args.path, newline='', encoding='utf-8') as lines:
+        result = import_rows(reader(lines), args.batch_size, print_progress)
+    sys.stderr.write("\n")
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    main()
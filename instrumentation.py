@@ -0,0 +1,274 @@
+#####################################################
+# Query timing, latency histograms and slow-query log
+#####################################################
+# InstrumentedSqliteDatabase runs every query through a QueryRecorder,
+# which keeps a latency histogram per operation and appends each query
+# slower than the configured threshold to the slow-query log as a JSON line
+# holding its SQL, parameters, duration, row count, operation and, if
+# enabled, its EXPLAIN QUERY PLAN.
+#
+# The operation is the innermost function marked with @operation that is
+# running, such as worklog_db.find_by_employee, so the queries a lookup
+# sends while browsing are charged to the lookup. Queries outside a marked
+# function are charged to the first calling function outside peewee.
+#
+# The time of a query that returns rows runs until its last row is fetched
+# and counts only the time spent in SQLite, not the caller's work between
+# rows. Recording costs a few microseconds per query and under one per
+# row, so it is meant to stay on; see settings.py to configure or disable it.
+import bisect
+from collections import OrderedDict
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from peewee import SqliteDatabase
+
+from settings import load_instrumentation_settings
+
+
+# Upper bounds, in milliseconds, of the histogram buckets; a last bucket
+# takes everything slower.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Modules whose functions are never reported as the caller of a query
+LIBRARY_MODULES = ('peewee', 'playhouse', __name__)
+
+
+########################################################
+# Operations
+########################################################
+_local = threading.local()
+
+
+def operation(function):
+    """Charge the queries run by function to its name"""
+    name = '{}.{}'.format(function.__module__, function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = _local.__dict__.setdefault('operations', [])
+        stack.append(name)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+    return wrapper
+
+
+def current_operation():
+    stack = getattr(_local, 'operations', None)
+    if stack:
+        return stack[-1]
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(LIBRARY_MODULES):
+            return '{}.{}'.format(module, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+########################################################
+# Recording
+########################################################
+class OperationStats(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, milliseconds, rows):
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        self.rows += rows
+        self.buckets[bisect.bisect_left(BUCKETS, milliseconds)] += 1
+
+    def percentile(self, percent):
+        """Upper bound in milliseconds of the bucket holding the given
+        percentile; the maximum for the last bucket"""
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def summary(self):
+        return OrderedDict([
+            ('count', self.count),
+            ('rows', self.rows),
+            ('total_ms', round(self.total, 3)),
+            ('max_ms', round(self.max, 3)),
+            ('p50_ms', self.percentile(50)),
+            ('p95_ms', self.percentile(95)),
+            ('p99_ms', self.percentile(99)),
+            ('buckets', self.buckets[:]),
+        ])
+
+
+class QueryRecorder(object):
+    def __init__(self, enabled=1, slow_query_ms=100.0,
+                 slow_query_log='slow_queries.log', explain=0):
+        self.enabled = bool(enabled)
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.explain = bool(explain)
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def record(self, database, operation, sql, params, seconds, rows):
+        milliseconds = seconds * 1000
+        with self.lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = OperationStats()
+            stats.add(milliseconds, rows)
+        if milliseconds >= self.slow_query_ms and self.slow_query_log:
+            self.log_slow_query(database, operation, sql, params,
+                                milliseconds, rows)
+
+    def log_path(self, database):
+        """The slow-query log of database's queries: slow_query_log, in the
+        directory of the database file when relative; None for an in-memory
+        database"""
+        if os.path.isabs(self.slow_query_log):
+            return self.slow_query_log
+        if database.database in ('', ':memory:'):
+            return None
+        return os.path.join(
+            os.path.dirname(os.path.abspath(database.database)),
+            self.slow_query_log)
+
+    def log_slow_query(self, database, operation, sql, params, milliseconds,
+                       rows):
+        line = OrderedDict([
+            ('time', datetime.datetime.now().isoformat(timespec='seconds')),
+            ('operation', operation),
+            ('duration_ms', round(milliseconds, 3)),
+            ('rows', rows),
+            ('sql', sql),
+            ('params', list(params or ())),
+        ])
+        path = self.log_path(database)
+        if path is None:
+            return
+        if self.explain:
+            line['plan'] = query_plan(database, sql, params)
+        with self.lock, open(path, 'a') as log:
+            log.write(json.dumps(line, default=str) + '\n')
+
+    def summary(self):
+        """Histogram summaries by operation name"""
+        with self.lock:
+            return OrderedDict(
+                (name, self.operations[name].summary())
+                for name in sorted(self.operations))
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+
+
+def query_plan(database, sql, params):
+    """The EXPLAIN QUERY PLAN lines of sql, or None if it has none"""
+    try:
+        rows = database.connection().execute('EXPLAIN QUERY PLAN ' + sql,
+                                             params or ())
+        return [row[-1] for row in rows] or None
+    except Exception:
+        return None
+
+
+class InstrumentedCursor(object):
+    """Wraps a cursor of result rows and records its query once the rows
+    run out or the cursor is closed"""
+    def __init__(self, cursor, finish, elapsed):
+        self.cursor = cursor
+        self.finish = finish
+        self.elapsed = elapsed
+        self.rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _done(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            finish(self.elapsed, self.rows)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.elapsed += time.perf_counter() - started
+        if row is None:
+            self._done()
+        else:
+            self.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = self.cursor.fetchmany(size or self.cursor.arraysize)
+        self.elapsed += time.perf_counter() - started
+        self.rows += len(rows)
+        if len(rows) < (size or self.cursor.arraysize):
+            self._done()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self.elapsed += time.perf_counter() - started
+        self.rows += len(rows)
+        self._done()
+        return rows
+
+    def close(self):
+        self._done()
+        self.cursor.close()
+
+    def __del__(self):
+        self._done()
+
+
+########################################################
+# Databases
+########################################################
+class InstrumentedDatabase(object):
+    """Mixin recording the queries of a peewee database with recorder"""
+    def __init__(self, *args, **kwargs):
+        self.recorder = kwargs.pop('recorder', None) or recorder
+        super(InstrumentedDatabase, self).__init__(*args, **kwargs)
+
+    def execute_sql(self, sql, params=None):
+        if not self.recorder.enabled:
+            return super(InstrumentedDatabase, self).execute_sql(sql, params)
+        name = current_operation()
+        started = time.perf_counter()
+        cursor = super(InstrumentedDatabase, self).execute_sql(sql, params)
+        elapsed = time.perf_counter() - started
+        if cursor.description is None:
+            self.recorder.record(self, name, sql, params, elapsed,
+                                 max(cursor.rowcount, 0))
+            return cursor
+        return InstrumentedCursor(
+            cursor, functools.partial(self.recorder.record, self, name, sql,
+                                      params), elapsed)
+
+
+class InstrumentedSqliteDatabase(InstrumentedDatabase, SqliteDatabase):
+    pass
+
+
+recorder = QueryRecorder(**load_instrumentation_settings())
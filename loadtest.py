@@ -0,0 +1,110 @@
+#####################################################
+# Load test for the Work Log HTTP API
+#####################################################
+# Usage (with python3 api.py running):
+# python3 loadtest.py [--port 8080] [--connections 50] [--duration 10] \
+#     [--path /entries?limit=20 --path /employees]
+#
+# Keeps the given number of keep-alive connections busy with GET requests,
+# cycling through the paths, and reports requests per second and the
+# p50/p99 latency.
+import argparse
+import asyncio
+import itertools
+import time
+
+
+DEFAULT_PATHS = ('/entries?limit=20', '/employees', '/dates')
+
+
+class LoadResult(object):
+    def __init__(self, latencies, errors, elapsed):
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def requests_per_second(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, percent):
+        """Latency in seconds at the given percentile (nearest rank)"""
+        if not self.latencies:
+            return 0.0
+        rank = max(int(round(percent / 100.0 * len(self.latencies))), 1)
+        return self.latencies[rank - 1]
+
+    def __str__(self):
+        return ("{} requests in {:.1f}s, {} errors\n"
+                "{:.0f} requests/s\n"
+                "p50 {:.2f} ms, p99 {:.2f} ms").format(
+                    self.requests, self.elapsed, self.errors,
+                    self.requests_per_second, self.percentile(50) * 1000,
+                    self.percentile(99) * 1000)
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, paths, deadline, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    errors = 0
+    try:
+        for path in itertools.cycle(paths):
+            if time.perf_counter() >= deadline:
+                break
+            started = time.perf_counter()
+            writer.write('GET {} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(
+                path, host).encode('latin-1'))
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def run(host, port, paths, connections, duration):
+    latencies = []
+    started = time.perf_counter()
+    deadline = started + duration
+    errors = await asyncio.gather(*[
+        client(host, port, paths, deadline, latencies)
+        for _ in range(connections)])
+    return LoadResult(latencies, sum(errors), time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the work log HTTP API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--path', action='append', dest='paths')
+    args = parser.parse_args(argv)
+    result = asyncio.run(run(args.host, args.port,
+                             args.paths or DEFAULT_PATHS, args.connections,
+                             args.duration))
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    main()
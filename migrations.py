@@ -0,0 +1,415 @@
+#####################################################
+# Schema migrations for the Work Log database
+#####################################################
+# Each migration is a function taking the database. The position of the
+# function in MIGRATIONS is its version number, and the version a database
+# file has reached is kept in SQLite's own `PRAGMA user_version` header, so
+# existing workLog.db files are upgraded in place by initialize(). New
+# databases are built by the same steps, starting from an empty file.
+# Migrations spell out their SQL instead of reading it off the models so
+# that later model changes cannot alter what an old step does.
+
+
+def add_lookup_indexes(database):
+    """Index the columns the find_by_* lookups filter on"""
+    # The entry table as the first releases created it, for new databases
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "entry" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"name" VARCHAR(255) NOT NULL, "task" VARCHAR(255) NOT NULL, '
+        '"spent_minutes" INTEGER NOT NULL, "notes" TEXT NOT NULL, '
+        '"timestamp" DATE NOT NULL)')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "entry_timestamp" '
+                         'ON "entry" ("timestamp")')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "entry_name_timestamp" '
+                         'ON "entry" ("name", "timestamp")')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS '
+                         '"entry_spent_minutes_timestamp" '
+                         'ON "entry" ("spent_minutes", "timestamp")')
+    database.execute_sql('ANALYZE "entry"')
+
+
+def add_value_catalogs(database):
+    """Keep distinct names and dates with their entry counts"""
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "name_catalog" ('
+        '"name" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"entry_count" INTEGER NOT NULL)')
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "date_catalog" ('
+        '"date" DATE NOT NULL PRIMARY KEY, '
+        '"entry_count" INTEGER NOT NULL)')
+    # Legacy rows store a full datetime string in timestamp, newer ones a
+    # plain date; the first ten characters are the date in both cases.
+    database.execute_sql(
+        'INSERT INTO "name_catalog" ("name", "entry_count") '
+        'SELECT "name", count(*) FROM "entry" GROUP BY "name"')
+    database.execute_sql(
+        'INSERT INTO "date_catalog" ("date", "entry_count") '
+        'SELECT substr("timestamp", 1, 10), count(*) FROM "entry" '
+        'GROUP BY substr("timestamp", 1, 10)')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_catalog_insert" '
+        'AFTER INSERT ON "entry" BEGIN '
+        'INSERT INTO "name_catalog" ("name", "entry_count") '
+        'VALUES (new."name", 1) ON CONFLICT ("name") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; '
+        'INSERT INTO "date_catalog" ("date", "entry_count") '
+        'VALUES (substr(new."timestamp", 1, 10), 1) ON CONFLICT ("date") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; '
+        'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_catalog_delete" '
+        'AFTER DELETE ON "entry" BEGIN '
+        'UPDATE "name_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "name" = old."name"; '
+        'DELETE FROM "name_catalog" '
+        'WHERE "name" = old."name" AND "entry_count" <= 0; '
+        'UPDATE "date_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "date" = substr(old."timestamp", 1, 10); '
+        'DELETE FROM "date_catalog" '
+        'WHERE "date" = substr(old."timestamp", 1, 10) '
+        'AND "entry_count" <= 0; '
+        'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_catalog_update_name" '
+        'AFTER UPDATE OF "name" ON "entry" '
+        'WHEN old."name" IS NOT new."name" BEGIN '
+        'INSERT INTO "name_catalog" ("name", "entry_count") '
+        'VALUES (new."name", 1) ON CONFLICT ("name") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; '
+        'UPDATE "name_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "name" = old."name"; '
+        'DELETE FROM "name_catalog" '
+        'WHERE "name" = old."name" AND "entry_count" <= 0; '
+        'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_catalog_update_date" '
+        'AFTER UPDATE OF "timestamp" ON "entry" '
+        'WHEN substr(old."timestamp", 1, 10) '
+        'IS NOT substr(new."timestamp", 1, 10) BEGIN '
+        'INSERT INTO "date_catalog" ("date", "entry_count") '
+        'VALUES (substr(new."timestamp", 1, 10), 1) ON CONFLICT ("date") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; '
+        'UPDATE "date_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "date" = substr(old."timestamp", 1, 10); '
+        'DELETE FROM "date_catalog" '
+        'WHERE "date" = substr(old."timestamp", 1, 10) '
+        'AND "entry_count" <= 0; '
+        'END')
+
+
+def add_full_text_search(database):
+    """Index task and notes for full-text search"""
+    database.execute_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "entry_search" USING fts5('
+        '"task", "notes", content="entry", content_rowid="id")')
+    database.execute_sql(
+        'INSERT INTO "entry_search" ("entry_search") VALUES (\'rebuild\')')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_search_insert" '
+        'AFTER INSERT ON "entry" BEGIN '
+        'INSERT INTO "entry_search" ("rowid", "task", "notes") '
+        'VALUES (new."id", new."task", new."notes"); '
+        'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_search_delete" '
+        'AFTER DELETE ON "entry" BEGIN '
+        'INSERT INTO "entry_search" ("entry_search", "rowid", "task", '
+        '"notes") VALUES (\'delete\', old."id", old."task", old."notes"); '
+        'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_search_update" '
+        'AFTER UPDATE OF "task", "notes" ON "entry" BEGIN '
+        'INSERT INTO "entry_search" ("entry_search", "rowid", "task", '
+        '"notes") VALUES (\'delete\', old."id", old."task", old."notes"); '
+        'INSERT INTO "entry_search" ("rowid", "task", "notes") '
+        'VALUES (new."id", new."task", new."notes"); '
+        'END')
+
+
+def add_daily_rollup(database):
+    """Sum minutes and count entries per day, employee and task"""
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "daily_rollup" ('
+        '"date" DATE NOT NULL, "name" VARCHAR(255) NOT NULL, '
+        '"task" VARCHAR(255) NOT NULL, "total_minutes" INTEGER NOT NULL, '
+        '"entry_count" INTEGER NOT NULL, '
+        'PRIMARY KEY ("date", "name", "task"))')
+    database.execute_sql(
+        'INSERT INTO "daily_rollup" ("date", "name", "task", '
+        '"total_minutes", "entry_count") '
+        'SELECT substr("timestamp", 1, 10), "name", "task", '
+        'sum("spent_minutes"), count(*) FROM "entry" '
+        'GROUP BY substr("timestamp", 1, 10), "name", "task"')
+    add_new = (
+        'INSERT INTO "daily_rollup" ("date", "name", "task", '
+        '"total_minutes", "entry_count") '
+        'VALUES (substr(new."timestamp", 1, 10), new."name", new."task", '
+        'new."spent_minutes", 1) ON CONFLICT ("date", "name", "task") '
+        'DO UPDATE SET "total_minutes" = "total_minutes" + '
+        'excluded."total_minutes", "entry_count" = "entry_count" + 1; ')
+    remove_old = (
+        'UPDATE "daily_rollup" SET '
+        '"total_minutes" = "total_minutes" - old."spent_minutes", '
+        '"entry_count" = "entry_count" - 1 '
+        'WHERE "date" = substr(old."timestamp", 1, 10) '
+        'AND "name" = old."name" AND "task" = old."task"; '
+        'DELETE FROM "daily_rollup" '
+        'WHERE "date" = substr(old."timestamp", 1, 10) '
+        'AND "name" = old."name" AND "task" = old."task" '
+        'AND "entry_count" <= 0; ')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_rollup_insert" '
+        'AFTER INSERT ON "entry" BEGIN ' + add_new + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_rollup_delete" '
+        'AFTER DELETE ON "entry" BEGIN ' + remove_old + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_rollup_update" '
+        'AFTER UPDATE OF "name", "task", "spent_minutes", "timestamp" '
+        'ON "entry" WHEN old."name" IS NOT new."name" '
+        'OR old."task" IS NOT new."task" '
+        'OR old."spent_minutes" IS NOT new."spent_minutes" '
+        'OR substr(old."timestamp", 1, 10) '
+        'IS NOT substr(new."timestamp", 1, 10) '
+        'BEGIN ' + remove_old + add_new + 'END')
+
+
+# The name of the employee or task of an entry row, once entry holds ids
+EMPLOYEE_NAME = '(SELECT "name" FROM "employee" WHERE "id" = {}."employee_id")'
+TASK_NAME = '(SELECT "name" FROM "task" WHERE "id" = {}."task_id")'
+
+
+def normalize_names_and_tasks(database):
+    """Store each employee name and task once, referenced by id"""
+    for table in ('employee', 'task'):
+        database.execute_sql(
+            'CREATE TABLE IF NOT EXISTS "{0}" ('
+            '"id" INTEGER NOT NULL PRIMARY KEY, '
+            '"name" VARCHAR(255) NOT NULL)'.format(table))
+        database.execute_sql(
+            'CREATE UNIQUE INDEX IF NOT EXISTS "{0}_name" '
+            'ON "{0}" ("name")'.format(table))
+    database.execute_sql(
+        'INSERT OR IGNORE INTO "employee" ("name") '
+        'SELECT DISTINCT "name" FROM "entry"')
+    database.execute_sql(
+        'INSERT OR IGNORE INTO "task" ("name") '
+        'SELECT DISTINCT "task" FROM "entry"')
+    # SQLite cannot change the type of a column, so the entry table is
+    # rebuilt with the same ids; dropping the old one also drops its
+    # indexes and triggers, which are created again below.
+    database.execute_sql(
+        'CREATE TABLE "entry_normalized" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, '
+        '"employee_id" INTEGER NOT NULL REFERENCES "employee" ("id"), '
+        '"task_id" INTEGER NOT NULL REFERENCES "task" ("id"), '
+        '"spent_minutes" INTEGER NOT NULL, "notes" TEXT NOT NULL, '
+        '"timestamp" DATE NOT NULL)')
+    database.execute_sql(
+        'INSERT INTO "entry_normalized" ("id", "employee_id", "task_id", '
+        '"spent_minutes", "notes", "timestamp") '
+        'SELECT "entry"."id", "employee"."id", "task"."id", '
+        '"entry"."spent_minutes", "entry"."notes", "entry"."timestamp" '
+        'FROM "entry" '
+        'JOIN "employee" ON "employee"."name" = "entry"."name" '
+        'JOIN "task" ON "task"."name" = "entry"."task"')
+    database.execute_sql('DROP TABLE "entry_search"')
+    database.execute_sql('DROP TABLE "entry"')
+    database.execute_sql(
+        'ALTER TABLE "entry_normalized" RENAME TO "entry"')
+    database.execute_sql('CREATE INDEX "entry_timestamp" '
+                         'ON "entry" ("timestamp")')
+    database.execute_sql('CREATE INDEX "entry_employee_id_timestamp" '
+                         'ON "entry" ("employee_id", "timestamp")')
+    database.execute_sql('CREATE INDEX "entry_spent_minutes_timestamp" '
+                         'ON "entry" ("spent_minutes", "timestamp")')
+    database.execute_sql('CREATE INDEX "entry_task_id" '
+                         'ON "entry" ("task_id")')
+    database.execute_sql('ANALYZE "entry"')
+
+    new_name, old_name = EMPLOYEE_NAME.format('new'), EMPLOYEE_NAME.format(
+        'old')
+    new_task, old_task = TASK_NAME.format('new'), TASK_NAME.format('old')
+    add_name = (
+        'INSERT INTO "name_catalog" ("name", "entry_count") '
+        'VALUES (' + new_name + ', 1) ON CONFLICT ("name") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; ')
+    remove_name = (
+        'UPDATE "name_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "name" = ' + old_name + '; '
+        'DELETE FROM "name_catalog" '
+        'WHERE "name" = ' + old_name + ' AND "entry_count" <= 0; ')
+    add_date = (
+        'INSERT INTO "date_catalog" ("date", "entry_count") '
+        'VALUES (substr(new."timestamp", 1, 10), 1) ON CONFLICT ("date") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; ')
+    remove_date = (
+        'UPDATE "date_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "date" = substr(old."timestamp", 1, 10); '
+        'DELETE FROM "date_catalog" '
+        'WHERE "date" = substr(old."timestamp", 1, 10) '
+        'AND "entry_count" <= 0; ')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_catalog_insert" AFTER INSERT ON "entry" '
+        'BEGIN ' + add_name + add_date + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_catalog_delete" AFTER DELETE ON "entry" '
+        'BEGIN ' + remove_name + remove_date + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_catalog_update_name" '
+        'AFTER UPDATE OF "employee_id" ON "entry" '
+        'WHEN old."employee_id" IS NOT new."employee_id" '
+        'BEGIN ' + add_name + remove_name + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_catalog_update_date" '
+        'AFTER UPDATE OF "timestamp" ON "entry" '
+        'WHEN substr(old."timestamp", 1, 10) '
+        'IS NOT substr(new."timestamp", 1, 10) '
+        'BEGIN ' + add_date + remove_date + 'END')
+
+    # The full-text index reads task names through a view
+    database.execute_sql(
+        'CREATE VIEW "entry_text" AS '
+        'SELECT "entry"."id" AS "id", "task"."name" AS "task", '
+        '"entry"."notes" AS "notes" FROM "entry" '
+        'JOIN "task" ON "task"."id" = "entry"."task_id"')
+    database.execute_sql(
+        'CREATE VIRTUAL TABLE "entry_search" USING fts5('
+        '"task", "notes", content="entry_text", content_rowid="id")')
+    database.execute_sql(
+        'INSERT INTO "entry_search" ("entry_search") VALUES (\'rebuild\')')
+    add_text = (
+        'INSERT INTO "entry_search" ("rowid", "task", "notes") '
+        'VALUES (new."id", ' + new_task + ', new."notes"); ')
+    remove_text = (
+        'INSERT INTO "entry_search" ("entry_search", "rowid", "task", '
+        '"notes") VALUES (\'delete\', old."id", ' + old_task +
+        ', old."notes"); ')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_search_insert" AFTER INSERT ON "entry" '
+        'BEGIN ' + add_text + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_search_delete" AFTER DELETE ON "entry" '
+        'BEGIN ' + remove_text + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_search_update" '
+        'AFTER UPDATE OF "task_id", "notes" ON "entry" '
+        'BEGIN ' + remove_text + add_text + 'END')
+
+    # The rollup keeps its names, so reports need no joins
+    add_rollup = (
+        'INSERT INTO "daily_rollup" ("date", "name", "task", '
+        '"total_minutes", "entry_count") '
+        'VALUES (substr(new."timestamp", 1, 10), ' + new_name + ', ' +
+        new_task + ', new."spent_minutes", 1) '
+        'ON CONFLICT ("date", "name", "task") '
+        'DO UPDATE SET "total_minutes" = "total_minutes" + '
+        'excluded."total_minutes", "entry_count" = "entry_count" + 1; ')
+    rollup_row = (
+        'WHERE "date" = substr(old."timestamp", 1, 10) '
+        'AND "name" = ' + old_name + ' AND "task" = ' + old_task)
+    remove_rollup = (
+        'UPDATE "daily_rollup" SET '
+        '"total_minutes" = "total_minutes" - old."spent_minutes", '
+        '"entry_count" = "entry_count" - 1 ' + rollup_row + '; '
+        'DELETE FROM "daily_rollup" ' + rollup_row +
+        ' AND "entry_count" <= 0; ')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_rollup_insert" AFTER INSERT ON "entry" '
+        'BEGIN ' + add_rollup + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_rollup_delete" AFTER DELETE ON "entry" '
+        'BEGIN ' + remove_rollup + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER "entry_rollup_update" '
+        'AFTER UPDATE OF "employee_id", "task_id", "spent_minutes", '
+        '"timestamp" ON "entry" '
+        'WHEN old."employee_id" IS NOT new."employee_id" '
+        'OR old."task_id" IS NOT new."task_id" '
+        'OR old."spent_minutes" IS NOT new."spent_minutes" '
+        'OR substr(old."timestamp", 1, 10) '
+        'IS NOT substr(new."timestamp", 1, 10) '
+        'BEGIN ' + remove_rollup + add_rollup + 'END')
+
+
+def add_archive_ranges(database):
+    """Index the date ranges moved out to archive files"""
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "archive_range" ('
+        '"id" INTEGER NOT NULL PRIMARY KEY, "path" TEXT NOT NULL, '
+        '"first_date" DATE NOT NULL, "last_date" DATE NOT NULL, '
+        '"entry_count" INTEGER NOT NULL, "archived_at" DATETIME NOT NULL)')
+
+
+def add_filter_statistics(database):
+    """Count entries per minutes spent and expose the search index terms,
+    for planner.py to estimate how many entries each filter matches"""
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "minutes_catalog" ('
+        '"spent_minutes" INTEGER NOT NULL PRIMARY KEY, '
+        '"entry_count" INTEGER NOT NULL)')
+    database.execute_sql(
+        'INSERT INTO "minutes_catalog" ("spent_minutes", "entry_count") '
+        'SELECT "spent_minutes", count(*) FROM "entry" '
+        'GROUP BY "spent_minutes"')
+    add_minutes = (
+        'INSERT INTO "minutes_catalog" ("spent_minutes", "entry_count") '
+        'VALUES (new."spent_minutes", 1) ON CONFLICT ("spent_minutes") '
+        'DO UPDATE SET "entry_count" = "entry_count" + 1; ')
+    remove_minutes = (
+        'UPDATE "minutes_catalog" SET "entry_count" = "entry_count" - 1 '
+        'WHERE "spent_minutes" = old."spent_minutes"; '
+        'DELETE FROM "minutes_catalog" '
+        'WHERE "spent_minutes" = old."spent_minutes" '
+        'AND "entry_count" <= 0; ')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_minutes_insert" '
+        'AFTER INSERT ON "entry" BEGIN ' + add_minutes + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_minutes_delete" '
+        'AFTER DELETE ON "entry" BEGIN ' + remove_minutes + 'END')
+    database.execute_sql(
+        'CREATE TRIGGER IF NOT EXISTS "entry_minutes_update" '
+        'AFTER UPDATE OF "spent_minutes" ON "entry" '
+        'WHEN old."spent_minutes" IS NOT new."spent_minutes" '
+        'BEGIN ' + add_minutes + remove_minutes + 'END')
+    # The number of entries holding each term, read off the full-text index
+    # itself, so it needs no upkeep
+    database.execute_sql(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS "entry_search_vocab" '
+        'USING fts5vocab("entry_search", "row")')
+
+
+MIGRATIONS = [
+    add_lookup_indexes,
+    add_value_catalogs,
+    add_full_text_search,
+    add_daily_rollup,
+    normalize_names_and_tasks,
+    add_archive_ranges,
+    add_filter_statistics,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(database):
+    return database.execute_sql('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(database):
+    """Apply every migration the database has not seen yet.
+
+    Each step runs in its own transaction together with the version bump,
+    so an interrupted upgrade resumes from the last completed step.
+    Returns the resulting schema version.
+    """
+    version = get_schema_version(database)
+    for number in range(version, SCHEMA_VERSION):
+        with database.atomic():
+            MIGRATIONS[number](database)
+            database.execute_sql('PRAGMA user_version = {:d}'.format(
+                number + 1))
+    return max(version, SCHEMA_VERSION)
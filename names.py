@@ -0,0 +1,178 @@
+#####################################################
+# Trigram index for fuzzy employee name lookups
+#####################################################
+# NameIndex keeps, in memory, the trigrams of every employee name: the
+# three letter runs of each word of the name, lower-cased and padded with
+# two spaces in front and one behind. The trigrams inside a word have their
+# letters sorted, so that a swap of two neighbouring letters keeps most of
+# them: 'Bteh' and 'Beth' share three of their five.
+#
+# A lookup ranks the names holding at least MIN_SCORE of its trigrams:
+# 'Beth' finds Beth, Beth Smith, Bethany and Elizabeth. Only the names in
+# the smallest posting sets can reach that score, so the rest are never
+# counted. Names containing the looked up text are included too, as with
+# the substring match the lookups used before, when its words have three
+# letters or more.
+#
+# Employee rows are only ever added, so the index catches up by reading the
+# rows past the highest id it has seen; only names that still have entries
+# in the name catalog are returned, reading further down the ranking until
+# there are enough of them.
+from collections import Counter
+import heapq
+import itertools
+import math
+import re
+import threading
+
+from entry import Employee, NameCatalog
+
+
+MIN_SCORE = 0.5
+MAX_MATCHES = 20
+WORD = re.compile(r'\w+')
+NONE = frozenset()
+
+
+def trigrams(text):
+    """The set of trigrams of the words of text"""
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = '  {} '.format(word)
+        for start in range(len(padded) - 2):
+            gram = padded[start:start + 3]
+            grams.add(gram if ' ' in gram else ''.join(sorted(gram)))
+    return grams
+
+
+class NameIndex(object):
+    def __init__(self, database=None, min_score=MIN_SCORE):
+        """database defaults to the one Employee is bound to"""
+        self.database = database
+        self.min_score = min_score
+        self.lock = threading.Lock()
+        self.reset(None)
+
+    def reset(self, database):
+        self.indexed_database = database
+        self.names = {}
+        self.folded = {}
+        self.sizes = {}
+        self.postings = {}
+        self.last_id = 0
+
+    def refresh(self):
+        """Index the employees added since the last refresh"""
+        database = self.database or Employee._meta.database
+        # Plain SQL: this runs on every lookup, where building the query
+        # would cost more than running it
+        last_id = database.execute_sql(
+            'SELECT max("id") FROM "employee"').fetchone()[0] or 0
+        if database is not self.indexed_database or last_id < self.last_id:
+            self.reset(database)
+        if last_id == self.last_id:
+            return
+        added = (Employee.select(Employee.id, Employee.name)
+                 .where(Employee.id > self.last_id)
+                 .bind(database).tuples())
+        for name_id, name in added:
+            self.add(name_id, name)
+        self.last_id = last_id
+
+    def add(self, name_id, name):
+        grams = trigrams(name)
+        self.names[name_id] = name
+        self.folded[name_id] = name.lower()
+        self.sizes[name_id] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(name_id)
+
+    def matches(self, text, limit=MAX_MATCHES):
+        """Up to limit employee names like text, best match first.
+
+        Names sharing more of the trigrams of text come first, and among
+        those the ones with fewer other trigrams, so an exact match leads.
+        """
+        folded = text.strip().lower()
+        grams = trigrams(folded)
+        if not grams:
+            # Text without letters or digits has no trigrams to look up
+            return self.with_entries(self.containing(text, limit))[:limit]
+        needed = max(1, math.ceil(self.min_score * len(grams)))
+        with self.lock:
+            self.refresh()
+            postings = sorted((self.postings.get(gram, NONE)
+                               for gram in grams), key=len)
+            names, folded_names, sizes = self.names, self.folded, self.sizes
+            # When enough names share every trigram of text, no other name
+            # can rank among them
+            complete = postings[0].intersection(*postings[1:])
+            if len(complete) >= limit * 2:
+                found = self.first_with_entries(in_order(
+                    complete, lambda name_id: (sizes[name_id],
+                                               names[name_id]), names.get),
+                    limit)
+                if len(found) == limit:
+                    return found
+            # A name sharing needed trigrams is in at least one of the
+            # len(grams) - needed + 1 smallest posting sets
+            candidates = set().union(*postings[:len(grams) - needed + 1])
+            # A name containing text has every trigram of text that does
+            # not take in the padding
+            inner = sorted((self.postings.get(gram, NONE) for gram in grams
+                            if ' ' not in gram), key=len)
+            containing = inner[0].intersection(*inner[1:]) if inner else NONE
+            candidates |= containing
+            counts = Counter()
+            for posting in postings:
+                counts.update(candidates & posting)
+        ranked = [(shared, name_id) for name_id, shared in counts.items()
+                  if shared >= needed]
+        ranked.extend((counts[name_id], name_id) for name_id in containing
+                      if counts[name_id] < needed and
+                      folded in folded_names[name_id])
+        # For as many shared trigrams, fewer trigrams of its own make a
+        # name more alike to text
+        return self.first_with_entries(in_order(
+            ranked, lambda pair: (-pair[0], sizes[pair[1]], names[pair[1]]),
+            lambda pair: names[pair[1]]), limit)
+
+    def containing(self, text, limit):
+        return [row.name for row in NameCatalog
+                .select(NameCatalog.name)
+                .where(NameCatalog.name.contains(text))
+                .order_by(NameCatalog.name).limit(limit)
+                .bind(self.database or NameCatalog._meta.database)]
+
+    def first_with_entries(self, ordered, limit):
+        """The first limit names from the iterator ordered that have
+        entries, read limit * 2 at a time, as names may have none left"""
+        found = []
+        while len(found) < limit:
+            batch = list(itertools.islice(ordered, limit * 2))
+            if not batch:
+                break
+            found.extend(self.with_entries(batch))
+        return found[:limit]
+
+    def with_entries(self, candidates):
+        """candidates, in order, without the names that have no entries"""
+        if not candidates:
+            return []
+        database = self.database or NameCatalog._meta.database
+        listed = set(name for name, in database.execute_sql(
+            'SELECT "name" FROM "name_catalog" WHERE "name" IN ({})'.format(
+                ', '.join('?' * len(candidates))), candidates))
+        return [name for name in candidates if name in listed]
+
+
+def in_order(items, key, name):
+    """Yield name(item) for items from the smallest key up, sorting only as
+    far as they are read"""
+    heap = [(key(item), number, item) for number, item in enumerate(items)]
+    heapq.heapify(heap)
+    while heap:
+        yield name(heapq.heappop(heap)[2])
+
+
+name_index = NameIndex()
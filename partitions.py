@@ -0,0 +1,351 @@
+#####################################################
+# Work Log partitioned into one database file per year
+#####################################################
+# Usage:
+# python3 partitions.py split workLog.db --directory worklog-partitions
+#
+# PartitionedWorklog has the interface of service.WorklogService over a
+# directory holding worklog-<year>.db files, each a complete work log with
+# its own catalogs, search index and rollups for the entries of that year.
+# A partition is opened the first time a lookup needs it, and created the
+# first time an entry is added for its year.
+#
+# Date and date range lookups only open the partitions of the years they
+# overlap. Other lookups run in every partition and the results are merged
+# in the order of a single work log (see cursor.EntryCursor); search ranks
+# are computed per partition.
+#
+# The id of an entry is its year times ID_SPAN plus its id in the partition,
+# so get, edit and delete go straight to one file. Editing the date of an
+# entry into another year moves it to that year's partition under a new id,
+# which edit_entry returns. The move adds the entry before deleting the old
+# one, so a crash in between leaves a duplicate rather than losing it.
+#
+# Only the API serves partitions (api.py --partitions): the menus of
+# worklog_db.py and cli.py still read workLog.db alone. split copies a work
+# log into partitions without changing it, so both can be kept side by side.
+#
+# Partitions are separate connections rather than ATTACHed databases: the
+# entry models and the triggers of each file use unqualified table names,
+# SQLite attaches at most 10 databases, and in WAL mode a transaction over
+# attached files is not atomic across them anyway.
+import argparse
+import datetime
+import heapq
+import itertools
+import os
+import re
+import threading
+
+from cursor import EntryCursor, PAGE_SIZE
+from entry import Entry, Employee, Task, select_entries
+from instrumentation import operation
+from migrations import get_schema_version, SCHEMA_VERSION
+from peewee import SqliteDatabase
+import planner
+import service
+import worklog_db
+
+
+PARTITION_FILE = 'worklog-{}.db'
+PARTITION_NAME = re.compile(r'^worklog-(\d{4})\.db$')
+ID_SPAN = 10 ** 9
+SPLIT_BATCH = 1000
+
+
+def partition_years(directory):
+    """Years that have a partition file in directory, in order"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(match.group(1)) for match in
+                  map(PARTITION_NAME.match, names) if match)
+
+
+def split_id(entry_id):
+    """(year, id within the partition) of a partitioned entry id"""
+    return divmod(int(entry_id), ID_SPAN)
+
+
+class PartitionedWorklog(object):
+    def __init__(self, directory, pragmas=None,
+                 max_readers=service.MAX_READERS):
+        self.directory = directory
+        self.pragmas = pragmas
+        self.max_readers = max_readers
+        self.partitions = {}
+        self.lock = threading.Lock()
+
+    def initialize(self):
+        """Create the directory if needed; each partition is brought up to
+        date when it is first opened"""
+        os.makedirs(self.directory, exist_ok=True)
+
+    def close(self):
+        with self.lock:
+            for partition in self.partitions.values():
+                partition.close()
+            self.partitions.clear()
+
+    def path(self, year):
+        return os.path.join(self.directory, PARTITION_FILE.format(year))
+
+    def partition(self, year):
+        """The service over year's partition, opened on first use; creates
+        the partition if it does not exist yet"""
+        with self.lock:
+            partition = self.partitions.get(year)
+            if partition is None:
+                partition = service.WorklogService(
+                    self.path(year), pragmas=self.pragmas,
+                    max_readers=self.max_readers)
+                partition.initialize()
+                self.partitions[year] = partition
+            return partition
+
+    def years(self, filters):
+        """Years of the existing partitions the date filters can match"""
+        years = partition_years(self.directory)
+        date = filters.get('date')
+        first = filters.get('start_date') or datetime.date.min
+        last = filters.get('end_date') or datetime.date.max
+        if date is not None:
+            first, last = max(first, date), min(last, date)
+        return [year for year in years if first.year <= year <= last.year]
+
+    ########################################################
+    # Writes
+    ########################################################
+    def add_entry(self, name, task, spent_minutes, notes='', timestamp=None):
+        """Add an entry and return its id"""
+        return self.add_entries([dict(name=name, task=task,
+                                      spent_minutes=spent_minutes,
+                                      notes=notes, timestamp=timestamp)])[0]
+
+    @operation
+    def add_entries(self, entries):
+        """Add entries, given as dicts of add_entry arguments, and return
+        their ids; the entries of each year are added in one transaction"""
+        by_year = {}
+        for position, entry in enumerate(entries):
+            timestamp = service.clean_values(
+                timestamp=entry.get('timestamp') or
+                datetime.date.today())['timestamp']
+            by_year.setdefault(timestamp.year, []).append(
+                (position, dict(entry, timestamp=timestamp)))
+        ids = [None] * len(entries)
+        for year, year_entries in sorted(by_year.items()):
+            added = self.partition(year).add_entries(
+                [entry for _, entry in year_entries])
+            for (position, _), entry_id in zip(year_entries, added):
+                ids[position] = year * ID_SPAN + entry_id
+        return ids
+
+    @operation
+    def edit_entry(self, entry_id, **changes):
+        """Change fields of an entry and return its id, which is new if the
+        entry moved to another year; None if there is no such entry"""
+        unknown = set(changes) - set(service.EDITABLE_FIELDS)
+        if unknown:
+            raise ValueError("Cannot edit {}".format(', '.join(
+                sorted(unknown))))
+        year, local_id = split_id(entry_id)
+        if year not in partition_years(self.directory):
+            return None
+        partition = self.partition(year)
+        timestamp = changes.get('timestamp')
+        if timestamp is not None:
+            timestamp = service.clean_values(timestamp=timestamp)['timestamp']
+        if timestamp is None or timestamp.year == year:
+            return entry_id if partition.edit_entry(local_id, **changes) \
+                else None
+        entry = partition.get_entry(local_id)
+        if entry is None:
+            return None
+        moved = dict(name=entry.name, task=entry.task,
+                     spent_minutes=entry.spent_minutes, notes=entry.notes)
+        moved.update(changes, timestamp=timestamp)
+        new_id = self.add_entry(**moved)
+        partition.delete_entry(local_id)
+        return new_id
+
+    @operation
+    def delete_entry(self, entry_id):
+        """Delete an entry; False if there is no such entry"""
+        year, local_id = split_id(entry_id)
+        if year not in partition_years(self.directory):
+            return False
+        return self.partition(year).delete_entry(local_id)
+
+    ########################################################
+    # Reads
+    ########################################################
+    @operation
+    def get_entry(self, entry_id):
+        year, local_id = split_id(entry_id)
+        if year not in partition_years(self.directory):
+            return None
+        entry = self.partition(year).get_entry(local_id)
+        if entry is not None:
+            entry.id = entry_id
+        return entry
+
+    def _merged(self, filters, after, limit):
+        """(sort key, entry) pairs of the first limit entries past after,
+        merged from the partitions that can match the filters"""
+        pages = []
+        for year in self.years(filters):
+            base = year * ID_SPAN
+            partition = self.partition(year)
+            # The last part of a key is the entry id, which is the
+            # partitioned id outside the partition
+            local_after = None if after is None else \
+                tuple(after[:-1]) + (after[-1] - base,)
+            # Each partition plans for its own entries; the plans order the
+            # entries alike, whichever filter they find them by
+            with partition.read_db.connection_context():
+                query = planner.plan_query(partition.read_db,
+                                           **filters).query
+                cursor = EntryCursor(query, limit, after=local_after)
+            page = []
+            for entry in cursor.page:
+                key = cursor.key(entry)[:-1] + (base + entry.id,)
+                entry.id = base + entry.id
+                page.append((key, entry))
+            pages.append(page)
+        merged = heapq.merge(*pages, key=lambda pair: pair[0])
+        return list(itertools.islice(merged, limit))
+
+    @operation
+    def find_entries(self, limit=None, **filters):
+        """Entries matching the filters of worklog_db.filter_entries, by
+        date, or by rank for a full-text search"""
+        return [entry for _, entry in self._merged(filters, None, limit)]
+
+    @operation
+    def find_page(self, after=None, page_size=PAGE_SIZE, **filters):
+        """One page of the entries matching the filters and the key to pass
+        as after for the next page, None on the last page"""
+        page = self._merged(filters, after, page_size)
+        if len(page) < page_size:
+            return [entry for _, entry in page], None
+        return [entry for _, entry in page], page[-1][0]
+
+    def find_by_employee(self, name, limit=None):
+        return self.find_entries(limit, employee=name)
+
+    def find_by_date(self, date, limit=None):
+        return self.find_entries(limit, date=date)
+
+    def find_by_date_range(self, start_date, end_date, limit=None):
+        return self.find_entries(limit, start_date=start_date,
+                                 end_date=end_date)
+
+    def find_by_spent_minutes(self, spent_minutes, limit=None):
+        return self.find_entries(limit, spent_minutes=spent_minutes)
+
+    def find_by_search_term(self, search_term, mode='match', limit=None):
+        return self.find_entries(limit, search_term=search_term,
+                                 search_mode=mode)
+
+    @operation
+    def minutes_histogram(self,
+                          bucket_minutes=worklog_db.HISTOGRAM_BUCKET_MINUTES,
+                          buckets=worklog_db.HISTOGRAM_BUCKETS, **filters):
+        """The histograms of the partitions the filters can match, added
+        up bucket by bucket"""
+        totals = {}
+        for year in self.years(filters):
+            for low, high, count, minutes in self.partition(
+                    year).minutes_histogram(bucket_minutes, buckets,
+                                            **filters):
+                _, _, total_count, total_minutes = totals.get(
+                    low, (low, high, 0, 0))
+                totals[low] = (low, high, total_count + count,
+                               total_minutes + minutes)
+        return [totals[low] for low in sorted(totals)]
+
+    @operation
+    def explain(self, **filters):
+        """The plans of the partitions the filters can match, each under
+        the year of its partition"""
+        lines = []
+        for year in self.years(filters):
+            lines.append('{}:'.format(year))
+            lines.extend(self.partition(year).explain(**filters))
+        return lines
+
+    @operation
+    def employee_names(self):
+        names = set()
+        for year in partition_years(self.directory):
+            names.update(self.partition(year).employee_names())
+        return sorted(names)
+
+    @operation
+    def entry_dates(self):
+        return [date for year in partition_years(self.directory)
+                for date in self.partition(year).entry_dates()]
+
+
+def split(source, directory):
+    """Copy the entries of the work log file source into partitions in
+    directory and return the number copied. Entries get new ids.
+
+    The source is only read; raises ValueError if it needs migrating first.
+    """
+    if not os.path.isfile(source):
+        raise ValueError("No work log at {}".format(source))
+    source_db = SqliteDatabase(source, pragmas=[('query_only', 1)])
+    try:
+        version = get_schema_version(source_db)
+    finally:
+        source_db.close()
+    if version != SCHEMA_VERSION:
+        raise ValueError(
+            "{} is at schema version {}, not {}; migrate it first, as "
+            "worklog_db.py does when it starts".format(source, version,
+                                                       SCHEMA_VERSION))
+    worklog = PartitionedWorklog(directory)
+    worklog.initialize()
+    count = 0
+    try:
+        with source_db.bind_ctx([Entry, Employee, Task]):
+            entries = (select_entries()
+                       .order_by(Entry.timestamp, Entry.id)
+                       .iterator())
+            while True:
+                batch = [dict(name=entry.name, task=entry.task,
+                              spent_minutes=entry.spent_minutes,
+                              notes=entry.notes, timestamp=entry.timestamp)
+                         for entry in itertools.islice(entries, SPLIT_BATCH)]
+                if not batch:
+                    break
+                worklog.add_entries(batch)
+                count += len(batch)
+    finally:
+        worklog.close()
+        source_db.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Split a work log into one database file per year")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split_parser = commands.add_parser(
+        'split', help="copy the entries of a work log into partitions")
+    split_parser.add_argument('source')
+    split_parser.add_argument('--directory', default='worklog-partitions')
+    args = parser.parse_args(argv)
+    try:
+        count = split(args.source, args.directory)
+    except ValueError as error:
+        parser.error(str(error))
+    print("Copied {} entries into {}".format(count, args.directory))
+    return count
+
+
+if __name__ == '__main__':
+    main()
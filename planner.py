@@ -0,0 +1,153 @@
+#####################################################
+# Planner for lookups combining several filters
+#####################################################
+# plan_query takes any mix of the filters of worklog_db.filter_entries,
+# such as Beth's entries of March 2016 over 60 minutes mentioning deploy,
+# and picks the one filter SQLite should find the entries through; the
+# others are then checked on each entry found. The single SQL statement is
+# filter_entries(use_index=...) over the filters.
+#
+# The choice rests on how many entries each filter matches, estimated from
+# statistics the database keeps up to date as entries change, without
+# reading the entries: the name, date and minutes catalogs and the term
+# counts of the full-text index. SQLite's own statistics, from ANALYZE,
+# know how many entries an employee has on average, not how many Beth has,
+# and nothing of how wide a range of dates or minutes is.
+#
+# Checking a search on an entry found another way means looking the entry
+# up in the full-text index, which costs about as much as reading
+# SEARCH_CHECK_COST entries from the index while searching, so the search
+# leads unless another filter matches that many times fewer entries.
+#
+# QueryPlan.explain() shows the estimates, the choice and SQLite's plan for
+# the statement, as printed by cli.py find --explain.
+import re
+
+from peewee import fn
+
+from entry import (Entry, NameCatalog, DateCatalog, MinutesCatalog,
+                   EntrySearchVocab)
+import worklog_db
+
+
+SEARCH_CHECK_COST = 500
+# The index each filter of worklog_db.FILTER_INDEXES finds entries through
+INDEX_NAMES = {
+    'employee': 'entry_employee_id_timestamp',
+    'date': 'entry_timestamp',
+    'minutes': 'entry_spent_minutes_timestamp',
+    'search': 'entry_search',
+}
+# Full-text terms as the index splits and folds them
+TERM = re.compile(r'\w+')
+
+
+class QueryPlan(object):
+    def __init__(self, database, filters, estimates, driver):
+        self.database = database
+        self.filters = filters
+        self.estimates = estimates
+        self.driver = driver
+
+    @property
+    def query(self):
+        """The filter_entries() query carrying out the plan"""
+        return worklog_db.filter_entries(use_index=self.driver,
+                                         **self.filters).bind(self.database)
+
+    def explain(self):
+        """Lines describing the plan"""
+        lines = ['{:<9} ~{} entries'.format(path, estimate)
+                 for path, estimate in self.estimates.items()]
+        if self.driver is None:
+            lines.append("SQLite picks the index")
+        else:
+            lines.append("Find entries by {} through {}".format(
+                self.driver, INDEX_NAMES[self.driver]))
+        sql, params = self.query.sql()
+        lines.extend('  ' + row[-1] for row in self.database.execute_sql(
+            'EXPLAIN QUERY PLAN ' + sql, params))
+        return lines
+
+
+def plan_query(database=None, **filters):
+    """QueryPlan for the entries matching filters, the keyword arguments of
+    worklog_db.filter_entries, in database, by default the one Entry is
+    bound to"""
+    database = database or Entry._meta.database
+    estimates = estimate_filters(database, **filters)
+    driver = None
+    # With one filter there is nothing to choose between
+    if len(estimates) > 1:
+        def cost(path):
+            if path != 'search' and 'search' in estimates:
+                return estimates[path] * SEARCH_CHECK_COST
+            return estimates[path]
+        driver = min(estimates, key=cost)
+    return QueryPlan(database, filters, estimates, driver)
+
+
+def estimate_filters(database, employee=None, date=None, start_date=None,
+                     end_date=None, spent_minutes=None, search_term=None,
+                     search_mode='match', min_minutes=None, max_minutes=None,
+                     **_):
+    """The number of entries each given filter with an index matches, by
+    worklog_db.FILTER_INDEXES name, in that order"""
+    def total(query):
+        return query.bind(database).scalar() or 0
+    estimates = {}
+    if employee is not None:
+        estimates['employee'] = total(
+            NameCatalog.select(fn.sum(NameCatalog.entry_count))
+            .where(NameCatalog.name.contains(employee)))
+    if (date, start_date, end_date) != (None, None, None):
+        query = DateCatalog.select(fn.sum(DateCatalog.entry_count))
+        for first in (date, start_date):
+            if first is not None:
+                query = query.where(DateCatalog.date >= first)
+        for last in (date, end_date):
+            if last is not None:
+                query = query.where(DateCatalog.date <= last)
+        estimates['date'] = total(query)
+    if (spent_minutes, min_minutes, max_minutes) != (None, None, None):
+        query = MinutesCatalog.select(fn.sum(MinutesCatalog.entry_count))
+        for low in (spent_minutes, min_minutes):
+            if low is not None:
+                query = query.where(MinutesCatalog.spent_minutes >= low)
+        for high in (spent_minutes, max_minutes):
+            if high is not None:
+                query = query.where(MinutesCatalog.spent_minutes <= high)
+        estimates['minutes'] = total(query)
+    if search_term is not None and search_mode == 'match':
+        # A substring search has no index to find entries through
+        estimate = estimate_search(database, search_term)
+        if estimate is not None:
+            estimates['search'] = estimate
+    return estimates
+
+
+def estimate_search(database, search_term):
+    """The number of entries matching search_term, read as
+    worklog_db.full_text_query reads it, at most; None if it has no words.
+
+    Every part of the term must match, so the estimate is the count of its
+    rarest word. The count of a prefix adds up the terms it starts, which
+    counts an entry holding several of them more than once.
+    """
+    estimates = []
+    for phrase, word in worklog_db.FULL_TEXT_TERM.findall(search_term):
+        terms = TERM.findall((phrase or word.rstrip('*')).lower())
+        prefix = word.endswith('*') and terms
+        for number, term in enumerate(terms, 1):
+            query = EntrySearchVocab.select(fn.sum(EntrySearchVocab.doc))
+            if prefix and number == len(terms):
+                # The terms from term up to the first one past every term
+                # starting with it
+                query = query.where(
+                    EntrySearchVocab.term >= term,
+                    EntrySearchVocab.term <
+                    term[:-1] + chr(ord(term[-1]) + 1))
+            else:
+                query = query.where(EntrySearchVocab.term == term)
+            estimates.append(query.bind(database).scalar() or 0)
+    return min(estimates) if estimates else None
@@ -0,0 +1,294 @@
+#####################################################
+# Time reports from the daily rollup
+#####################################################
+# Usage:
+# python3 reports.py --by employee --by month [--from 01/01/2016] \
+#     [--to 12/31/2016] [--employee Beth] [--format csv]
+# python3 reports.py --histogram 30 [--buckets 9] [--from 01/01/2016] ...
+# python3 reports.py --by employee --workers 8 [--shards 32] ...
+#
+# Totals of spent minutes and entry counts, grouped by any mix of employee,
+# task, day, week and month. They are read from the daily_rollup table,
+# which triggers keep in step with every insert, edit and delete, so a
+# report reads at most one row per day, employee and task.
+#
+# --histogram counts the entries instead by minutes spent, in buckets of
+# the given width (see worklog_db.minutes_histogram); the rollup has no
+# minutes of single entries, so it reads the entries in one pass.
+#
+# --workers reads the entries themselves in that many processes: the dates
+# are split into shards holding about as many entries each, by the counts
+# of the date catalog, each shard is totalled by a worker over its own
+# read-only connection and the partial totals are added up. The shards are
+# independent, so the time taken falls with the number of cores. With
+# --workers 1 the same shards are totalled one after the other in this
+# process, which gives the same report, as does the rollup.
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import datetime
+import os
+import sys
+
+from peewee import SqliteDatabase, fn
+
+from entry import DailyRollup, DateCatalog, Employee, Entry, Task
+import worklog_db
+
+
+GROUPINGS = {
+    'employee': DailyRollup.name,
+    'task': DailyRollup.task,
+    'day': DailyRollup.date,
+    'week': fn.strftime('%Y-W%W', DailyRollup.date),
+    'month': fn.strftime('%Y-%m', DailyRollup.date),
+}
+
+# The groupings read from the entries: employees and tasks by id, named
+# once the shards are added up. The day is read as a date, like the
+# rollup's, from either form of stored timestamp.
+ENTRY_GROUPINGS = {
+    'employee': Entry.employee,
+    'task': Entry.task_ref,
+    'day': fn.substr(Entry.timestamp, 1, 10).coerce(False),
+    'week': fn.strftime('%Y-W%W', fn.substr(Entry.timestamp, 1, 10)),
+    'month': fn.substr(Entry.timestamp, 1, 7).coerce(False),
+}
+# Shards per worker, so that a worker done early takes on another shard
+SHARDS_PER_WORKER = 4
+
+
+def time_report(group_by, start_date=None, end_date=None, employee=None):
+    """Return (group values..., total minutes, entry count) rows.
+
+    group_by is a sequence of GROUPINGS names; the date range is inclusive
+    and employee is matched as part of the name, as in find_by_employee.
+    """
+    columns = [GROUPINGS[name].alias(name) for name in group_by]
+    query = DailyRollup.select(
+        *columns + [fn.sum(DailyRollup.total_minutes).alias('total_minutes'),
+                    fn.sum(DailyRollup.entry_count).alias('entry_count')])
+    if start_date is not None:
+        query = query.where(DailyRollup.date >= start_date)
+    if end_date is not None:
+        query = query.where(DailyRollup.date <= end_date)
+    if employee is not None:
+        query = query.where(DailyRollup.name.contains(employee))
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+    return list(query.tuples())
+
+
+########################################################
+# Reports over date shards
+########################################################
+def shard_dates(shards, start_date=None, end_date=None):
+    """Split the dates from start_date to end_date, either of which may be
+    open, into at most shards consecutive (first, last) ranges holding
+    about as many entries each. The ranges cover every date in between,
+    with or without entries, so together they match what the whole range
+    matches."""
+    assert shards > 0
+    query = (DateCatalog.select(DateCatalog.date, DateCatalog.entry_count)
+             .order_by(DateCatalog.date))
+    if start_date is not None:
+        query = query.where(DateCatalog.date >= start_date)
+    if end_date is not None:
+        query = query.where(DateCatalog.date <= end_date)
+    counts = list(query.tuples())
+    total = sum(count for _, count in counts)
+    # A shard starts at the first date past its share of the entries
+    starts, seen = [], 0
+    for date, count in counts:
+        if seen >= total * (len(starts) + 1) / shards:
+            starts.append(date)
+        seen += count
+    firsts = [start_date] + starts
+    lasts = [start - datetime.timedelta(days=1) for start in starts] + [
+        end_date]
+    return list(zip(firsts, lasts))
+
+
+def run_shards(function, shards, workers=None):
+    """function(*arguments) for each arguments of shards, in order, run by
+    workers processes, or in this process with workers=1"""
+    if workers == 1:
+        return [function(*arguments) for arguments in shards]
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(function, *zip(*shards)))
+
+
+def shard_time_report(path, group_by, start_date, end_date, employee):
+    """(group values..., total minutes, entry count) rows of the entries of
+    one shard of the database at path, employees and tasks by id"""
+    shard_db = SqliteDatabase(path, pragmas=[('query_only', 1)])
+    with shard_db.connection_context():
+        columns = [ENTRY_GROUPINGS[name] for name in group_by]
+        query = worklog_db.filter_entries(
+            employee=employee, start_date=start_date, end_date=end_date,
+            names=False).select(*columns + [fn.sum(Entry.spent_minutes),
+                                            fn.count(Entry.id)])
+        if columns:
+            query = query.group_by(*columns)
+        return list(query.tuples().bind(shard_db))
+
+
+def sharded_time_report(group_by, start_date=None, end_date=None,
+                        employee=None, workers=None, shards=None):
+    """time_report() added up from the entries of the date shards, each
+    totalled by one of workers processes, by default one per core"""
+    workers = workers or os.cpu_count()
+    path = Entry._meta.database.database
+    arguments = [(path, group_by, first, last, employee)
+                 for first, last in shard_dates(
+                     shards or workers * SHARDS_PER_WORKER, start_date,
+                     end_date)]
+    totals = {}
+    for rows in run_shards(shard_time_report, arguments, workers):
+        for row in rows:
+            key, minutes, count = row[:-2], row[-2] or 0, row[-1]
+            total_minutes, total_count = totals.get(key, (0, 0))
+            totals[key] = (total_minutes + minutes, total_count + count)
+    names = {}
+    for name, model in (('employee', Employee), ('task', Task)):
+        if name in group_by:
+            names[name] = dict(model.select(model.id, model.name).tuples())
+    rows = []
+    for key, (minutes, count) in totals.items():
+        key = tuple(group_value(names, name, value)
+                    for name, value in zip(group_by, key))
+        # As sum() and count() over no entries at all, without groupings
+        rows.append(key + ((minutes, count) if count else (None, None)))
+    return sorted(rows)
+
+
+def group_value(names, name, value):
+    """The value of a grouping in a shard row as time_report() gives it:
+    employees and tasks by name, and days, which the shards group as
+    'YYYY-MM-DD' text, as dates"""
+    if name in names:
+        return names[name][value]
+    if name == 'day':
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+def shard_histogram(path, bucket_minutes, buckets, start_date, end_date,
+                    employee):
+    """worklog_db.minutes_histogram() of the entries of one shard of the
+    database at path"""
+    shard_db = SqliteDatabase(path, pragmas=[('query_only', 1)])
+    with shard_db.connection_context():
+        return worklog_db.minutes_histogram(
+            worklog_db.filter_entries(
+                employee=employee, start_date=start_date, end_date=end_date,
+                names=False).bind(shard_db), bucket_minutes, buckets)
+
+
+def sharded_histogram(bucket_minutes=worklog_db.HISTOGRAM_BUCKET_MINUTES,
+                      buckets=worklog_db.HISTOGRAM_BUCKETS, start_date=None,
+                      end_date=None, employee=None, workers=None,
+                      shards=None):
+    """worklog_db.minutes_histogram() added up bucket by bucket from the
+    date shards, each counted by one of workers processes"""
+    workers = workers or os.cpu_count()
+    path = Entry._meta.database.database
+    arguments = [(path, bucket_minutes, buckets, first, last, employee)
+                 for first, last in shard_dates(
+                     shards or workers * SHARDS_PER_WORKER, start_date,
+                     end_date)]
+    totals = {}
+    for rows in run_shards(shard_histogram, arguments, workers):
+        for low, high, count, minutes in rows:
+            _, _, total_count, total_minutes = totals.get(
+                low, (low, high, 0, 0))
+            totals[low] = (low, high, total_count + count,
+                           total_minutes + minutes)
+    return [totals[low] for low in sorted(totals)]
+
+
+def print_report(group_by, rows):
+    header = list(group_by) + ['minutes', 'entries']
+    table = [header] + [[str(value) for value in row] for row in rows]
+    widths = [max(len(row[column]) for row in table)
+              for column in range(len(header))]
+    for row in table:
+        print('  '.join(value.ljust(width)
+                        for value, width in zip(row, widths)).rstrip())
+
+
+def histogram_report(args):
+    if args.workers is None:
+        rows = worklog_db.minutes_histogram(
+            worklog_db.filter_entries(employee=args.employee,
+                                      start_date=args.start_date,
+                                      end_date=args.end_date, names=False),
+            args.histogram, args.buckets)
+    else:
+        rows = sharded_histogram(args.histogram, args.buckets,
+                                 args.start_date, args.end_date,
+                                 args.employee, args.workers, args.shards)
+    if args.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['low', 'high', 'entries', 'minutes'])
+        writer.writerows(rows)
+    else:
+        worklog_db.print_histogram(rows)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report minutes spent, grouped from the daily rollup")
+    kinds = parser.add_mutually_exclusive_group()
+    kinds.add_argument('--by', action='append', choices=sorted(GROUPINGS),
+                       dest='group_by', help="repeat to nest groupings")
+    kinds.add_argument('--histogram', type=int, metavar='MINUTES',
+                       help="count entries in buckets this many minutes "
+                            "wide")
+    parser.add_argument('--buckets', type=int,
+                        default=worklog_db.HISTOGRAM_BUCKETS,
+                        help="with --histogram; the last is open-ended")
+    parser.add_argument('--from', dest='start_date',
+                        type=worklog_db.parse_date)
+    parser.add_argument('--to', dest='end_date', type=worklog_db.parse_date)
+    parser.add_argument('--employee', help="part of the employee name")
+    parser.add_argument('--format', choices=('table', 'csv'),
+                        default='table')
+    parser.add_argument('--workers', type=int,
+                        help="read the entries in this many processes "
+                             "instead; 1 reads them in this one")
+    parser.add_argument('--shards', type=int,
+                        help="with --workers, date shards to split the "
+                             "entries into (default: {} per worker)".format(
+                                 SHARDS_PER_WORKER))
+    args = parser.parse_args(argv)
+    if args.histogram is not None and (args.histogram < 1 or
+                                       args.buckets < 1):
+        parser.error("--histogram and --buckets must be positive")
+    if args.shards is not None and args.workers is None:
+        parser.error("--shards needs --workers")
+    if any(value is not None and value < 1
+           for value in (args.workers, args.shards)):
+        parser.error("--workers and --shards must be positive")
+    group_by = args.group_by or ['employee']
+    worklog_db.initialize()
+    if args.histogram is not None:
+        return histogram_report(args)
+    if args.workers is None:
+        rows = time_report(group_by, args.start_date, args.end_date,
+                           args.employee)
+    else:
+        rows = sharded_time_report(group_by, args.start_date, args.end_date,
+                                   args.employee, args.workers, args.shards)
+    if args.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(group_by + ['minutes', 'entries'])
+        writer.writerows(rows)
+    else:
+        print_report(group_by, rows)
+    return rows
+
+
+if __name__ == '__main__':
+    main()
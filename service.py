@@ -0,0 +1,265 @@
+#####################################################
+# Thread-safe service layer over the Work Log database
+#####################################################
+# WorklogService exposes add, edit, delete and the find_by_* lookups as plain
+# methods taking and returning values, for use from many threads at once.
+#
+# Reads go through a pool of query_only connections, so with the WAL journal
+# concurrent readers each run on their own connection. Writes go through a
+# single connection guarded by a lock and open their transactions with
+# BEGIN IMMEDIATE, so writers queue up in this process instead of retrying
+# on SQLITE_BUSY.
+import datetime
+import threading
+
+from playhouse.pool import PooledSqliteDatabase
+
+import archive
+from cursor import EntryCursor, PAGE_SIZE
+from entry import (Entry, Employee, Task, NameCatalog, DateCatalog,
+                   select_entries)
+from instrumentation import (InstrumentedDatabase,
+                             InstrumentedSqliteDatabase, operation)
+from migrations import migrate, get_schema_version, SCHEMA_VERSION
+from names import NameIndex, MAX_MATCHES
+import planner
+from settings import load_pragmas
+import worklog_db
+
+
+MAX_READERS = 16
+# Seconds a reader waits for a pooled connection when all are in use
+READER_WAIT = 30
+EDITABLE_FIELDS = ('name', 'task', 'spent_minutes', 'notes', 'timestamp')
+
+
+class InstrumentedPooledSqliteDatabase(InstrumentedDatabase,
+                                       PooledSqliteDatabase):
+    pass
+
+
+class WorklogService(object):
+    def __init__(self, path, pragmas=None, max_readers=MAX_READERS):
+        pragmas = list(load_pragmas() if pragmas is None else pragmas)
+        self.write_db = InstrumentedSqliteDatabase(
+            path, pragmas=pragmas, thread_safe=False, check_same_thread=False,
+            lock_type='IMMEDIATE')
+        self.read_db = InstrumentedPooledSqliteDatabase(
+            path, pragmas=pragmas + [('query_only', 1)],
+            max_connections=max_readers, timeout=READER_WAIT,
+            check_same_thread=False)
+        self.write_lock = threading.Lock()
+        self.name_index = NameIndex(self.read_db)
+
+    def initialize(self):
+        """Create the schema if needed and bring it up to date"""
+        with self.write_lock, self.write_db.connection_context():
+            if get_schema_version(self.write_db) != SCHEMA_VERSION:
+                migrate(self.write_db)
+
+    def close(self):
+        self.read_db.close_all()
+        with self.write_lock:
+            self.write_db.close()
+
+    ########################################################
+    # Writes
+    ########################################################
+    def _write(self, build):
+        """Run the queries build returns in one transaction and return their
+        results; build runs inside the transaction, so names it interns are
+        committed with the queries that use them"""
+        with self.write_lock:
+            if self.write_db.is_closed():
+                self.write_db.connect()
+            with self.write_db.atomic():
+                return [query.bind(self.write_db).execute()
+                        for query in build()]
+
+    def _interned(self, values):
+        """values with name and task replaced by the ids they are stored
+        under"""
+        values = dict(values)
+        if 'name' in values:
+            values['employee'] = Employee.intern(values.pop('name'),
+                                                 self.write_db)
+        if 'task' in values:
+            values['task_ref'] = Task.intern(values.pop('task'),
+                                             self.write_db)
+        return values
+
+    def add_entry(self, name, task, spent_minutes, notes='', timestamp=None):
+        """Add an entry and return its id"""
+        return self.add_entries([dict(name=name, task=task,
+                                      spent_minutes=spent_minutes,
+                                      notes=notes, timestamp=timestamp)])[0]
+
+    @operation
+    def add_entries(self, entries):
+        """Add entries, given as dicts of add_entry arguments, in a single
+        transaction and return their ids"""
+        values = [clean_values(name=entry['name'], task=entry['task'],
+                               spent_minutes=entry['spent_minutes'],
+                               notes=entry.get('notes', ''),
+                               timestamp=entry.get('timestamp') or
+                               datetime.date.today())
+                  for entry in entries]
+        return self._write(lambda: [Entry.insert(**self._interned(value))
+                                    for value in values])
+
+    @operation
+    def edit_entry(self, entry_id, **changes):
+        """Change fields of an entry; False if there is no such entry"""
+        unknown = set(changes) - set(EDITABLE_FIELDS)
+        if unknown:
+            raise ValueError("Cannot edit {}".format(', '.join(
+                sorted(unknown))))
+        if not changes:
+            return False
+        values = clean_values(**changes)
+        return self._write(lambda: [
+            Entry.update(**self._interned(values)).where(
+                Entry.id == entry_id)])[0] > 0
+
+    @operation
+    def delete_entry(self, entry_id):
+        """Delete an entry; False if there is no such entry"""
+        return self._write(lambda: [
+            Entry.delete().where(Entry.id == entry_id)])[0] > 0
+
+    ########################################################
+    # Reads
+    ########################################################
+    def _read(self, query, limit=None):
+        if limit is not None:
+            query = query.limit(limit)
+        with self.read_db.connection_context():
+            return list(query.bind(self.read_db))
+
+    def _plan(self, filters):
+        """planner.QueryPlan for the filters over the read connections"""
+        with self.read_db.connection_context():
+            return planner.plan_query(self.read_db, **filters)
+
+    @operation
+    def get_entry(self, entry_id):
+        entries = self._read(select_entries().where(Entry.id == entry_id))
+        return entries[0] if entries else None
+
+    @operation
+    def find_entries(self, limit=None, include_archive=False, **filters):
+        """Entries matching the filters of worklog_db.filter_entries, followed
+        with include_archive by the matching entries of archive.py files"""
+        entries = self._read(self._plan(filters).query, limit)
+        if include_archive and (limit is None or len(entries) < limit):
+            with self.read_db.connection_context():
+                entries.extend(archive.find_archived(
+                    self.read_db, None if limit is None else
+                    limit - len(entries), **filters))
+        return entries
+
+    @operation
+    def find_page(self, after=None, page_size=PAGE_SIZE, **filters):
+        """One page of the entries matching the filters.
+
+        Returns the entries and the key to pass as after for the next page,
+        which is None on the last page.
+        """
+        query = self._plan(filters).query
+        with self.read_db.connection_context():
+            entries = EntryCursor(query, page_size, after=after)
+        if len(entries.page) < page_size:
+            return entries.page, None
+        return entries.page, entries.key(entries.page[-1])
+
+    def find_by_employee(self, name, limit=None):
+        return self.find_entries(limit, employee=name)
+
+    def find_by_date(self, date, limit=None):
+        return self.find_entries(limit, date=date)
+
+    def find_by_date_range(self, start_date, end_date, limit=None):
+        return self.find_entries(limit, start_date=start_date,
+                                 end_date=end_date)
+
+    def find_by_spent_minutes(self, spent_minutes, limit=None):
+        return self.find_entries(limit, spent_minutes=spent_minutes)
+
+    def find_by_search_term(self, search_term, mode='match', limit=None):
+        return self.find_entries(limit, search_term=search_term,
+                                 search_mode=mode)
+
+    @operation
+    def minutes_histogram(self,
+                          bucket_minutes=worklog_db.HISTOGRAM_BUCKET_MINUTES,
+                          buckets=worklog_db.HISTOGRAM_BUCKETS, **filters):
+        """Entry counts by minutes spent, as worklog_db.minutes_histogram,
+        of the entries matching the filters"""
+        query = worklog_db.filter_entries(names=False, **filters).bind(
+            self.read_db)
+        with self.read_db.connection_context():
+            return worklog_db.minutes_histogram(query, bucket_minutes,
+                                                buckets)
+
+    @operation
+    def explain(self, **filters):
+        """Lines describing how the entries matching the filters are found
+        (see planner.py)"""
+        plan = self._plan(filters)
+        with self.read_db.connection_context():
+            return plan.explain()
+
+    @operation
+    def matching_names(self, text, limit=MAX_MATCHES):
+        """Employee names like text, best match first (see names.py)"""
+        with self.read_db.connection_context():
+            return self.name_index.matches(text, limit)
+
+    @operation
+    def employee_names(self):
+        query = NameCatalog.select(NameCatalog.name).order_by(NameCatalog.name)
+        return [row.name for row in self._read(query)]
+
+    @operation
+    def entry_dates(self):
+        query = DateCatalog.select(DateCatalog.date).order_by(DateCatalog.date)
+        return [row.date for row in self._read(query)]
+
+
+def clean_values(**values):
+    """Validate entry field values with the rules of the input prompts.
+
+    Raises ValueError for anything the prompts would not accept: name, task
+    and notes must be text, minutes a whole number or its digits, and the
+    timestamp a date, a datetime or a date as parse_date reads it.
+    """
+    for field in ('name', 'task', 'notes'):
+        if field in values and not isinstance(values[field], str):
+            raise ValueError("{} must be text".format(field))
+    for field in ('name', 'task'):
+        if field in values:
+            values[field] = values[field].strip()
+            if not worklog_db.is_valid_text(values[field]):
+                raise ValueError("{} cannot be blank".format(field))
+    if 'spent_minutes' in values:
+        spent_minutes = values['spent_minutes']
+        # int() would also take 1.9, True or ' -0 '
+        if isinstance(spent_minutes, bool) or not (
+                isinstance(spent_minutes, int) or
+                isinstance(spent_minutes, str) and
+                spent_minutes.strip().isdigit()):
+            raise ValueError("Minutes must be a whole, non-negative number")
+        try:
+            values['spent_minutes'] = worklog_db.parse_spent_minutes(
+                spent_minutes)
+        except AssertionError:
+            raise ValueError("Minutes must be a whole, non-negative number")
+    if 'notes' in values:
+        values['notes'] = values['notes'].strip()
+    if 'timestamp' in values:
+        timestamp = values['timestamp']
+        if isinstance(timestamp, str):
+            values['timestamp'] = worklog_db.parse_date(timestamp)
+        elif not isinstance(timestamp, datetime.date):
+            raise ValueError("timestamp must be a date")
+    return values
@@ -0,0 +1,158 @@
+#####################################################
+# Configuration of the Work Log database connection and caches
+#####################################################
+# The pragmas below are applied to every connection. Each one can be
+# overridden in the [pragmas] section of worklog.ini (or of the file named by
+# WORKLOG_CONFIG), and again by a WORKLOG_PRAGMA_<NAME> environment variable,
+# e.g. WORKLOG_PRAGMA_SYNCHRONOUS=full. The lookup cache is configured the
+# same way through the [cache] section and WORKLOG_CACHE_<NAME>, and query
+# instrumentation through [instrumentation] and WORKLOG_INSTRUMENTATION_<NAME>.
+#
+# To see the settings of an open connection:
+# python3 settings.py
+from collections import OrderedDict
+import configparser
+import os
+import re
+
+
+CONFIG_FILE = 'worklog.ini'
+CONFIG_ENV = 'WORKLOG_CONFIG'
+PRAGMA_ENV_PREFIX = 'WORKLOG_PRAGMA_'
+
+# WAL lets readers carry on while another terminal writes, and NORMAL
+# synchronous is durable against application crashes in WAL mode. The cache
+# and mmap sizes favour large scans; a negative cache_size is in KiB.
+# Incremental auto_vacuum lets archive.py hand freed pages back a few at a
+# time; it only takes effect in a new file, or after one full VACUUM, which
+# archive.compact runs on older files.
+DEFAULT_PRAGMAS = OrderedDict([
+    ('auto_vacuum', 'incremental'),
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('cache_size', '-65536'),
+    ('mmap_size', '268435456'),
+    ('temp_store', 'memory'),
+    ('busy_timeout', '5000'),
+])
+
+# size is the number of lookups kept, ttl how many seconds a result may be
+# reused (bounding how stale writes from other processes can make it) and
+# max_ids the largest result worth caching.
+DEFAULT_CACHE_SETTINGS = OrderedDict([
+    ('size', 128),
+    ('ttl', 300),
+    ('max_ids', 10000),
+])
+CACHE_ENV_PREFIX = 'WORKLOG_CACHE_'
+
+# enabled turns query timing on (1) or off (0); queries taking at least
+# slow_query_ms are appended to slow_query_log, with their EXPLAIN QUERY
+# PLAN when explain is 1. A relative slow_query_log is next to the database
+# the query ran on, and an empty one turns the log off.
+DEFAULT_INSTRUMENTATION_SETTINGS = OrderedDict([
+    ('enabled', 1),
+    ('slow_query_ms', 100.0),
+    ('slow_query_log', 'slow_queries.log'),
+    ('explain', 0),
+])
+INSTRUMENTATION_ENV_PREFIX = 'WORKLOG_INSTRUMENTATION_'
+
+# Pragma values are interpolated into SQL, so only plain words and integers
+# are accepted.
+PRAGMA_VALUE = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+
+def read_config(config_path=None, environ=None):
+    environ = os.environ if environ is None else environ
+    config = configparser.ConfigParser()
+    config.read(config_path or environ.get(CONFIG_ENV, CONFIG_FILE))
+    return config
+
+
+def load_pragmas(config_path=None, environ=None):
+    """Return the connection pragmas as a list of (name, value) pairs.
+
+    Defaults are overridden by the config file, which is overridden by the
+    environment. Raises ValueError for unknown pragmas or unsafe values.
+    """
+    environ = os.environ if environ is None else environ
+    pragmas = OrderedDict(DEFAULT_PRAGMAS)
+    config = read_config(config_path, environ)
+    if config.has_section('pragmas'):
+        pragmas.update(config.items('pragmas'))
+    for key, value in environ.items():
+        if key.startswith(PRAGMA_ENV_PREFIX):
+            pragmas[key[len(PRAGMA_ENV_PREFIX):].lower()] = value
+    for name, value in pragmas.items():
+        if name not in DEFAULT_PRAGMAS:
+            raise ValueError("Unknown pragma: {}".format(name))
+        if not PRAGMA_VALUE.match(str(value).strip()):
+            raise ValueError("Invalid value for {}: {}".format(name, value))
+        pragmas[name] = str(value).strip()
+    return list(pragmas.items())
+
+
+def load_cache_settings(config_path=None, environ=None):
+    """Return the lookup cache settings as a dict of ints.
+
+    Read from the [cache] section of the config file and WORKLOG_CACHE_<NAME>
+    environment variables, in the same order of precedence as the pragmas.
+    """
+    environ = os.environ if environ is None else environ
+    cache_settings = OrderedDict(DEFAULT_CACHE_SETTINGS)
+    config = read_config(config_path, environ)
+    if config.has_section('cache'):
+        cache_settings.update(config.items('cache'))
+    for key, value in environ.items():
+        if key.startswith(CACHE_ENV_PREFIX):
+            cache_settings[key[len(CACHE_ENV_PREFIX):].lower()] = value
+    for name, value in cache_settings.items():
+        if name not in DEFAULT_CACHE_SETTINGS:
+            raise ValueError("Unknown cache setting: {}".format(name))
+        cache_settings[name] = int(value)
+    return cache_settings
+
+
+def load_instrumentation_settings(config_path=None, environ=None):
+    """Return the query instrumentation settings as a dict.
+
+    Read from the [instrumentation] section of the config file and
+    WORKLOG_INSTRUMENTATION_<NAME> environment variables, in the same order
+    of precedence as the pragmas. Values take the type of their default.
+    """
+    environ = os.environ if environ is None else environ
+    instrumentation = OrderedDict(DEFAULT_INSTRUMENTATION_SETTINGS)
+    config = read_config(config_path, environ)
+    if config.has_section('instrumentation'):
+        instrumentation.update(config.items('instrumentation'))
+    for key, value in environ.items():
+        if key.startswith(INSTRUMENTATION_ENV_PREFIX):
+            name = key[len(INSTRUMENTATION_ENV_PREFIX):].lower()
+            instrumentation[name] = value
+    for name, value in instrumentation.items():
+        if name not in DEFAULT_INSTRUMENTATION_SETTINGS:
+            raise ValueError("Unknown instrumentation setting: {}".format(
+                name))
+        default = DEFAULT_INSTRUMENTATION_SETTINGS[name]
+        instrumentation[name] = type(default)(value)
+    return instrumentation
+
+
+def active_settings(database):
+    """Read back the pragmas in effect on the database's connection"""
+    return OrderedDict(
+        (name, database.execute_sql('PRAGMA {}'.format(name)).fetchone()[0])
+        for name in DEFAULT_PRAGMAS)
+
+
+def main():
+    from entry import db
+    db.connect()
+    print("database: {}".format(db.database))
+    for name, value in active_settings(db).items():
+        print("{} = {}".format(name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,45 @@
 # Author: Jay Li
 #####################################################
 import unittest
-from io import StringIO
+from io import StringIO, BytesIO
 from unittest import mock
 import random, string
 import datetime
+import os
+import shutil
+import tempfile
 
-from entry import Entry
+from entry import (Entry, Employee, Task, NameCatalog, DateCatalog,
+                   MinutesCatalog, EntrySearch, EntrySearchVocab,
+                   DailyRollup)
 from peewee import *
 import worklog_db
+import migrations
+from cursor import EntryCursor
+import importer
+import exporter
+import reports
+from cache import LookupCache, lookup_cache
+import settings
+import instrumentation
+import service
+import threading
+import asyncio
+import json
+import base64
+import api
+import loadtest
+import cli
+import writebuffer
+import benchmark
+import partitions
+import archive
+import planner
+import bulk
+try:
+    import analytics
+except ImportError:
+    analytics = None
 
 
 test_db = SqliteDatabase('test.db')
@@ -20,6 +51,16 @@ test_spent_minutes = 10
 test_notes = 'Wonderful time'
 
 
+def setUpModule():
+    # Slow queries met while testing are logged away from the repository
+    directory = tempfile.mkdtemp()
+    unittest.addModuleCleanup(shutil.rmtree, directory)
+    patcher = mock.patch.object(instrumentation.recorder, 'slow_query_log',
+                                os.path.join(directory, 'slow_queries.log'))
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+
 #####################################################
 # Helper Functions
 #####################################################
@@ -49,6 +90,12 @@ def create_random_date():
     return datetime.date(year, month, day)
 
 
+def query_plan(query):
+    sql, params = query.sql()
+    rows = test_db.execute_sql('EXPLAIN QUERY PLAN ' + sql, params)
+    return ' '.join(row[-1] for row in rows)
+
+
 def add_random_entry():
     entry = create_random_entry()
     return Entry.create(name=entry['name'], task=entry['task'],
@@ -58,8 +105,11 @@ def add_random_entry():
 
 class WorklogTest(unittest.TestCase):
     def setUp(self):
-        test_db.create_tables([Entry], safe=True)
-        Entry._meta.database = test_db
+        test_db.bind([Entry, Employee, Task, NameCatalog, DateCatalog,
+                      MinutesCatalog, EntrySearch, EntrySearchVocab,
+                      DailyRollup])
+        migrations.migrate(test_db)
+        lookup_cache.clear()
         entries = Entry.select()
         for entry in entries:
             entry.delete_instance()
@@ -129,6 +179,24 @@ class WorklogTest(unittest.TestCase):
             for matched_entry in matched_entries:
                 self.assertEqual(matched_entry.name, entry['name'])
 
+    @mock.patch('worklog_db.get_browse_input', return_value='')
+    @mock.patch('worklog_db.get_input', autospec=True)
+    def test_find_by_misspelt_employee(self, mock_get_input, _):
+        for name in ('Beth', 'Beth', 'Ann'):
+            Entry.create(name=name, task='Task', spent_minutes=5, notes='')
+        mock_get_input.return_value = 'Bteh'
+        matched_entries = worklog_db.find_by_employee()
+        self.assertEqual([entry.name for entry in matched_entries],
+                         ['Beth', 'Beth'])
+        # Several names alike ask which one was meant
+        Entry.create(name='Bethany', task='Task', spent_minutes=5, notes='')
+        mock_get_input.side_effect = ['Beth', 'Bethany']
+        with mock.patch('builtins.print') as mock_print:
+            matched_entries = worklog_db.find_by_employee()
+        mock_print.assert_any_call("Multiple matched names:")
+        self.assertEqual([entry.name for entry in matched_entries],
+                         ['Bethany'])
+
     @mock.patch('worklog_db.get_browse_input', return_value='')
     @mock.patch('worklog_db.get_input', autospec=True)
     def test_find_by_spent_minutes(self, mock_get_spent_minutes, _):
@@ -150,7 +218,7 @@ class WorklogTest(unittest.TestCase):
 
     @mock.patch('worklog_db.get_browse_input', return_value='')
     @mock.patch('worklog_db.get_input', autospec=True)
-    def test_find_by_search_term(self, mock_get_search_term, _):
+    def test_find_by_substring(self, mock_get_search_term, _):
         iter_num = 5
         entries = [create_random_entry() for _ in range(iter_num)]
         for (index, entry) in enumerate(entries, start=1):
@@ -167,7 +235,7 @@ class WorklogTest(unittest.TestCase):
             end = random.randint(start+1, length)
             substring = search_term[start:end]
             mock_get_search_term.return_value = substring
-            matched_entries = worklog_db.find_by_search_term()
+            matched_entries = worklog_db.find_by_substring()
             self.assertGreaterEqual(len(matched_entries), index)
             for matched_entry in matched_entries:
                 self.assertTrue(
@@ -220,6 +288,742 @@ class WorklogTest(unittest.TestCase):
                 self.assertGreaterEqual(matched_entry.timestamp, start_date)
                 self.assertLessEqual(matched_entry.timestamp, end_date)
 
+    @mock.patch('worklog_db.get_browse_input', return_value='')
+    @mock.patch('worklog_db.get_input')
+    def test_find_by_date_matches_datetime_timestamps(self,
+                                                      mock_get_date_string,
+                                                      _):
+        date = create_random_date()
+        entry = create_random_entry()
+        Entry.create(name=entry['name'], task=entry['task'],
+                     spent_minutes=entry['spent_minutes'],
+                     notes=entry['notes'],
+                     timestamp=datetime.datetime.combine(
+                         date, datetime.time(23, 59, 59)))
+        Entry.create(name=entry['name'], task=entry['task'],
+                     spent_minutes=entry['spent_minutes'],
+                     notes=entry['notes'],
+                     timestamp=date + datetime.timedelta(days=1))
+        mock_get_date_string.return_value = date.strftime('%m/%d/%Y')
+        matched_entries = worklog_db.find_by_date()
+        self.assertEqual(len(matched_entries), 1)
+
+    @mock.patch('worklog_db.get_input',
+                side_effect=['soon', '2016-03-01', '03/02/2016', 'q'])
+    def test_get_date_takes_what_parse_date_takes(self, _):
+        with mock.patch('builtins.print') as mock_print:
+            self.assertEqual(worklog_db.get_date(), datetime.date(2016, 3, 1))
+        mock_print.assert_called_once_with(
+            "Invalid date. Please enter again.")
+        self.assertEqual(worklog_db.get_date(), datetime.date(2016, 3, 2))
+        self.assertIsNone(worklog_db.get_date())
+
+    @mock.patch('worklog_db.enter_any_key', return_value='')
+    @mock.patch('worklog_db.get_input')
+    def test_find_by_date_uses_timestamp_index(self, mock_get_date_string,
+                                               _):
+        mock_get_date_string.return_value = '03/01/2016'
+        matched_entries = worklog_db.find_by_date()
+        self.assertIn('INDEX entry_timestamp', query_plan(matched_entries))
+
+    @mock.patch('worklog_db.enter_any_key', return_value='')
+    @mock.patch('worklog_db.get_input')
+    def test_find_by_date_range_uses_timestamp_index(self,
+                                                     mock_get_date_string,
+                                                     _):
+        mock_get_date_string.side_effect = ['01/01/2016', '12/31/2016']
+        matched_entries = worklog_db.find_by_date_range()
+        self.assertIn('INDEX entry_timestamp', query_plan(matched_entries))
+
+    def catalog_counts(self):
+        names = dict((row.name, row.entry_count)
+                     for row in NameCatalog.select())
+        dates = dict((row.date, row.entry_count)
+                     for row in DateCatalog.select())
+        return names, dates
+
+    def test_catalogs_follow_entry_changes(self):
+        first_date = datetime.date(2016, 3, 1)
+        second_date = datetime.date(2016, 3, 2)
+        josh = Entry.create(name='Josh', task='Fix bug', spent_minutes=20,
+                            notes='fun', timestamp=first_date)
+        Entry.create(name='Josh', task='Review', spent_minutes=5,
+                     notes='', timestamp=first_date)
+        self.assertEqual(self.catalog_counts(),
+                         ({'Josh': 2}, {first_date: 2}))
+        josh.name = 'May'
+        josh.timestamp = second_date
+        josh.save()
+        self.assertEqual(self.catalog_counts(),
+                         ({'Josh': 1, 'May': 1},
+                          {first_date: 1, second_date: 1}))
+        josh.delete_instance()
+        self.assertEqual(self.catalog_counts(),
+                         ({'Josh': 1}, {first_date: 1}))
+
+    def test_catalog_pick_lists(self):
+        Entry.create(name='May', task='Fix bug', spent_minutes=20,
+                     notes='fun', timestamp=datetime.date(2016, 3, 2))
+        Entry.create(name='Josh', task='Fix bug', spent_minutes=20,
+                     notes='fun', timestamp=datetime.date(2016, 3, 1))
+        self.assertEqual(worklog_db.catalog_names(), ['Josh', 'May'])
+        self.assertEqual(worklog_db.catalog_dates(),
+                         [datetime.date(2016, 3, 1),
+                          datetime.date(2016, 3, 2)])
+
+    @mock.patch('worklog_db.get_browse_input', return_value='')
+    @mock.patch('worklog_db.get_input', autospec=True)
+    def test_find_by_search_term(self, mock_get_search_term, _):
+        deploy = Entry.create(name='Beth', task='Deploy release',
+                              spent_minutes=30,
+                              notes='deploy went fine, deploy again soon')
+        Entry.create(name='Beth', task='Write docs', spent_minutes=30,
+                     notes='mention deployment once')
+        Entry.create(name='Beth', task='Redeploy', spent_minutes=30,
+                     notes='no whole word here')
+        mock_get_search_term.return_value = 'deploy'
+        matched_entries = worklog_db.find_by_search_term()
+        self.assertEqual([entry.id for entry in matched_entries],
+                         [deploy.id])
+        self.assertIn('[deploy]', matched_entries[0].snippet.lower())
+        mock_get_search_term.return_value = 'deploy*'
+        matched_entries = worklog_db.find_by_search_term()
+        self.assertEqual(len(matched_entries), 2)
+        # The entry mentioning deploy most often ranks first
+        self.assertEqual(matched_entries[0].id, deploy.id)
+        mock_get_search_term.return_value = '"went fine"'
+        matched_entries = worklog_db.find_by_search_term()
+        self.assertEqual([entry.id for entry in matched_entries],
+                         [deploy.id])
+
+    def test_search_index_follows_entry_changes(self):
+        entry = Entry.create(name='Beth', task='Deploy', spent_minutes=30,
+                             notes='')
+        entry.task = 'Review'
+        entry.save()
+        self.assertEqual(len(worklog_db.search_entries('deploy')), 0)
+        self.assertEqual(len(worklog_db.search_entries('review')), 1)
+        entry.delete_instance()
+        self.assertEqual(len(worklog_db.search_entries('review')), 0)
+
+    def test_full_text_query(self):
+        self.assertEqual(worklog_db.full_text_query('a "b c" d* e"f'),
+                         '"a" "b c" "d"* "e""f"')
+        self.assertEqual(worklog_db.full_text_query('  * "" '), '')
+
+    def test_entry_cursor_pages_in_timestamp_order(self):
+        for _ in range(10):
+            entry = create_random_entry()
+            Entry.create(name=entry['name'], task=entry['task'],
+                         spent_minutes=entry['spent_minutes'],
+                         notes=entry['notes'],
+                         timestamp=random.choice([
+                             datetime.date(2016, 3, 1),
+                             datetime.date(2016, 3, 2),
+                             datetime.datetime(2016, 3, 1, 12, 30)]))
+        expected = [entry.id for entry in
+                    Entry.select().order_by(Entry.timestamp, Entry.id)]
+        entries = EntryCursor(Entry.select(), page_size=3)
+        seen = [entries.current.id]
+        while entries.next():
+            self.assertLessEqual(len(entries.page), 3)
+            seen.append(entries.current.id)
+        self.assertEqual(seen, expected)
+        seen = [entries.current.id]
+        while entries.previous():
+            self.assertLessEqual(len(entries.page), 3)
+            seen.append(entries.current.id)
+        self.assertEqual(seen, expected[::-1])
+
+    def test_entry_cursor_keeps_search_rank(self):
+        for count in range(1, 6):
+            Entry.create(name='Beth', task='Deploy', spent_minutes=10,
+                         notes=' '.join(['deploy'] * count + ['x'] * 5))
+        ranked = worklog_db.search_entries('deploy')
+        expected = [entry.id for entry in ranked]
+        entries = EntryCursor(ranked, page_size=2)
+        seen = [entries.current.id]
+        while entries.next():
+            seen.append(entries.current.id)
+        self.assertEqual(seen, expected)
+
+    def test_entry_cursor_empty(self):
+        self.assertFalse(EntryCursor(Entry.select()))
+
+    def test_import_csv(self):
+        lines = StringIO(
+            'name,task,spent_minutes,notes,timestamp\n'
+            'Beth,Deploy,30,went fine,2016-03-01\n'
+            'Beth,Review,15,,03/02/2016\n'
+            'May,Plan,-5,negative,\n'
+            '  ,Plan,5,blank name,\n'
+            'May,Plan,ten,not a number,\n'
+            'May,Plan,5,bad date,2016-13-01\n'
+            'May,Plan,45,,\n')
+        batches = []
+        result = importer.import_rows(importer.read_csv(lines), batch_size=2,
+                                      progress=lambda r: batches.append(
+                                          r.imported))
+        self.assertEqual((result.imported, result.rejected), (3, 4))
+        self.assertEqual(batches, [2, 3])
+        self.assertEqual(Entry.select().count(), 3)
+        self.assertEqual(worklog_db.catalog_names(), ['Beth', 'May'])
+        review = Entry.get(Entry.task == 'Review')
+        self.assertEqual(review.timestamp, datetime.date(2016, 3, 2))
+        plan = Entry.get(Entry.task == 'Plan')
+        self.assertEqual(plan.timestamp, datetime.date.today())
+
+    def test_name_filters(self):
+        for name, task in (('Beth', 'Deploy'), ('May', 'Plan'),
+                           ('Ann', 'Deploy')):
+            Entry.create(name=name, task=task, spent_minutes=5, notes='')
+
+        def names(condition):
+            return sorted(entry.name for entry in
+                          Entry.select().where(condition))
+        self.assertEqual(names(Entry.name != 'Beth'), ['Ann', 'May'])
+        self.assertEqual(names(Entry.task != 'Deploy'), ['May'])
+        self.assertEqual(names(Entry.name.in_(['Beth', 'May', 'Zed'])),
+                         ['Beth', 'May'])
+        self.assertEqual(names(Entry.name.not_in(['Beth', 'May'])), ['Ann'])
+        self.assertEqual(names(Entry.name.in_([])), [])
+        # No silent Python bool for an operator without SQL behind it
+        with self.assertRaises(TypeError):
+            Entry.name < 'May'
+        with self.assertRaises(TypeError):
+            Entry.select().order_by(Entry.name.desc())
+
+    def test_import_jsonl(self):
+        lines = StringIO(
+            '{"name": "Beth", "task": "Deploy", "spent_minutes": 30}\n'
+            '\n'
+            '{"name": "Beth", "task": "Deploy", "spent_minutes": null}\n'
+            '{"name": "Beth", "task": "Deploy", "spent_minutes": \n'
+            '5\n'
+            '[1]\n'
+            '{"name": "Beth", "task": "Deploy", "spent_minutes": 30.7}\n'
+            '{"name": "Beth", "task": "Deploy", "spent_minutes": true}\n'
+            '{"name": "May", "task": "Plan", "spent_minutes": "45"}\n')
+        result = importer.import_rows(importer.read_jsonl(lines),
+                                      batch_size=1)
+        # Bad lines mid-file are counted and the rows around them imported
+        self.assertEqual((result.imported, result.rejected), (2, 6))
+        self.assertEqual(len(worklog_db.search_entries('deploy')), 1)
+        self.assertEqual(sorted(entry.spent_minutes
+                                for entry in Entry.select()), [30, 45])
+
+    def add_export_entries(self):
+        Entry.create(name='Beth', task='Deploy', spent_minutes=30,
+                     notes='went fine', timestamp=datetime.date(2016, 3, 2))
+        Entry.create(name='Beth', task='Review', spent_minutes=15,
+                     notes='', timestamp=datetime.date(2016, 3, 1))
+        Entry.create(name='May', task='Deploy', spent_minutes=45,
+                     notes='line one\nline "two"',
+                     timestamp=datetime.date(2016, 3, 1))
+
+    @mock.patch('worklog_db.initialize')
+    def test_cli_find_and_add(self, _):
+        self.add_export_entries()
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            cli.main(['find', '--employee', 'Beth', '--from', '2016-03-01',
+                      '--format', 'json'])
+        self.assertEqual([(record['task'], record['timestamp'])
+                          for record in json.loads(stdout.getvalue())],
+                         [('Review', '2016-03-01'), ('Deploy', '2016-03-02')])
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            cli.main(['add', '--name', 'Ann', '--task', 'Plan',
+                      '--minutes', '20', '--date', '03/05/2016'])
+            entry_id = int(stdout.getvalue())
+        self.assertEqual(Entry.get_by_id(entry_id).timestamp,
+                         datetime.date(2016, 3, 5))
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            cli.main(['employees'])
+        self.assertEqual(stdout.getvalue().split('\n'),
+                         ['Ann', 'Beth', 'May', ''])
+        with mock.patch('sys.stderr', new_callable=StringIO), \
+                self.assertRaises(SystemExit) as raised:
+            cli.main(['add', '--name', 'Ann', '--task', 'Plan',
+                      '--minutes', '-5'])
+        self.assertEqual(raised.exception.code, 2)
+
+    def test_clear_screen_only_writes_to_terminals(self):
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            worklog_db.clear_screen()
+        self.assertEqual(stdout.getvalue(), '')
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            stdout.isatty = lambda: True
+            worklog_db.clear_screen()
+        self.assertEqual(stdout.getvalue(), worklog_db.CLEAR_SCREEN)
+
+    def test_filter_entries(self):
+        self.add_export_entries()
+        beth_march = worklog_db.filter_entries(
+            employee='Beth', start_date=datetime.date(2016, 3, 2))
+        self.assertEqual([entry.task for entry in beth_march], ['Deploy'])
+        deploys = worklog_db.filter_entries(
+            search_term='deploy', date=datetime.date(2016, 3, 1))
+        self.assertEqual([entry.name for entry in deploys], ['May'])
+        self.assertEqual(len(worklog_db.filter_entries()), 3)
+
+    @mock.patch('worklog_db.get_browse_input', return_value='')
+    @mock.patch('worklog_db.get_input', autospec=True)
+    def test_minutes_ranges_and_histogram(self, mock_get_input, _):
+        for minutes in (5, 20, 30, 45, 240, 300):
+            Entry.create(name='Beth', task='Task', spent_minutes=minutes,
+                         notes='')
+        self.assertEqual(worklog_db.parse_minutes_range('30-60'), (30, 60))
+        self.assertEqual(worklog_db.parse_minutes_range('240-'), (240, None))
+        self.assertEqual(worklog_db.parse_minutes_range(' -15'), (None, 15))
+        self.assertEqual(worklog_db.parse_minutes_range('45'), (45, 45))
+        with self.assertRaises(ValueError):
+            worklog_db.parse_minutes_range('-')
+        with self.assertRaises(AssertionError):
+            worklog_db.parse_minutes_range('60-30')
+
+        def minutes(**filters):
+            return sorted(entry.spent_minutes for entry in
+                          worklog_db.filter_entries(**filters))
+        self.assertEqual(minutes(min_minutes=240), [240, 300])
+        self.assertEqual(minutes(max_minutes=20), [5, 20])
+        self.assertEqual(minutes(min_minutes=30, max_minutes=240),
+                         [30, 45, 240])
+        self.assertEqual(
+            worklog_db.minutes_histogram(bucket_minutes=30, buckets=3),
+            [(0, 29, 2, 25), (30, 59, 2, 75), (60, None, 2, 540)])
+        # Read off the minutes catalog, the same as counting the entries
+        self.assertEqual(
+            worklog_db.minutes_histogram(Entry.select(), 30, 3),
+            [(0, 29, 2, 25), (30, 59, 2, 75), (60, None, 2, 540)])
+        self.assertEqual(
+            worklog_db.minutes_histogram(worklog_db.filter_entries(
+                min_minutes=30, names=False), 60, 10),
+            [(0, 59, 2, 75), (240, 299, 1, 240), (300, 359, 1, 300)])
+        mock_get_input.return_value = '240-'
+        with mock.patch('builtins.print') as mock_print:
+            matched_entries = worklog_db.find_by_spent_minutes()
+        mock_print.assert_any_call('{:>9}  {:>7}  {}'.format(
+            '240+', 2, '#' * 40))
+        self.assertEqual(sorted(entry.spent_minutes
+                                for entry in matched_entries), [240, 300])
+
+    def add_planner_entries(self):
+        march_first = datetime.date(2016, 3, 1)
+        for number in range(20):
+            Entry.create(name='Ann', task='Review', spent_minutes=number,
+                         notes='customer call', timestamp=march_first)
+        for day, minutes, task in ((1, 90, 'Deploy'), (2, 30, 'Deploy'),
+                                   (3, 120, 'Design')):
+            Entry.create(name='Beth', task=task, spent_minutes=minutes,
+                         notes='customer release',
+                         timestamp=datetime.date(2016, 3, day))
+
+    def test_query_planner(self):
+        self.add_planner_entries()
+        filters = dict(employee='Beth', date=datetime.date(2016, 3, 1),
+                       min_minutes=10)
+        plan = planner.plan_query(**filters)
+        self.assertEqual(plan.estimates,
+                         {'employee': 3, 'date': 21, 'minutes': 13})
+        self.assertEqual(plan.driver, 'employee')
+        self.assertEqual([entry.task for entry in plan.query], ['Deploy'])
+        self.assertIn('INDEX entry_employee_id_timestamp',
+                      query_plan(plan.query))
+        # Whichever filter finds the entries, they are the same
+        for use_index in (None, 'employee', 'date', 'minutes'):
+            query = worklog_db.filter_entries(use_index=use_index, **filters)
+            self.assertEqual([entry.spent_minutes for entry in
+                              EntryCursor(query).page], [90])
+        self.assertIn('INDEX entry_spent_minutes_timestamp', query_plan(
+            worklog_db.filter_entries(use_index='minutes', **filters)))
+        # Checking the search on each entry costs more than searching
+        plan = planner.plan_query(search_term='deploy',
+                                  start_date=datetime.date(2016, 3, 2))
+        self.assertEqual(plan.estimates, {'date': 2, 'search': 2})
+        self.assertEqual(plan.driver, 'search')
+        self.assertEqual([entry.timestamp for entry in plan.query],
+                         [datetime.date(2016, 3, 2)])
+        plan = planner.plan_query(search_term='customer', employee='Nobody')
+        self.assertEqual(plan.driver, 'employee')
+        self.assertEqual(list(plan.query), [])
+        # Found through another filter, searched entries keep their rank
+        ranked = worklog_db.filter_entries(search_term='release customer',
+                                           use_index='minutes',
+                                           min_minutes=30)
+        self.assertTrue(ranked.sql()[0].endswith('ORDER BY bm25("entry_search")'))
+        self.assertEqual(planner.estimate_search(test_db, 'de* customer'), 3)
+        self.assertEqual(planner.estimate_search(test_db, '"customer call"'),
+                         20)
+        self.assertIsNone(planner.estimate_search(test_db, '*'))
+        self.assertIsNone(planner.plan_query(min_minutes=10).driver)
+        with mock.patch('worklog_db.initialize'), \
+                mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            cli.main(['find', '--employee', 'Beth', '--from', '2016-03-01',
+                      '--search', 'release', '--explain'])
+        self.assertEqual(stdout.getvalue().split('\n')[:4],
+                         ['employee  ~3 entries', 'date      ~23 entries',
+                          'search    ~3 entries',
+                          'Find entries by search through entry_search'])
+
+    def test_bulk_edit_and_delete(self):
+        self.add_planner_entries()
+        beth = dict(employee='Beth')
+        self.assertEqual(bulk.edit_entries({'task': 'Ship'}, dry_run=True,
+                                           **beth), 3)
+        self.assertEqual(Entry.select().where(Entry.task == 'Ship').count(),
+                         0)
+        batches = []
+        self.assertEqual(bulk.edit_entries(
+            {'task': 'Ship', 'spent_minutes': '15'}, batch_size=2,
+            pause=0, report=lambda *batch: batches.append(batch), **beth), 3)
+        self.assertEqual(batches, [(1, 2), (2, 1)])
+        self.assertEqual(reports.time_report(['employee', 'task']),
+                         [('Ann', 'Review', 190, 20), ('Beth', 'Ship', 45, 3)])
+        self.assertEqual(len(worklog_db.search_entries('ship')), 3)
+        with self.assertRaises(ValueError):
+            bulk.edit_entries({'spent_minutes': -1}, **beth)
+        with self.assertRaises(ValueError):
+            bulk.edit_entries({'id': 1}, **beth)
+        lookup_cache.ids(worklog_db.filter_entries(employee='Ann'))
+        self.assertEqual(bulk.delete_entries(
+            batch_size=7, pause=0, employee='Ann',
+            max_minutes=14), 15)
+        self.assertEqual(lookup_cache.stats()['cached'], 0)
+        self.assertEqual(bulk.count_entries(employee='Ann'), 5)
+        self.assertEqual(bulk.delete_entries(search_term='nothing'), 0)
+        with mock.patch('worklog_db.initialize'), \
+                mock.patch('sys.stdout', new_callable=StringIO) as stdout, \
+                mock.patch('sys.stderr', new_callable=StringIO) as stderr:
+            cli.main(['delete', '--search', 'customer', '--dry-run'])
+            self.assertEqual(stdout.getvalue(), "Would delete 8 entries\n")
+            cli.main(['delete', '--employee', 'Ann', '--batch-size', '3'])
+            self.assertEqual(stderr.getvalue(), "batch 1: 3 entries\n"
+                                                "batch 2: 2 entries\n")
+            with self.assertRaises(SystemExit) as raised:
+                cli.main(['edit', '--set-task', 'Ship'])
+            self.assertEqual(raised.exception.code, 2)
+        self.assertEqual(bulk.count_entries(), 3)
+
+    def test_bulk_changes_match_the_whole_employee_name(self):
+        for name in ('Beth', 'Bethany', 'Elizabeth', 'Beth'):
+            Entry.create(name=name, task='Task', spent_minutes=5, notes='')
+        self.assertEqual(len(worklog_db.filter_entries(employee='Beth')), 4)
+        self.assertEqual(bulk.count_entries(employee='Beth'), 2)
+        self.assertEqual(bulk.count_entries(employee='Bet'), 0)
+        self.assertEqual(bulk.edit_entries({'task': 'Ship'}, pause=0,
+                                           employee='Bethany'), 1)
+        with mock.patch('worklog_db.initialize'), \
+                mock.patch('sys.stdout', new_callable=StringIO) as stdout, \
+                mock.patch('sys.stderr', new_callable=StringIO):
+            cli.main(['delete', '--employee', 'Beth'])
+        self.assertEqual(stdout.getvalue(), "Deleted 2 entries\n")
+        self.assertEqual(worklog_db.catalog_names(), ['Bethany', 'Elizabeth'])
+
+    def test_minutes_catalog_follows_entry_changes(self):
+        beth = Entry.create(name='Beth', task='Task', spent_minutes=30,
+                            notes='')
+        Entry.create(name='Ann', task='Task', spent_minutes=30, notes='')
+
+        def counts():
+            return dict(MinutesCatalog.select().tuples())
+        self.assertEqual(counts(), {30: 2})
+        beth.spent_minutes = 45
+        beth.save()
+        self.assertEqual(counts(), {30: 1, 45: 1})
+        beth.delete_instance()
+        self.assertEqual(counts(), {30: 1})
+
+    @mock.patch('worklog_db.get_browse_input', return_value='')
+    @mock.patch('worklog_db.get_input', autospec=True)
+    def test_find_by_several(self, mock_get_input, _):
+        self.add_planner_entries()
+        mock_get_input.side_effect = ['Beth', 'soon', '03/01/2016', '',
+                                      '60-', 'customer']
+        with mock.patch('builtins.print'):
+            matched_entries = worklog_db.find_by_several()
+        self.assertEqual(sorted(entry.spent_minutes
+                                for entry in matched_entries), [90, 120])
+
+    def test_export_csv_and_jsonl(self):
+        self.add_export_entries()
+        stream = StringIO()
+        count = exporter.write_csv(exporter.export_rows(
+            worklog_db.filter_entries(employee='Beth')), stream)
+        self.assertEqual(count, 2)
+        stream.seek(0)
+        rows = list(importer.read_csv(stream))
+        self.assertEqual([row['task'] for row in rows], ['Review', 'Deploy'])
+        self.assertEqual(rows[0]['timestamp'], '2016-03-01')
+        stream = StringIO()
+        exporter.write_jsonl(exporter.export_rows(
+            worklog_db.filter_entries(spent_minutes=45)), stream)
+        stream.seek(0)
+        rows = list(importer.read_jsonl(stream))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['notes'], 'line one\nline "two"')
+
+    def test_export_columnar_round_trip(self):
+        self.add_export_entries()
+        expected = list(exporter.export_rows(worklog_db.filter_entries()))
+        stream = BytesIO()
+        count = exporter.write_columnar(
+            exporter.export_rows(worklog_db.filter_entries()), stream,
+            row_group_size=2)
+        self.assertEqual(count, 3)
+        stream.seek(0)
+        self.assertEqual(list(exporter.read_columnar(stream)), expected)
+
+    def test_load_pragmas(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config_path = os.path.join(directory, 'worklog.ini')
+        with open(config_path, 'w') as config:
+            config.write('[pragmas]\ncache_size = -2000\n'
+                         'synchronous = full\n')
+        pragmas = dict(settings.load_pragmas(
+            config_path, {'WORKLOG_PRAGMA_SYNCHRONOUS': 'off'}))
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['cache_size'], '-2000')
+        self.assertEqual(pragmas['synchronous'], 'off')
+        with self.assertRaises(ValueError):
+            settings.load_pragmas(config_path,
+                                  {'WORKLOG_PRAGMA_JOURNAL_MODE': 'wal; x'})
+        with self.assertRaises(ValueError):
+            settings.load_pragmas(config_path,
+                                  {'WORKLOG_PRAGMA_FOREIGN_KEYS': '1'})
+
+    def test_active_settings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        tuned_db = SqliteDatabase(os.path.join(directory, 'tuned.db'),
+                                  pragmas=settings.load_pragmas(
+                                      os.path.join(directory, 'none.ini'),
+                                      {}))
+        tuned_db.connect()
+        self.addCleanup(tuned_db.close)
+        active = settings.active_settings(tuned_db)
+        self.assertEqual(active['journal_mode'], 'wal')
+        self.assertEqual(active['synchronous'], 1)
+        self.assertEqual(active['cache_size'], -65536)
+        self.assertEqual(active['temp_store'], 2)
+        self.assertEqual(active['busy_timeout'], 5000)
+
+    def test_query_instrumentation(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        log_path = os.path.join(directory, 'slow.log')
+        recorder = instrumentation.QueryRecorder(
+            slow_query_ms=0, slow_query_log=log_path, explain=1)
+        timed_db = instrumentation.InstrumentedSqliteDatabase(
+            os.path.join(directory, 'timed.db'), recorder=recorder)
+        timed_db.connect()
+        self.addCleanup(timed_db.close)
+        timed_db.execute_sql('CREATE TABLE t (x)')
+        timed_db.execute_sql('INSERT INTO t VALUES (1), (2), (3)')
+
+        @instrumentation.operation
+        def lookup():
+            return list(timed_db.execute_sql('SELECT x FROM t WHERE x > ?',
+                                             (0,)))
+        self.assertEqual(len(lookup()), 3)
+        summary = recorder.summary()
+        self.assertEqual(summary[__name__ + '.lookup']['rows'], 3)
+        self.assertEqual(summary[__name__ + '.lookup']['count'], 1)
+        self.assertEqual(
+            summary[__name__ + '.test_query_instrumentation']['count'], 2)
+        with open(log_path) as log:
+            lines = [json.loads(line) for line in log]
+        self.assertEqual([line['rows'] for line in lines], [0, 3, 3])
+        self.assertEqual(lines[-1]['params'], [0])
+        self.assertIn('SCAN t', ' '.join(lines[-1]['plan']))
+        recorder.reset()
+        recorder.enabled = False
+        lookup()
+        self.assertEqual(recorder.summary(), {})
+        # A relative log is kept next to the database; none for a database
+        # in memory
+        recorder.slow_query_log = 'slow.log'
+        self.assertEqual(recorder.log_path(timed_db), log_path)
+        self.assertIsNone(recorder.log_path(SqliteDatabase(':memory:')))
+
+    def test_load_instrumentation_settings(self):
+        instrumentation_settings = settings.load_instrumentation_settings(
+            'none.ini', {'WORKLOG_INSTRUMENTATION_SLOW_QUERY_MS': '250',
+                         'WORKLOG_INSTRUMENTATION_EXPLAIN': '1'})
+        self.assertEqual(instrumentation_settings['slow_query_ms'], 250.0)
+        self.assertEqual(instrumentation_settings['explain'], 1)
+        self.assertEqual(instrumentation_settings['enabled'], 1)
+        with self.assertRaises(ValueError):
+            settings.load_instrumentation_settings(
+                'none.ini', {'WORKLOG_INSTRUMENTATION_SAMPLE': '1'})
+
+    def test_time_report_follows_entry_changes(self):
+        self.add_export_entries()
+        extra = Entry.create(name='Beth', task='Deploy', spent_minutes=10,
+                             notes='', timestamp=datetime.date(2016, 4, 1))
+        self.assertEqual(reports.time_report(['employee']),
+                         [('Beth', 55, 3), ('May', 45, 1)])
+        self.assertEqual(reports.time_report(['employee', 'month'],
+                                             employee='Beth'),
+                         [('Beth', '2016-03', 45, 2),
+                          ('Beth', '2016-04', 10, 1)])
+        extra.task = 'Review'
+        extra.spent_minutes = 20
+        extra.save()
+        self.assertEqual(reports.time_report(
+            ['task'], start_date=datetime.date(2016, 3, 2)),
+            [('Deploy', 30, 1), ('Review', 20, 1)])
+        extra.delete_instance()
+        self.assertEqual(reports.time_report(['day']),
+                         [(datetime.date(2016, 3, 1), 60, 2),
+                          (datetime.date(2016, 3, 2), 30, 1)])
+        self.assertEqual(DailyRollup.select().count(), 3)
+
+    def test_sharded_reports_match_rollup(self):
+        self.add_export_entries()
+        for day in range(1, 29, 3):
+            Entry.create(name='Ann', task='Plan', spent_minutes=day * 10,
+                         notes='', timestamp=datetime.date(2016, 4, day))
+        self.assertEqual(reports.shard_dates(3), [
+            (None, datetime.date(2016, 4, 6)),
+            (datetime.date(2016, 4, 7), datetime.date(2016, 4, 18)),
+            (datetime.date(2016, 4, 19), None)])
+        # A legacy timestamp with its time of day
+        Entry.create(name='Ann', task='Plan', spent_minutes=5, notes='',
+                     timestamp=datetime.datetime(2016, 4, 2, 9, 30))
+        for group_by in (['employee'], ['task', 'day'], ['month', 'week'],
+                         []):
+            expected = reports.time_report(group_by,
+                                           datetime.date(2016, 3, 2))
+            # One process and several give the same totals as the rollup
+            for workers in (1, 2):
+                self.assertEqual(reports.sharded_time_report(
+                    group_by, datetime.date(2016, 3, 2), workers=workers,
+                    shards=4), expected)
+        days = reports.sharded_time_report(['day'], workers=2)
+        self.assertEqual(days, reports.time_report(['day']))
+        self.assertEqual(days[:2], [(datetime.date(2016, 3, 1), 60, 2),
+                                    (datetime.date(2016, 3, 2), 30, 1)])
+        self.assertEqual(reports.sharded_time_report(
+            ['employee'], employee='Nobody', workers=1), [])
+        self.assertEqual(reports.sharded_histogram(60, 3, workers=2),
+                         worklog_db.minutes_histogram(bucket_minutes=60,
+                                                      buckets=3))
+
+    @unittest.skipIf(analytics is None, "numpy is not installed")
+    def test_analytics_match_reports(self):
+        self.add_export_entries()
+        Entry.create(name='Beth', task='Deploy', spent_minutes=600, notes='',
+                     timestamp=datetime.datetime(2016, 1, 3, 9, 30))
+        for day in range(1, 15):
+            Entry.create(name='May', task='Plan', spent_minutes=day,
+                         notes='', timestamp=datetime.date(2017, 1, day))
+        columns = analytics.EntryColumns.load()
+        self.assertEqual(len(columns), 18)
+        self.assertEqual(columns.nbytes, 18 * 24)
+        for group_by in (['employee'], ['task', 'day'], ['week'],
+                         ['employee', 'month'], []):
+            self.assertEqual(columns.totals(group_by),
+                             reports.time_report(group_by))
+        self.assertEqual(columns.totals(['year']), [(2016, 690, 4),
+                                                    (2017, 105, 14)])
+        minutes = [entry.spent_minutes for entry in Entry.select()]
+        self.assertEqual(columns.percentiles([10, 50, 99]),
+                         [tuple(analytics.numpy.percentile(minutes,
+                                                           [10, 50, 99]))])
+        self.assertEqual(columns.percentiles([50], ['employee']),
+                         [('Beth', 30.0), ('May', 8.0)])
+        self.assertEqual(columns.histogram([0, 10, 60, 600], ['employee']),
+                         [('Beth', [0, 2, 1]), ('May', [9, 6, 0])])
+        self.assertEqual(
+            [Entry.get_by_id(entry_id).spent_minutes
+             for entry_id in columns.outliers(['employee'])], [45])
+        beth = columns.where(columns.employees == Employee.intern('Beth'))
+        self.assertEqual(beth.totals(), [(645, 3)])
+        march = analytics.EntryColumns.load(worklog_db.filter_entries(
+            start_date=datetime.date(2016, 3, 1),
+            end_date=datetime.date(2016, 3, 31)))
+        self.assertEqual(march.totals(['task']), [('Deploy', 75, 2),
+                                                  ('Review', 15, 1)])
+        self.assertEqual(analytics.EntryColumns.load(
+            worklog_db.filter_entries(employee='nobody')).percentiles([50]),
+            [])
+
+    def test_lookup_cache_invalidation(self):
+        cache = LookupCache(size=10, ttl=60)
+        self.addCleanup(cache.clear)
+        beth = Entry.create(name='Beth', task='Deploy', spent_minutes=30,
+                            notes='', timestamp=datetime.date(2016, 3, 1))
+        Entry.create(name='May', task='Deploy', spent_minutes=45, notes='',
+                     timestamp=datetime.date(2016, 3, 1))
+        by_beth = worklog_db.filter_entries(employee='beth')
+        by_minutes = worklog_db.filter_entries(spent_minutes=45)
+        self.assertEqual(cache.ids(by_beth), [beth.id])
+        self.assertEqual(len(cache.ids(by_minutes)), 1)
+        self.assertEqual(cache.ids(by_beth), [beth.id])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        # The same lookup over another database is another result
+        self.assertNotEqual(cache.key(by_beth), cache.key(
+            by_beth.clone().bind(SqliteDatabase(':memory:'))))
+        with mock.patch('cache.lookup_cache', cache), \
+                mock.patch.object(test_db, 'execute_sql',
+                                  wraps=test_db.execute_sql) as execute:
+            # Neither lookup matches the new entry, which one statement
+            # checks for both
+            Entry.create(name='Josh', task='Plan', spent_minutes=5,
+                         notes='', timestamp=datetime.date(2016, 3, 1))
+            self.assertEqual(cache.invalidations, 0)
+            self.assertEqual(len([call for call in execute.call_args_list
+                                  if 'UNION ALL' in call[0][0]]), 1)
+            # Now matches by_beth
+            other_beth = Entry.create(name='Beth Smith', task='Plan',
+                                      spent_minutes=5, notes='')
+            self.assertEqual(cache.invalidations, 1)
+            self.assertEqual(cache.ids(by_beth), [beth.id, other_beth.id])
+            # An edit of a cached row drops only the lookups holding it
+            beth.spent_minutes = 45
+            beth.save()
+            self.assertEqual(cache.invalidations, 3)
+            self.assertEqual(len(cache.ids(by_minutes)), 2)
+            other_beth.delete_instance()
+            self.assertEqual(cache.ids(by_beth), [beth.id])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_lookup_cache_limits(self):
+        now = [0]
+        cache = LookupCache(size=1, ttl=10, max_ids=2,
+                            clock=lambda: now[0])
+        for minutes in (1, 1, 1, 2):
+            Entry.create(name='Beth', task='Deploy', spent_minutes=minutes,
+                         notes='')
+        self.assertIsNone(cache.ids(
+            worklog_db.filter_entries(spent_minutes=1)))
+        by_two = worklog_db.filter_entries(spent_minutes=2)
+        cache.ids(by_two)
+        cache.ids(by_two)
+        now[0] = 11
+        cache.ids(by_two)
+        cache.ids(worklog_db.filter_entries(employee='Beth'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 4,
+                                         'invalidations': 0, 'cached': 1})
+
+    @mock.patch('worklog_db.get_browse_input',
+                side_effect=['n', 'b', 'n', 'b'])
+    def test_browse_through_cached_search(self, _):
+        for count in range(1, 4):
+            Entry.create(name='Beth', task='Deploy', spent_minutes=10,
+                         notes=' '.join(['deploy'] * count))
+        hits = lookup_cache.hits
+        with mock.patch('worklog_db.print_entry') as mock_print:
+            worklog_db.browse_through(worklog_db.search_entries(
+                'deploy', snippets=True))
+            worklog_db.browse_through(worklog_db.search_entries(
+                'deploy', snippets=True))
+        shown = [call[0][0] for call in mock_print.call_args_list]
+        self.assertEqual([entry.id for entry in shown[:2]],
+                         [entry.id for entry in shown[2:]])
+        self.assertTrue(all(entry.snippet for entry in shown))
+        self.assertEqual(lookup_cache.hits, hits + 1)
+
     def test_creation(self):
         Entry.create(name='Josh', task='Fix bug', spent_minutes=20,
                      notes='fun')
@@ -231,21 +1035,23 @@ class WorklogTest(unittest.TestCase):
         self.assertEqual(entry.spent_minutes, 20)
         self.assertEqual(entry.notes, 'fun')
 
+    @mock.patch('worklog_db.find_by_substring')
     @mock.patch('worklog_db.find_by_search_term')
     @mock.patch('worklog_db.find_by_spent_minutes')
     @mock.patch('worklog_db.find_by_date_range')
     @mock.patch('worklog_db.find_by_date')
     @mock.patch('worklog_db.find_by_employee')
     @mock.patch('worklog_db.get_input', side_effect=['a', 'b', 'd', 'c',
-                                                     'd', 'e', 'q'])
+                                                     'd', 'e', 'f', 'q'])
     def test_lookup_entries(self, mock_get_input, mock_a, mock_b, mock_c,
-                            mock_d, mock_e):
+                            mock_d, mock_e, mock_f):
         worklog_db.lookup_entries()
         mock_a.assert_called_once_with()
         mock_b.assert_called_once_with()
         mock_c.assert_called_once_with()
         self.assertTrue(mock_d.call_count == 2)
         mock_e.assert_called_once_with()
+        mock_f.assert_called_once_with()
 
     @mock.patch('worklog_db.edit_notes')
     @mock.patch('worklog_db.edit_spent_minutes')
@@ -289,12 +1095,55 @@ class WorklogTest(unittest.TestCase):
         worklog_db.main()
         mock_b.assert_called_once_with()
 
-    @mock.patch('worklog_db.db.create_tables')
+    @mock.patch('worklog_db.get_schema_version', return_value=0)
+    @mock.patch('worklog_db.migrate')
     @mock.patch('worklog_db.db.connect')
-    def test_initalize(self, mock_connect, mock_create_tables):
+    def test_initalize(self, mock_connect, mock_migrate, mock_version):
         worklog_db.initialize()
         mock_connect.assert_called_once_with()
-        mock_create_tables.assert_called_once_with([Entry], safe=True)
+        mock_migrate.assert_called_once_with(worklog_db.db)
+        # A database already at the current version is not checked again
+        mock_version.return_value = migrations.SCHEMA_VERSION
+        worklog_db.initialize()
+        mock_migrate.assert_called_once_with(worklog_db.db)
+
+    def test_migrate_upgrades_legacy_database(self):
+        legacy_db = SqliteDatabase(':memory:')
+        legacy_db.execute_sql(
+            'CREATE TABLE "entry" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"name" VARCHAR(255) NOT NULL, "task" VARCHAR(255) NOT NULL, '
+            '"spent_minutes" INTEGER NOT NULL, "notes" TEXT NOT NULL, '
+            '"timestamp" DATE NOT NULL)')
+        legacy_db.execute_sql(
+            'INSERT INTO "entry" ("name", "task", "spent_minutes", '
+            '"notes", "timestamp") VALUES '
+            '(\'Jay\', \'a\', 5, \'\', \'2017-07-03 16:58:35.595088\'), '
+            '(\'Jay\', \'b\', 5, \'\', \'2017-07-03\')')
+        self.assertEqual(migrations.get_schema_version(legacy_db), 0)
+        version = migrations.migrate(legacy_db)
+        self.assertEqual(version, migrations.SCHEMA_VERSION)
+        self.assertEqual(migrations.get_schema_version(legacy_db),
+                         migrations.SCHEMA_VERSION)
+        index_names = set(index.name for index in
+                          legacy_db.get_indexes('entry'))
+        self.assertTrue({'entry_timestamp', 'entry_employee_id_timestamp',
+                         'entry_spent_minutes_timestamp'} <= index_names)
+        self.assertEqual(list(legacy_db.execute_sql(
+            'SELECT "employee"."name", "task"."name" FROM "entry" '
+            'JOIN "employee" ON "employee"."id" = "entry"."employee_id" '
+            'JOIN "task" ON "task"."id" = "entry"."task_id" '
+            'ORDER BY "entry"."id"')), [('Jay', 'a'), ('Jay', 'b')])
+        self.assertEqual(list(legacy_db.execute_sql(
+            'SELECT "rowid" FROM "entry_search" '
+            'WHERE "entry_search" MATCH \'b\'')), [(2,)])
+        self.assertEqual(list(legacy_db.execute_sql(
+            'SELECT "name", "entry_count" FROM "name_catalog"')), [('Jay', 2)])
+        self.assertEqual(list(legacy_db.execute_sql(
+            'SELECT "date", "entry_count" FROM "date_catalog"')),
+            [('2017-07-03', 2)])
+        # A second run has nothing left to do
+        self.assertEqual(migrations.migrate(legacy_db),
+                         migrations.SCHEMA_VERSION)
 
     @mock.patch('worklog_db.get_input', return_value="yo")
     def test_get_browse_input(self, _):
@@ -354,6 +1203,589 @@ class WorklogTest(unittest.TestCase):
     def test_get_task(self, _):
         self.assertEqual(worklog_db.get_task(), 'task')
 
+class ServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.service = service.WorklogService(
+            os.path.join(directory, 'service.db'),
+            pragmas=settings.load_pragmas(os.path.join(directory, 'none.ini'),
+                                          {}), max_readers=4)
+        self.addCleanup(self.service.close)
+        self.service.initialize()
+
+
+class ServiceTest(ServiceTestCase):
+    def test_add_edit_delete(self):
+        entry_id = self.service.add_entry('Beth', 'Deploy', '30',
+                                          timestamp='03/01/2016')
+        entry = self.service.get_entry(entry_id)
+        self.assertEqual((entry.name, entry.spent_minutes, entry.timestamp),
+                         ('Beth', 30, datetime.date(2016, 3, 1)))
+        self.assertTrue(self.service.edit_entry(entry_id, task='Review',
+                                                spent_minutes=45))
+        self.assertEqual(
+            [entry.task for entry in self.service.find_by_employee('Beth')],
+            ['Review'])
+        self.assertEqual(self.service.employee_names(), ['Beth'])
+        self.assertEqual(self.service.entry_dates(),
+                         [datetime.date(2016, 3, 1)])
+        self.assertTrue(self.service.delete_entry(entry_id))
+        self.assertFalse(self.service.delete_entry(entry_id))
+        self.assertIsNone(self.service.get_entry(entry_id))
+
+    def test_invalid_values(self):
+        with self.assertRaises(ValueError):
+            self.service.add_entry(' ', 'Deploy', 30)
+        with self.assertRaises(ValueError):
+            self.service.add_entry('Beth', 'Deploy', -1)
+        with self.assertRaises(ValueError):
+            self.service.edit_entry(1, id=5)
+        for values in (dict(name=None), dict(name=['x']), dict(task=5),
+                       dict(notes={'a': 1}), dict(notes=None),
+                       dict(spent_minutes=1.9), dict(spent_minutes=True),
+                       dict(spent_minutes=None), dict(spent_minutes=' -0'),
+                       dict(timestamp=5), dict(timestamp=None)):
+            with self.assertRaises(ValueError):
+                service.clean_values(**values)
+        self.assertEqual(service.clean_values(
+            name=' Beth ', task='Deploy', spent_minutes=' 30 ', notes='',
+            timestamp='2016-03-01'), dict(
+                name='Beth', task='Deploy', spent_minutes=30, notes='',
+                timestamp=datetime.date(2016, 3, 1)))
+
+    def test_matching_names(self):
+        for name in ('Beth', 'Beth Smith', 'Bethany', 'Elizabeth', 'Bob',
+                     'Ann Beth', 'Gone'):
+            self.service.add_entry(name, 'Task', 5)
+        self.service.delete_entry(
+            self.service.find_by_employee('Gone')[0].id)
+        # The names holding the whole word come before the longer ones
+        self.assertEqual(self.service.matching_names('Beth'),
+                         ['Beth', 'Ann Beth', 'Beth Smith', 'Bethany',
+                          'Elizabeth'])
+        self.assertEqual(self.service.matching_names('Bteh')[0], 'Beth')
+        self.assertEqual(self.service.matching_names('bteh smtih'),
+                         ['Beth Smith'])
+        self.assertEqual(self.service.matching_names('Beth', limit=2),
+                         ['Beth', 'Ann Beth'])
+        self.assertEqual(self.service.matching_names('Gone'), [])
+        self.service.add_entry('Zed Bethel', 'Task', 5)
+        self.assertIn('Zed Bethel', self.service.matching_names('Beth'))
+        # Names left without entries do not take the places of others
+        for name in ('Beth', 'Ann Beth'):
+            self.service.delete_entry(
+                self.service.find_by_employee(name)[0].id)
+        self.assertEqual(self.service.matching_names('Beth', limit=1),
+                         ['Beth Smith'])
+
+    def test_concurrent_readers_and_writers(self):
+        writers, readers, per_thread = 4, 8, 50
+        errors = []
+
+        def write(number):
+            try:
+                for index in range(per_thread):
+                    self.service.add_entry(
+                        'writer {}'.format(number), 'Task', index,
+                        notes='stress note {}'.format(index),
+                        timestamp=datetime.date(2016, 1, 1 + index % 28))
+            except Exception as error:
+                errors.append(error)
+
+        def read():
+            try:
+                for index in range(per_thread):
+                    self.service.find_by_date(
+                        datetime.date(2016, 1, 1 + index % 28))
+                    self.service.find_by_search_term('stress', limit=10)
+                    self.service.employee_names()
+            except Exception as error:
+                errors.append(error)
+
+        threads = ([threading.Thread(target=write, args=(number,))
+                    for number in range(writers)] +
+                   [threading.Thread(target=read) for _ in range(readers)])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.service.find_entries()),
+                         writers * per_thread)
+        self.assertEqual(len(self.service.employee_names()), writers)
+        self.assertEqual(len(self.service.find_by_search_term('stress')),
+                         writers * per_thread)
+
+
+class BufferedWriterTest(ServiceTestCase):
+    def writer(self, **kwargs):
+        writer = writebuffer.BufferedWriter(self.service, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_batch_is_one_transaction(self):
+        writer = self.writer(batch_size=5, max_delay=60)
+        with mock.patch.object(self.service, 'add_entries',
+                               wraps=self.service.add_entries) as add:
+            futures = [writer.submit('Beth', 'Task', minutes)
+                       for minutes in range(10)]
+            ids = [future.result(5) for future in futures]
+        self.assertEqual(add.call_count, 2)
+        self.assertEqual([entry.spent_minutes for entry in
+                          map(self.service.get_entry, ids)], list(range(10)))
+
+    def test_time_limit_and_callback(self):
+        writer = self.writer(batch_size=100, max_delay=0.01)
+        committed = threading.Event()
+        future = writer.submit('Beth', 'Task', 5,
+                               callback=lambda future: committed.set())
+        self.assertTrue(committed.wait(5))
+        self.assertEqual(self.service.get_entry(future.result()).name, 'Beth')
+
+    def test_invalid_entry_is_rejected_at_once(self):
+        writer = self.writer()
+        with self.assertRaises(ValueError):
+            writer.submit('Beth', 'Task', -5)
+        with self.assertRaises(ValueError):
+            writer.submit(' ', 'Task', 5)
+
+    def test_close_writes_pending_entries(self):
+        writer = self.writer(batch_size=100, max_delay=60)
+        futures = [writer.submit('Beth', 'Task', 5) for _ in range(3)]
+        writer.close()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(self.service.find_by_employee('Beth')), 3)
+        with self.assertRaises(RuntimeError):
+            writer.submit('Beth', 'Task', 5)
+
+
+class BenchmarkTest(ServiceTestCase):
+    def test_generator_is_reproducible(self):
+        entries = list(benchmark.generate_entries(2000, seed=7))
+        self.assertEqual(entries, list(benchmark.generate_entries(2000, 7)))
+        self.assertNotEqual(entries,
+                            list(benchmark.generate_entries(2000, 8)))
+        names, tasks = benchmark.cardinalities(2000)
+        self.assertLessEqual(len({entry['name'] for entry in entries}), names)
+        self.assertLessEqual(len({entry['task'] for entry in entries}), tasks)
+        self.assertEqual(len(benchmark.vocabulary(
+            (benchmark.VERBS, benchmark.OBJECTS), 500, random.Random(1))),
+            500)
+
+    def test_run_and_compare(self):
+        self.assertTrue(benchmark.populate(self.service, 300, seed=3))
+        self.assertFalse(benchmark.populate(self.service, 300, seed=3))
+        results = benchmark.run(self.service, 300, seed=3, repeat=2)
+        self.assertEqual(len(self.service.find_entries()), 300)
+        self.assertTrue({'find_by_employee', 'find_by_date',
+                         'find_by_date_range', 'find_by_spent_minutes',
+                         'find_by_search_term', 'add_entry', 'edit_entry',
+                         'delete_entry'} <= set(results['results']))
+        self.assertGreater(results['results']['find_by_employee']['rows'], 0)
+        json.dumps(results)
+        slower = json.loads(json.dumps(results))
+        slower['results']['find_by_date']['median'] *= 2
+        self.assertEqual(benchmark.compare(results, results), [])
+        self.assertEqual([name for name, _, _ in
+                          benchmark.compare(results, slower)],
+                         ['find_by_date'])
+
+
+class ArchiveTest(ServiceTestCase):
+    def archive(self, cutoff):
+        with self.service.write_lock, \
+                self.service.write_db.connection_context():
+            return archive.archive_entries(self.service.write_db, cutoff)
+
+    def test_archive_and_include_archive_in_lookups(self):
+        for year in (2015, 2016, 2017):
+            self.service.add_entry('Beth', 'Deploy', year - 2000,
+                                   notes='deploy {}'.format(year),
+                                   timestamp=datetime.date(year, 6, 1))
+        self.service.add_entry('May', 'Plan', 5,
+                               timestamp=datetime.date(2016, 1, 1))
+        archive_range = self.archive(datetime.date(2017, 1, 1))
+        self.assertEqual((archive_range.first_date, archive_range.last_date,
+                          archive_range.entry_count),
+                         (datetime.date(2015, 6, 1),
+                          datetime.date(2016, 6, 1), 3))
+        path = os.path.join(os.path.dirname(self.service.write_db.database),
+                            archive_range.path)
+        self.assertTrue(path.endswith('.db.gz'))
+        self.assertFalse(os.stat(path).st_mode & 0o222)
+        self.assertIsNone(self.archive(datetime.date(2017, 1, 1)))
+        self.assertEqual([entry.spent_minutes for entry in
+                          self.service.find_entries()], [17])
+        self.assertEqual(self.service.employee_names(), ['Beth'])
+        self.assertEqual(
+            sorted(entry.spent_minutes for entry in
+                   self.service.find_entries(include_archive=True)),
+            [5, 15, 16, 17])
+        self.assertEqual(
+            [entry.spent_minutes for entry in self.service.find_entries(
+                include_archive=True, search_term='deploy',
+                end_date=datetime.date(2015, 12, 31))], [15])
+        self.assertEqual(len(self.service.find_entries(
+            limit=2, include_archive=True)), 2)
+        with self.service.read_db.connection_context():
+            self.assertEqual(archive.archived_ranges(
+                self.service.read_db, start_date=datetime.date(2017, 1, 1)),
+                [])
+            self.assertEqual(len(archive.archived_ranges(
+                self.service.read_db, date=datetime.date(2016, 6, 1))), 1)
+
+    def test_compact(self):
+        self.service.add_entries([dict(name='Beth', task='Task',
+                                       spent_minutes=1, notes='x' * 2000,
+                                       timestamp=datetime.date(2015, 1, 1))
+                                  for _ in range(200)])
+        self.archive(datetime.date(2016, 1, 1))
+        database = self.service.write_db
+        with database.connection_context():
+            pages = database.execute_sql('PRAGMA page_count').fetchone()[0]
+            self.assertGreater(archive.compact(database, pages=16, pause=0),
+                               50)
+            self.assertEqual(database.execute_sql(
+                'PRAGMA freelist_count').fetchone()[0], 0)
+            self.assertLess(database.execute_sql(
+                'PRAGMA page_count').fetchone()[0], pages)
+        plain_db = SqliteDatabase(os.path.join(
+            os.path.dirname(database.database), 'plain.db'))
+        with plain_db.connection_context():
+            plain_db.execute_sql('CREATE TABLE t (x)')
+            archive.compact(plain_db)
+            self.assertEqual(plain_db.execute_sql(
+                'PRAGMA auto_vacuum').fetchone()[0], archive.INCREMENTAL)
+
+
+class PartitionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pragmas = settings.load_pragmas(
+            os.path.join(self.directory, 'none.ini'), {})
+        self.worklog = self.open()
+
+    def open(self):
+        worklog = partitions.PartitionedWorklog(
+            os.path.join(self.directory, 'log'), pragmas=self.pragmas,
+            max_readers=2)
+        self.addCleanup(worklog.close)
+        worklog.initialize()
+        return worklog
+
+    def add_entries(self):
+        return self.worklog.add_entries([
+            dict(name='Beth', task='Deploy', spent_minutes=30,
+                 notes='deploy the api', timestamp='12/31/2015'),
+            dict(name='May', task='Review', spent_minutes=15,
+                 notes='deploy review', timestamp='01/02/2016'),
+            dict(name='Beth', task='Plan', spent_minutes=45,
+                 notes='', timestamp='2017-03-01'),
+            dict(name='Beth', task='Deploy', spent_minutes=10,
+                 notes='deploy again', timestamp='2016-01-01'),
+        ])
+
+    def test_entries_go_to_the_partition_of_their_year(self):
+        ids = self.add_entries()
+        self.assertEqual(partitions.partition_years(self.worklog.directory),
+                         [2015, 2016, 2017])
+        self.assertEqual([partitions.split_id(entry_id)[0]
+                          for entry_id in ids], [2015, 2016, 2017, 2016])
+        entry = self.worklog.get_entry(ids[2])
+        self.assertEqual((entry.id, entry.task), (ids[2], 'Plan'))
+        self.assertIsNone(self.worklog.get_entry(2014 * partitions.ID_SPAN))
+        self.assertEqual(self.worklog.employee_names(), ['Beth', 'May'])
+        self.assertEqual(self.worklog.entry_dates(),
+                         [datetime.date(2015, 12, 31),
+                          datetime.date(2016, 1, 1),
+                          datetime.date(2016, 1, 2),
+                          datetime.date(2017, 3, 1)])
+
+    @unittest.skipIf(analytics is None, "numpy is not installed")
+    def test_analytics_load_from_the_query_database(self):
+        self.add_entries()
+        partition = self.worklog.partition(2016)
+        columns = analytics.EntryColumns.load(
+            worklog_db.filter_entries().bind(partition.read_db))
+        # The partition's entries and names, not those of test.db
+        self.assertEqual(columns.totals(['employee']), [('Beth', 10, 1),
+                                                        ('May', 15, 1)])
+
+    def test_date_lookups_open_only_overlapping_partitions(self):
+        ids = self.add_entries()
+        worklog = self.open()
+        self.assertEqual(worklog.partitions, {})
+        self.assertEqual(
+            [entry.id for entry in worklog.find_by_date_range(
+                datetime.date(2015, 12, 1), datetime.date(2016, 1, 1))],
+            [ids[0], ids[3]])
+        self.assertEqual(sorted(worklog.partitions), [2015, 2016])
+        self.assertEqual(len(worklog.find_by_date(datetime.date(2018, 1, 1))),
+                         0)
+        self.assertEqual(sorted(worklog.partitions), [2015, 2016])
+
+    def test_lookups_merge_across_partitions(self):
+        ids = self.add_entries()
+        self.assertEqual([entry.id for entry in
+                          self.worklog.find_by_employee('Beth')],
+                         [ids[0], ids[3], ids[2]])
+        self.assertEqual(
+            sorted(entry.id for entry in
+                   self.worklog.find_by_search_term('deploy')),
+            sorted([ids[0], ids[1], ids[3]]))
+        self.assertEqual(len(self.worklog.find_by_search_term('deploy',
+                                                              limit=2)), 2)
+        seen, after = [], None
+        while True:
+            page, after = self.worklog.find_page(after=after, page_size=1)
+            seen.extend(entry.id for entry in page)
+            if after is None:
+                break
+        self.assertEqual(seen, [ids[0], ids[3], ids[1], ids[2]])
+
+    def test_edit_into_another_year_moves_the_entry(self):
+        ids = self.add_entries()
+        self.assertEqual(self.worklog.edit_entry(ids[1], spent_minutes=20),
+                         ids[1])
+        new_id = self.worklog.edit_entry(ids[1], timestamp='2017-05-01',
+                                         task='Retro')
+        self.assertEqual(partitions.split_id(new_id)[0], 2017)
+        self.assertIsNone(self.worklog.get_entry(ids[1]))
+        moved = self.worklog.get_entry(new_id)
+        self.assertEqual((moved.name, moved.task, moved.spent_minutes),
+                         ('May', 'Retro', 20))
+        self.assertIsNone(self.worklog.edit_entry(ids[1], notes='gone'))
+        with self.assertRaises(ValueError):
+            self.worklog.edit_entry(new_id, id=5)
+        self.assertTrue(self.worklog.delete_entry(new_id))
+        self.assertFalse(self.worklog.delete_entry(new_id))
+        self.assertEqual(self.worklog.employee_names(), ['Beth'])
+
+    def test_split_a_work_log(self):
+        source = service.WorklogService(
+            os.path.join(self.directory, 'source.db'), pragmas=self.pragmas)
+        self.addCleanup(source.close)
+        source.initialize()
+        for year in (2015, 2016, 2016):
+            source.add_entry('Beth', 'Task', year - 2000,
+                             timestamp=datetime.date(year, 6, 1))
+        directory = os.path.join(self.directory, 'split')
+        self.assertEqual(partitions.split(source.write_db.database,
+                                          directory), 3)
+        worklog = partitions.PartitionedWorklog(directory,
+                                                pragmas=self.pragmas)
+        self.addCleanup(worklog.close)
+        self.assertEqual(
+            [entry.spent_minutes for entry in worklog.find_entries()],
+            [15, 16, 16])
+        self.assertEqual(partitions.partition_years(directory), [2015, 2016])
+
+    def test_split_refuses_an_out_of_date_work_log(self):
+        path = os.path.join(self.directory, 'old.db')
+        old_db = SqliteDatabase(path)
+        old_db.execute_sql('CREATE TABLE "entry" ("id" INTEGER PRIMARY KEY)')
+        old_db.close()
+        directory = os.path.join(self.directory, 'split')
+        with self.assertRaises(ValueError):
+            partitions.split(path, directory)
+        with self.assertRaises(ValueError):
+            partitions.split(os.path.join(self.directory, 'none.db'),
+                             directory)
+        # Neither the source nor the partitions were touched
+        self.assertEqual(old_db.execute_sql(
+            'PRAGMA user_version').fetchone()[0], 0)
+        old_db.close()
+        self.assertFalse(os.path.exists(directory))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'none.db')))
+
+
+class APITest(ServiceTestCase):
+    async def request(self, port, method, path, payload=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        body = json.dumps(payload).encode() if payload is not None else b''
+        writer.write('{} {} HTTP/1.1\r\nContent-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(
+                         method, path, len(body)).encode() + body)
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body.decode())
+
+    def run_api(self, scenario):
+        async def main():
+            worklog_api = api.WorklogAPI(self.service, max_workers=4)
+            server = await worklog_api.serve('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await scenario(port)
+            finally:
+                server.close()
+                await server.wait_closed()
+                worklog_api.close()
+        return asyncio.run(main())
+
+    def test_entry_routes(self):
+        async def scenario(port):
+            status, created = await self.request(port, 'POST', '/entries', {
+                'name': 'Beth', 'task': 'Deploy', 'spent_minutes': 30,
+                'notes': 'went fine', 'timestamp': '2016-03-01'})
+            self.assertEqual(status, 201)
+            path = '/entries/{}'.format(created['id'])
+            status, entry = await self.request(port, 'PATCH', path,
+                                               {'spent_minutes': 45})
+            self.assertEqual((status, entry['spent_minutes']), (200, 45))
+            status, _ = await self.request(port, 'POST', '/entries',
+                                           {'name': 'Beth'})
+            self.assertEqual(status, 400)
+            status, found = await self.request(
+                port, 'GET', '/entries?search=fine&employee=Beth')
+            self.assertEqual([entry['id'] for entry in found['entries']],
+                             [created['id']])
+            status, names = await self.request(port, 'GET', '/employees')
+            self.assertEqual(names, {'employees': ['Beth']})
+            status, _ = await self.request(port, 'DELETE', path)
+            self.assertEqual(status, 200)
+            status, _ = await self.request(port, 'GET', path)
+            self.assertEqual(status, 404)
+        self.run_api(scenario)
+
+    def test_entry_routes_reject_values_of_the_wrong_type(self):
+        fields = {'name': 'Beth', 'task': 'Deploy', 'spent_minutes': 30,
+                  'notes': '', 'timestamp': '2016-03-01'}
+        bad_values = [('name', None), ('name', ['x']), ('task', 5),
+                      ('notes', {'a': 1}), ('notes', None),
+                      ('spent_minutes', 1.9), ('spent_minutes', None),
+                      ('spent_minutes', True), ('timestamp', 5),
+                      ('timestamp', 20.5)]
+
+        async def scenario(port):
+            statuses = []
+            for field, value in bad_values:
+                status, _ = await self.request(port, 'POST', '/entries',
+                                               dict(fields, **{field: value}))
+                statuses.append(status)
+            status, created = await self.request(port, 'POST', '/entries',
+                                                 fields)
+            path = '/entries/{}'.format(created['id'])
+            for field, value in bad_values + [('timestamp', None)]:
+                status, _ = await self.request(port, 'PATCH', path,
+                                               {field: value})
+                statuses.append(status)
+            status, found = await self.request(port, 'GET', '/entries')
+            return statuses, status, found['entries']
+        statuses, status, entries = self.run_api(scenario)
+        self.assertEqual(statuses, [400] * (len(bad_values) * 2 + 1))
+        # Only the valid entry was stored, and as it was posted
+        self.assertEqual(status, 200)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(
+            {field: entries[0][field] for field in fields},
+            dict(fields, timestamp='2016-03-01'))
+
+    def test_histogram_route(self):
+        for minutes in (10, 20, 50, 70):
+            self.service.add_entry('Beth', 'Task', minutes,
+                                   timestamp=datetime.date(2016, 3, 1))
+
+        async def scenario(port):
+            status, histogram = await self.request(
+                port, 'GET', '/histogram?bucket_minutes=30&buckets=2'
+                             '&min_minutes=20')
+            self.assertEqual(status, 200)
+            self.assertEqual(histogram['buckets'], [
+                {'low': 0, 'high': 29, 'entries': 1, 'minutes': 20},
+                {'low': 30, 'high': None, 'entries': 2, 'minutes': 120}])
+            status, found = await self.request(
+                port, 'GET', '/entries?min_minutes=20&max_minutes=50')
+            self.assertEqual([entry['spent_minutes']
+                              for entry in found['entries']], [20, 50])
+            status, _ = await self.request(port, 'GET',
+                                           '/histogram?buckets=0')
+            self.assertEqual(status, 400)
+        self.run_api(scenario)
+
+    def test_explain_route(self):
+        self.service.add_entry('Beth', 'Deploy', 30,
+                               timestamp=datetime.date(2016, 3, 1))
+
+        async def scenario(port):
+            status, explained = await self.request(
+                port, 'GET', '/explain?employee=Beth&min_minutes=20')
+            self.assertEqual(status, 200)
+            self.assertEqual(explained['plan'][:3], [
+                'employee  ~1 entries', 'minutes   ~1 entries',
+                'Find entries by employee through '
+                'entry_employee_id_timestamp'])
+        self.run_api(scenario)
+
+    def test_entry_pages(self):
+        for day in range(1, 8):
+            self.service.add_entry('Beth', 'Task', day,
+                                   timestamp=datetime.date(2016, 3, day))
+
+        async def scenario(port):
+            minutes = []
+            path = '/entries?limit=3'
+            while path:
+                status, page = await self.request(port, 'GET', path)
+                self.assertLessEqual(len(page['entries']), 3)
+                minutes.extend(entry['spent_minutes']
+                               for entry in page['entries'])
+                path = page['next'] and '/entries?limit=3&after={}'.format(
+                    page['next'])
+            return minutes
+        self.assertEqual(self.run_api(scenario), list(range(1, 8)))
+
+    def test_invalid_after_tokens(self):
+        self.service.add_entry('Beth', 'Task', 5)
+
+        def token(text):
+            return base64.urlsafe_b64encode(text.encode()).decode()
+
+        async def scenario(port):
+            statuses = []
+            for after in ('%%%', token('{not json'), token('5'),
+                          token('"2016-03-01"'), token('{"a": 1}'),
+                          token('[1]'), token('["2016-03-01", 1, 2]'),
+                          token('["2016-03-01", "1"]'),
+                          token('[["2016-03-01"], 1]'),
+                          token('[null, 1]'), token('[true, 1]')):
+                status, body = await self.request(
+                    port, 'GET', '/entries?after=' + after)
+                statuses.append((status, body))
+            statuses.append(await self.request(
+                port, 'GET', '/entries?search=Task&mode=regex'))
+            return statuses
+        *tokens, (status, body) = self.run_api(scenario)
+        self.assertEqual(tokens, [(400, {'error': "Invalid after token"})] *
+                         len(tokens))
+        self.assertEqual((status, body['error']),
+                         (400, "Invalid filter value"))
+
+    def test_stats_route(self):
+        async def scenario(port):
+            await self.request(port, 'GET', '/employees')
+            return await self.request(port, 'GET', '/stats')
+        status, stats = self.run_api(scenario)
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(
+            stats['queries']['service.employee_names']['count'], 1)
+
+    def test_load_harness(self):
+        self.service.add_entry('Beth', 'Task', 5)
+
+        async def scenario(port):
+            return await loadtest.run('127.0.0.1', port,
+                                      loadtest.DEFAULT_PATHS, 4, 0.2)
+        result = self.run_api(scenario)
+        self.assertGreater(result.requests, 0)
+        self.assertEqual(result.errors, 0)
+        self.assertLessEqual(result.percentile(50), result.percentile(99))
+
+
 if __name__ == '__main__':
     test_db.connect()
     unittest.main()
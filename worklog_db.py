@@ -23,24 +23,49 @@
 # If multiple employees share a name (e.g. multiple people with the first name Beth), a list of possible matches is given.
 # Records are displayed one at a time with the ability to page through records (previous/next/back).
 # As a fellow developer of the script, I should see test coverage of 85% of the code or better.
-import os
 from collections import OrderedDict
+import re
 import sys
 import datetime
 
-from entry import db, Entry
+from peewee import JOIN, OP, Expression, NodeList, SQL, fn
+from entry import (db, Entry, NameCatalog, DateCatalog, MinutesCatalog,
+                   EntrySearch, select_entries)
+from cache import lookup_cache
+from cursor import EntryCursor, IdCursor
+from instrumentation import operation
+from migrations import migrate, get_schema_version, SCHEMA_VERSION
+from names import name_index
+import planner
 
 
 ##########################################################
 # Utilities
 ##########################################################
+# Cursor home and erase display, written instead of running clear, which
+# started a process on every screen
+CLEAR_SCREEN = '\033[H\033[2J'
+# The filters of filter_entries that SQLite can find entries through: the
+# employee_id, timestamp and spent_minutes indexes and the full-text index
+FILTER_INDEXES = ('employee', 'date', 'minutes', 'search')
+# Buckets of the minutes spent histogram shown by find_by_spent_minutes
+HISTOGRAM_BUCKET_MINUTES = 30
+HISTOGRAM_BUCKETS = 9
+HISTOGRAM_WIDTH = 40
+
+
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if sys.stdout.isatty():
+        sys.stdout.write(CLEAR_SCREEN)
+        sys.stdout.flush()
 
 
 def initialize():
     db.connect()
-    db.create_tables([Entry], safe=True)
+    # The migrations build the whole schema, so a database already at the
+    # current version needs no further checks
+    if get_schema_version(db) != SCHEMA_VERSION:
+        migrate(db)
     # test_name = 'John Lennon'
     # test_task = 'Write a new song'
     # test_spent_minutes = 10
@@ -52,20 +77,50 @@ def initialize():
 ########################################################
 # Input functions
 ########################################################
+def is_valid_text(text):
+    """Names and tasks need at least one non-whitespace character"""
+    return bool(text.strip())
+
+
+def parse_spent_minutes(spent_minutes):
+    """Parse minutes spent; raises ValueError if it is not a whole number
+    and AssertionError if it is negative"""
+    spent_minutes = int(spent_minutes)
+    assert spent_minutes >= 0
+    return spent_minutes
+
+
 def get_name():
     while True:
         name = input("Enter name: ").strip()
-        if not name.isspace():
+        if is_valid_text(name):
             return name
 
 
 def get_task():
     while True:
         task = input("Enter task name: ").strip()
-        if not task.isspace():
+        if is_valid_text(task):
             return task
 
 
+def parse_minutes_range(text):
+    """Parse minutes spent, or a range of them: 30-60, 240- for at least
+    240 or -15 for at most 15. Returns (low, high), None for an open end;
+    raises ValueError if it is malformed and AssertionError if a bound is
+    negative or the range is empty"""
+    low, dash, high = text.strip().partition('-')
+    if not dash:
+        minutes = parse_spent_minutes(low)
+        return minutes, minutes
+    if not low.strip() and not high.strip():
+        raise ValueError("A range needs at least one bound")
+    low = parse_spent_minutes(low) if low.strip() else None
+    high = parse_spent_minutes(high) if high.strip() else None
+    assert low is None or high is None or low <= high
+    return low, high
+
+
 def get_spent_minutes_string():
     return input("Enter time spent in (rounded) minutes: ").strip()
 
@@ -73,9 +128,7 @@ def get_spent_minutes_string():
 def get_spent_minutes():
     while True:
         try:
-            spent_minutes = get_spent_minutes_string()
-            spent_minutes = int(spent_minutes)
-            assert spent_minutes >= 0
+            spent_minutes = parse_spent_minutes(get_spent_minutes_string())
         except ValueError:
             print("Invalid minutes entered. Please enter again")
         except AssertionError:
@@ -103,6 +156,7 @@ def enter_any_key():
 ########################################################
 # Utility functions
 ########################################################
+@operation
 def add_entry():
     """Add an entry"""
     clear_screen()
@@ -115,6 +169,18 @@ def add_entry():
                  notes=notes)
 
 
+def catalog_names():
+    """Distinct employee names, read from the maintained catalog"""
+    return [row.name for row in
+            NameCatalog.select(NameCatalog.name).order_by(NameCatalog.name)]
+
+
+def catalog_dates():
+    """Distinct entry dates, read from the maintained catalog"""
+    return [row.date for row in
+            DateCatalog.select(DateCatalog.date).order_by(DateCatalog.date)]
+
+
 def get_browse_input():
     print()
     print("[N]ext (Default), [P]revious, [E]dit, [D]elete, [B]ack")
@@ -129,6 +195,9 @@ def print_entry(entry):
     print("task: {}".format(entry.task))
     print("minutes spent: {}".format(entry.spent_minutes))
     print("notes: {}".format(entry.notes))
+    snippet = getattr(entry, 'snippet', None)
+    if snippet:
+        print("match: {}".format(snippet))
 ########################################################
 # End: Utility functions
 ########################################################
@@ -154,6 +223,7 @@ def edit_notes(entry):
     entry.notes = get_notes()
 
 
+@operation
 def edit_entry(entry):
     entry_attributes = OrderedDict([
         ('a', edit_name),
@@ -176,16 +246,19 @@ def edit_entry(entry):
 
 
 def browse_through(matched_entries):
-    if matched_entries:
-        index = 0
-        while index < len(matched_entries):
-            entry = matched_entries[index]
+    ids = lookup_cache.ids(matched_entries)
+    if ids is None:
+        entries = EntryCursor(matched_entries)
+    else:
+        entries = IdCursor(matched_entries, ids)
+    if entries:
+        while True:
+            entry = entries.current
             clear_screen()
             print_entry(entry)
             browse_option = get_browse_input()
             if browse_option == 'p':
-                if index > 0:
-                    index -= 1
+                entries.previous()
             elif browse_option == 'd':
                 entry.delete_instance()
                 break
@@ -195,80 +268,93 @@ def browse_through(matched_entries):
                     break
             elif browse_option == 'b':
                 break
-            else:
-                index +=1
+            elif not entries.next():
+                break
     else:
         print("No entries matched")
         enter_any_key()
 
 
+@operation
 def find_by_employee():
     """Find by employee name"""
     clear_screen()
     print("Employees to choose from:")
-    entries = Entry.select()
-    names = set([entry.name for entry in entries])
-    for name in sorted(names):
+    for name in catalog_names():
         print(name)
     print("Enter an employee name")
     print("Enter q to go back (Default)")
     name = get_input()
     if name == 'q':
         return None
-    matched_entries = entries.where(Entry.name.contains(name))
-    unique_names = set([entry.name for entry in matched_entries])
+    # Names like the one entered, best match first, so a misspelt name
+    # still finds its entries
+    unique_names = name_index.matches(name)
     if len(unique_names) > 1:
         print("Multiple matched names:")
         for name in unique_names:
             print(name)
         print('Enter a name')
         name = get_input()
-        matched_entries = entries.where(Entry.name == name)
+    elif unique_names:
+        name = unique_names[0]
+    matched_entries = filter_entries().where(Entry.name == name)
     browse_through(matched_entries)
     return matched_entries
 
 
+def timestamp_in_range(start_date, end_date):
+    """Match timestamps in the half-open range [start_date, end_date).
+
+    Compares the raw column, so the timestamp index can be used. Timestamps
+    are stored either as 'YYYY-MM-DD' or as a full datetime string, and both
+    sort between the two date bounds.
+    """
+    return (Entry.timestamp >= start_date) & (Entry.timestamp < end_date)
+
+
+def parse_date(date):
+    """Parse a date written as MM/DD/YYYY or YYYY-MM-DD"""
+    try:
+        return datetime.datetime.strptime(date, '%m/%d/%Y').date()
+    except ValueError:
+        return datetime.datetime.strptime(date, '%Y-%m-%d').date()
+
+
 def get_date():
     while True:
         date = get_input()
         if date.lower() == 'q':
             return None
         try:
-            date = datetime.datetime.strptime(date, '%m/%d/%Y').date()
-            return date
+            return parse_date(date)
         except ValueError:
             print("Invalid date. Please enter again.")
 
 
+@operation
 def find_by_date():
     """Find by date of entry"""
-    entries = Entry.select()
-    dates = set([entry.timestamp for entry in entries])
     clear_screen()
     print("Dates to choose from:")
-    for date in dates:
+    for date in catalog_dates():
         print(date.strftime('%m/%d/%Y'))
     print("Enter a date (MM/DD/YYYY)")
     print("Enter q to go back")
     date = get_date()
     if date is None:
         return
-    matched_entries = entries.where(
-        Entry.timestamp.year == date.year,
-        Entry.timestamp.month == date.month,
-        Entry.timestamp.day == date.day
-    )
+    matched_entries = filter_entries(date=date)
     browse_through(matched_entries)
     return matched_entries
 
 
+@operation
 def find_by_date_range():
     """Find by date range"""
-    entries = Entry.select()
-    dates = set([entry.timestamp for entry in entries])
     clear_screen()
     print("Dates to choose from:")
-    for date in dates:
+    for date in catalog_dates():
         print(date.strftime('%m/%d/%Y'))
     print("Enter a start date (MM/DD/YYYY)")
     print("Enter q to go back to main menu")
@@ -280,46 +366,286 @@ def find_by_date_range():
     end_date = get_date()
     if end_date is None:
         return
-    end_date += datetime.timedelta(days=1)
-    matched_entries = entries.where(Entry.timestamp.between(start_date,
-                                                            end_date))
+    matched_entries = filter_entries(start_date=start_date,
+                                     end_date=end_date)
     browse_through(matched_entries)
     return matched_entries
 
 
+@operation
 def find_by_spent_minutes():
     """Find by time spent on task"""
     clear_screen()
-    print("Enter time spent in minutes")
+    print("Entries by minutes spent:")
+    print_histogram(minutes_histogram())
+    print("Enter time spent in minutes, or a range: 30-60, 240- for at "
+          "least 240 or -15 for at most 15")
     print("Enter q to go back")
     while True:
-        spent_minutes = get_input()
-        if spent_minutes == 'q':
+        minutes_range = get_input()
+        if minutes_range == 'q':
             return None
         try:
-            spent_minutes = int(spent_minutes)
-            assert spent_minutes >= 0
+            low, high = parse_minutes_range(minutes_range)
         except ValueError:
             print("Invalid minutes. Please enter again.")
         except AssertionError:
-            print("Spent minutes must be positive. Please enter again.")
+            print("Spent minutes must be positive and the range not empty. "
+                  "Please enter again.")
         else:
-            matched_entries = Entry.select().where(Entry.spent_minutes ==
-                                                   int(spent_minutes))
+            if low == high:
+                matched_entries = filter_entries(spent_minutes=low)
+            else:
+                matched_entries = filter_entries(min_minutes=low,
+                                                 max_minutes=high)
             browse_through(matched_entries)
             return matched_entries
 
 
+FULL_TEXT_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def full_text_query(search_term):
+    """Translate a search term into an FTS5 query.
+
+    Bare words match whole words, a word ending in * matches as a prefix
+    and double-quoted words match as a phrase. Every part is quoted, so
+    punctuation in the term is never read as FTS5 syntax.
+    """
+    parts = []
+    for phrase, word in FULL_TEXT_TERM.findall(search_term):
+        prefix = word.endswith('*')
+        text = phrase or word.rstrip('*')
+        if not text.strip():
+            continue
+        parts.append('"{}"{}'.format(text.replace('"', '""'),
+                                     '*' if prefix else ''))
+    return ' '.join(parts)
+
+
+def search_entries(search_term, mode='match', snippets=False, names=True,
+                   driving=True):
+    """Select entries whose task or notes contain search_term.
+
+    The 'match' mode uses the full-text index and orders the entries by
+    bm25 relevance, best first. With snippets the entries also carry a
+    `snippet` attribute showing the matched text. The 'substring' mode
+    matches the term anywhere in task or notes, and is also used when the
+    term has no words to match. names=False leaves out the joins that read
+    the employee and task names along, as in filter_entries().
+
+    SQLite reads the entries matching the search first. With driving=False
+    the search is joined with CROSS JOIN, which SQLite never reorders, so
+    the entries are found through the other filters of the query and the
+    search only checks each of them.
+    """
+    select = select_entries if names else Entry.select
+    query = full_text_query(search_term) if mode == 'match' else ''
+    if not query:
+        return select().where(Entry.task.contains(search_term) |
+                              Entry.notes.contains(search_term))
+    columns = []
+    if snippets:
+        columns.append(fn.snippet(EntrySearch._meta.entity, -1, '[', ']',
+                                  '...', 10).alias('snippet'))
+    if driving:
+        query = (select(*columns)
+                 .join_from(Entry, EntrySearch,
+                            on=(EntrySearch.rowid == Entry.id))
+                 .where(EntrySearch.match(query)))
+    else:
+        query = (select(*columns)
+                 .join_from(Entry, EntrySearch, JOIN.CROSS)
+                 .where(EntrySearch.rowid == Entry.id,
+                        EntrySearch.match(query)))
+    return query.order_by(EntrySearch.bm25())
+
+
+def filter_entries(employee=None, date=None, start_date=None, end_date=None,
+                   spent_minutes=None, search_term=None, search_mode='match',
+                   min_minutes=None, max_minutes=None, names=True,
+                   use_index=None):
+    """Select the entries matching every filter that is given.
+
+    These are the filters of the find_by_* lookups: employee is matched as
+    part of the name, date as a single day, start_date and end_date as an
+    inclusive range that may be open at either end, min_minutes and
+    max_minutes likewise for the minutes spent, and search_term as in
+    search_entries(). The filters only read the entry table, so with
+    names=False the query leaves out the employee and task joins, for
+    queries that select other columns such as aggregates.
+
+    use_index names the one filter, of FILTER_INDEXES, whose index SQLite
+    must find the entries through; the others are then only checked on
+    each entry found (see planner.py). None leaves the choice to SQLite.
+    """
+    assert use_index is None or use_index in FILTER_INDEXES
+    if search_term is not None:
+        query = search_entries(search_term, mode=search_mode, names=names,
+                               driving=use_index in (None, 'search'))
+    elif names:
+        query = select_entries()
+    else:
+        query = Entry.select()
+    clauses = {}
+    if employee is not None:
+        clauses['employee'] = [Entry.name.contains(employee)]
+    if date is not None:
+        clauses.setdefault('date', []).append(timestamp_in_range(
+            date, date + datetime.timedelta(days=1)))
+    if start_date is not None:
+        clauses.setdefault('date', []).append(Entry.timestamp >= start_date)
+    if end_date is not None:
+        clauses.setdefault('date', []).append(
+            Entry.timestamp < end_date + datetime.timedelta(days=1))
+    # Ranges of minutes are read from the spent_minutes index, like the
+    # exact lookup
+    if spent_minutes is not None:
+        clauses.setdefault('minutes', []).append(
+            Entry.spent_minutes == spent_minutes)
+    if min_minutes is not None:
+        clauses.setdefault('minutes', []).append(
+            Entry.spent_minutes >= min_minutes)
+    if max_minutes is not None:
+        clauses.setdefault('minutes', []).append(
+            Entry.spent_minutes <= max_minutes)
+    where = []
+    for path, path_clauses in clauses.items():
+        if use_index not in (None, path):
+            path_clauses = [without_index(clause) for clause in path_clauses]
+        where.extend(path_clauses)
+    if use_index in ('employee', 'minutes') and not query._order_by:
+        # Otherwise SQLite may still walk the timestamp index to return the
+        # entries in date order without sorting them
+        query = query.order_by(unindexed(Entry.timestamp))
+    return query.where(*where) if where else query
+
+
+def unindexed(column):
+    """column written as +column, which SQLite never looks up or orders
+    through an index"""
+    return NodeList((SQL('+'), column), glue='')
+
+
+def without_index(clause):
+    """clause with its columns unindexed()"""
+    if clause.op in (OP.AND, OP.OR):
+        return Expression(without_index(clause.lhs), clause.op,
+                          without_index(clause.rhs))
+    return Expression(unindexed(clause.lhs), clause.op, clause.rhs)
+
+
+def minutes_histogram(query=None, bucket_minutes=HISTOGRAM_BUCKET_MINUTES,
+                      buckets=HISTOGRAM_BUCKETS):
+    """Count the entries matched by query, a filter_entries(names=False)
+    query, or every entry, by minutes spent, in one query.
+
+    Returns (low, high, entry count, total minutes) rows for the buckets
+    holding entries, in order. Each bucket spans bucket_minutes from low to
+    high inclusive, except the last of the buckets, whose high is None: it
+    holds every entry from its low up.
+    """
+    assert bucket_minutes > 0 and buckets > 0
+    if query is None:
+        # The minutes catalog already counts every entry by its minutes, in
+        # a row per distinct number of minutes
+        query = (MinutesCatalog
+                 .select(MinutesCatalog.spent_minutes,
+                         MinutesCatalog.entry_count,
+                         MinutesCatalog.spent_minutes *
+                         MinutesCatalog.entry_count)
+                 .order_by(MinutesCatalog.spent_minutes).tuples())
+    else:
+        # Grouped by the minutes themselves, the entries are counted in the
+        # order of the spent_minutes index without sorting them
+        query = (query
+                 .select(Entry.spent_minutes, fn.count(Entry.id),
+                         fn.sum(Entry.spent_minutes))
+                 .group_by(Entry.spent_minutes)
+                 .order_by(Entry.spent_minutes).tuples())
+    # The few rows that come back are added up into buckets here
+    totals = OrderedDict()
+    for minutes, count, total in query:
+        number = min(minutes // bucket_minutes, buckets - 1)
+        entries, spent = totals.get(number, (0, 0))
+        totals[number] = (entries + count, spent + total)
+    return [(number * bucket_minutes,
+             None if number == buckets - 1
+             else (number + 1) * bucket_minutes - 1, count, total)
+            for number, (count, total) in totals.items()]
+
+
+def print_histogram(rows, width=HISTOGRAM_WIDTH):
+    """Print minutes_histogram() rows with a bar for each count"""
+    if not rows:
+        print("No entries")
+        return
+    most = max(count for _, _, count, _ in rows)
+    for low, high, count, _ in rows:
+        span = '{}+'.format(low) if high is None else '{}-{}'.format(low,
+                                                                    high)
+        print('{:>9}  {:>7}  {}'.format(span, count,
+                                        '#' * -(-count * width // most)))
+
+
+@operation
 def find_by_search_term():
     """Find by a search term"""
     clear_screen()
     print("Enter search term")
+    print('Words match whole words, word* matches a prefix and '
+          '"quoted words" match a phrase')
+    search_term = get_input()
+    matched_entries = search_entries(search_term, snippets=True)
+    browse_through(matched_entries)
+    return matched_entries
+
+
+@operation
+def find_by_substring():
+    """Find by text within task or notes"""
+    clear_screen()
+    print("Enter text to look for")
+    search_term = get_input()
+    matched_entries = search_entries(search_term, mode='substring')
+    browse_through(matched_entries)
+    return matched_entries
+
+
+def get_optional(parse):
+    """Input read by parse, or None when nothing is entered"""
     while True:
-        search_term = get_input()
-        matched_entries = Entry.select().where(Entry.task.contains(
-            search_term) | Entry.notes.contains(search_term))
-        browse_through(matched_entries)
-        return matched_entries
+        text = get_input()
+        if not text:
+            return None
+        try:
+            return parse(text)
+        except (ValueError, AssertionError):
+            print("Invalid input. Please enter again, or nothing to skip.")
+
+
+@operation
+def find_by_several():
+    """Find by several criteria"""
+    clear_screen()
+    print("Enter nothing to skip a criterion")
+    print("Employee name, or part of it")
+    employee = get_input() or None
+    print("From date (MM/DD/YYYY)")
+    start_date = get_optional(parse_date)
+    print("To date (MM/DD/YYYY)")
+    end_date = get_optional(parse_date)
+    print("Time spent in minutes, or a range: 30-60, 240- or -15")
+    low, high = get_optional(parse_minutes_range) or (None, None)
+    print("Search term")
+    search_term = get_input() or None
+    # One query over every criterion, finding the entries through the
+    # one that matches the fewest
+    matched_entries = planner.plan_query(
+        employee=employee, start_date=start_date, end_date=end_date,
+        min_minutes=low, max_minutes=high, search_term=search_term).query
+    browse_through(matched_entries)
+    return matched_entries
 
 
 def lookup_entries():
@@ -329,7 +655,9 @@ def lookup_entries():
         ('b', find_by_date),
         ('c', find_by_date_range),
         ('d', find_by_spent_minutes),
-        ('e', find_by_search_term)
+        ('e', find_by_search_term),
+        ('f', find_by_substring),
+        ('g', find_by_several)
     ])
     while True:
         clear_screen()
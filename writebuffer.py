@@ -0,0 +1,136 @@
+#####################################################
+# Group-commit write buffer for new Work Log entries
+#####################################################
+# BufferedWriter collects entries submitted from any thread and adds them
+# through WorklogService.add_entries, one transaction per batch. A batch is
+# written once batch_size entries are waiting or max_delay seconds after
+# the first of them was submitted, whichever comes first, so a burst of
+# entries costs one commit instead of one per entry.
+#
+# Durability: submit() returns a Future that resolves to the entry id only
+# after the transaction holding the entry has committed. Entries still
+# waiting in the buffer are lost if the process dies; close() (also run at
+# interpreter exit) and flush() write them out. A committed entry survives
+# an application crash; with the default WAL journal and synchronous=NORMAL
+# the last commits may be rolled back by a power loss or OS crash, so set
+# WORKLOG_PRAGMA_SYNCHRONOUS=full where that matters.
+import atexit
+import datetime
+from concurrent.futures import Future
+import threading
+import time
+
+import service
+
+
+BATCH_SIZE = 500
+# Seconds the first entry of a batch may wait before the batch is written
+MAX_DELAY = 0.05
+
+
+class BufferedWriter(object):
+    def __init__(self, worklog, batch_size=BATCH_SIZE, max_delay=MAX_DELAY,
+                 clock=time.monotonic):
+        assert batch_size >= 1
+        self.worklog = worklog
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.pending = []
+        self.first_submitted = None
+        self.in_flight = 0
+        self.flushing = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='worklog-writer')
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, name, task, spent_minutes, notes='', timestamp=None,
+               callback=None):
+        """Queue an entry and return a Future of its id.
+
+        The values are checked at once, so a ValueError is raised here
+        rather than through the Future. callback, if given, is called with
+        the Future once the entry is committed or has failed.
+        """
+        values = service.clean_values(name=name, task=task,
+                                      spent_minutes=spent_minutes,
+                                      notes=notes,
+                                      timestamp=timestamp or
+                                      datetime.date.today())
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The writer is closed")
+            if not self.pending:
+                self.first_submitted = self.clock()
+            self.pending.append((values, future))
+            self.condition.notify_all()
+        return future
+
+    def flush(self):
+        """Wait until every entry submitted so far is committed"""
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                self.condition.wait_for(
+                    lambda: not self.pending and not self.in_flight)
+            finally:
+                self.flushing -= 1
+
+    def close(self):
+        """Write out the waiting entries and stop the writer thread"""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def _due(self):
+        return (self.closed or self.flushing or
+                len(self.pending) >= self.batch_size or
+                self.clock() - self.first_submitted >= self.max_delay)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending or not self._due():
+                    if self.closed and not self.pending:
+                        return
+                    timeout = None
+                    if self.pending:
+                        timeout = max(self.first_submitted + self.max_delay -
+                                      self.clock(), 0)
+                    self.condition.wait(timeout)
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                self.first_submitted = self.clock() if self.pending else None
+                self.in_flight += 1
+            try:
+                self._write(batch)
+            finally:
+                with self.condition:
+                    self.in_flight -= 1
+                    self.condition.notify_all()
+
+    def _write(self, batch):
+        batch = [(values, future) for values, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        futures = [future for _, future in batch]
+        try:
+            ids = self.worklog.add_entries([values for values, _ in batch])
+        except Exception as error:
+            for future in futures:
+                future.set_exception(error)
+        else:
+            for future, entry_id in zip(futures, ids):
+                future.set_result(entry_id)